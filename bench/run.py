@@ -0,0 +1,321 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+run.py
+
+Benchmarks for the pygsm HTTP API.  The WSGI app is built once and driven 
+in-process with falcon.testing against the database configured in 
+pygsm.cfg, so run this from the pygsm directory.  Use a dedicated database: --setup wipes it.
+
+    python -m bench.run --setup --scale small
+    python -m bench.run --scale small --save
+    python -m bench.run --scale small --compare
+
+Results are saved to and compared against bench/baselines/<scale>.json 
+unless a path is given.
+"""
+import os, sys, json, glob, math, time, random, argparse, platform
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_PSK = 'pygsm-benchmark'
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+# Synthetic data sizes
+SCALES = {
+    'small': { 'servers': 1000, 'games': 1000, 'players': 10000, 'leaderboard': 100000 },
+    'medium': { 'servers': 5000, 'games': 10000, 'players': 100000, 'leaderboard': 1000000 },
+    'large': { 'servers': 10000, 'games': 50000, 'players': 500000, 'leaderboard': 5000000 },
+}
+
+# Optional migrations, only loaded when asked for
+OPTIONAL_SCHEMA = {
+    'partitioned': 'sql/0005_partitioning.sql',
+}
+
+def setup_schema(db_cursor, partitioned = False):
+    """ Drop everything and load the schema files in sql/.  The optional 
+        partitioning is left out unless partitioned is set. """
+
+    db_cursor.execute("DROP SCHEMA public CASCADE")
+    db_cursor.execute("CREATE SCHEMA public")
+
+    for path in sorted(glob.glob('sql/*.sql')):
+
+        if path == OPTIONAL_SCHEMA['partitioned'] and not partitioned:
+            continue
+
+        with open(path) as f:
+            db_cursor.execute(f.read())
+
+def seed(db_cursor, scale):
+    """ Load synthetic data """
+
+    db_cursor.execute("""INSERT INTO psk (psk, development, description) 
+        VALUES (%s, false, 'pygsm benchmark') ON CONFLICT DO NOTHING""", (BENCH_PSK, ))
+
+    db_cursor.execute("""INSERT INTO game (stamp, dev) 
+        SELECT now() - random() * interval '20 days', false 
+        FROM generate_series(1, %s)""", (scale['games'], ))
+
+    db_cursor.execute("""WITH g AS (SELECT array_agg(game_uuid) AS games FROM game)
+        INSERT INTO ping (hostname, port, name, active, max, dev, ping, game_uuid)
+        SELECT 'bench-' || (i / 100) || '.example.com', 27000 + i %% 100, 
+        'Benchmark server ' || i, i %% 17, 16, false, now(), 
+        g.games[1 + i %% array_length(g.games, 1)]
+        FROM generate_series(1, %s) i, g""", (scale['servers'], ))
+
+    db_cursor.execute("""WITH g AS (SELECT array_agg(game_uuid) AS games FROM game)
+        INSERT INTO game_player (game_uuid, meta)
+        SELECT g.games[1 + i %% array_length(g.games, 1)], 
+        jsonb_build_object('name', 'player' || i)
+        FROM generate_series(1, %s) i, g""", (scale['players'], ))
+
+    db_cursor.execute("""WITH p AS (SELECT min(game_player_id) AS lo, 
+            max(game_player_id) AS hi FROM game_player)
+        INSERT INTO leaderboard (game_player_id, kills, deaths)
+        SELECT p.lo + (random() * (p.hi - p.lo))::int, r.kill, 1 - r.kill
+        FROM (SELECT (random() < 0.5)::int AS kill FROM generate_series(1, %s)) r, p""", 
+        (scale['leaderboard'], ))
+
+def prepare(args):
+    """ Set up the database for a benchmark run """
+
+    from core import db
+    from core.leaderboard import rebuild_totals
+
+    scale = SCALES[args.scale]
+
+    with db.transaction() as db_cursor:
+        if args.setup:
+            print("Loading schema...")
+            setup_schema(db_cursor, args.partitioned)
+
+        print("Loading %s data: %s" % (args.scale, scale))
+        seed(db_cursor, scale)
+
+    rebuild_totals()
+
+    conn = db.checkout()
+    try:
+        conn.autocommit = True
+        conn.cursor().execute("VACUUM ANALYZE")
+        conn.autocommit = False
+    finally:
+        db.checkin(conn)
+
+def load_ids():
+    """ Read ids the scenarios pick from """
+
+    from core import db
+
+    with db.transaction() as db_cursor:
+        db_cursor.execute("SELECT hostname, port, name, max, game_uuid FROM ping WHERE dev = false")
+        servers = [tuple(row) for row in db_cursor.fetchall()]
+
+        db_cursor.execute("SELECT min(game_player_id), max(game_player_id) FROM game_player")
+        players = tuple(db_cursor.fetchone())
+
+    if not servers or players[0] is None:
+        raise SystemExit("No benchmark data found.  Run with --seed or --setup first.")
+
+    return servers, players
+
+def scenarios(servers, players):
+    """ The requests to benchmark, as name: function returning 
+        (method, url, params) """
+
+    def heartbeat():
+        hostname, port, name, max_players, game_uuid = random.choice(servers)
+        return 'POST', '/server', {
+            'hostname': hostname, 'port': port, 'name': name, 
+            'activePlayers': random.randint(0, max_players), 
+            'maxPlayers': max_players, 'game_uuid': str(game_uuid),
+        }
+
+    def server_list():
+        return 'GET', '/server', {}
+
+    def leaderboard_top():
+        return 'GET', '/leaderboard', { 'order': 'kills', 'limit': 100 }
+
+    def leaderboard_player():
+        return 'GET', '/leaderboard', { 'game_player_id': random.randint(*players) }
+
+    def register_kill():
+        return 'POST', '/register-kill', {
+            'alive_game_player_id': random.randint(*players), 
+            'dead_game_player_id': random.randint(*players),
+        }
+
+    return {
+        'heartbeat': heartbeat,
+        'server_list': server_list,
+        'leaderboard_top': leaderboard_top,
+        'leaderboard_player': leaderboard_player,
+        'register_kill': register_kill,
+    }
+
+def percentile(values, p):
+    """ Nearest-rank percentile of sorted values """
+
+    if not values:
+        return None
+
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+def run_scenario(app, make_request, requests, threads):
+    """ Send requests to a WSGI app and measure them.  Returns the results 
+        dict. """
+
+    from falcon.testing import TestClient
+
+    client = TestClient(app)
+    headers = { 'X-Api-Key': BENCH_PSK }
+
+    def one(i):
+        method, url, params = make_request()
+        start = time.perf_counter()
+        result = client.simulate_request(method, url, params=params, headers=headers)
+        elapsed = time.perf_counter() - start
+
+        data = result.json
+        ok = result.status.startswith('200') and isinstance(data, dict) and data.get('success', False)
+
+        return elapsed, ok
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(threads) as executor:
+        timings = list(executor.map(one, range(requests)))
+
+    wall = time.perf_counter() - start
+    latencies = sorted(t for t, ok in timings)
+
+    return {
+        'requests': requests,
+        'errors': sum(1 for t, ok in timings if not ok),
+        'throughput': requests / wall,
+        'mean': sum(latencies) / len(latencies),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+def compare(results, baseline, threshold):
+    """ Print the change against a baseline.  Returns the names of the 
+        scenarios that regressed by more than threshold. """
+
+    regressions = []
+
+    for name, result in sorted(results.items()):
+
+        base = baseline['results'].get(name)
+
+        if not base:
+            continue
+
+        throughput = result['throughput'] / base['throughput'] - 1
+        p99 = result['p99'] / base['p99'] - 1
+        regressed = throughput < -threshold or p99 > threshold
+
+        print("%-20s throughput %+7.1f%%  p99 %+7.1f%%%s" % (name, throughput * 100, 
+            p99 * 100, "  REGRESSION" if regressed else ""))
+
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description="pygsm API benchmarks")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--setup', action='store_true', 
+        help="Wipe the database, load the schema and synthetic data")
+    parser.add_argument('--partitioned', action='store_true', 
+        help="With --setup, also apply the optional sql/0005_partitioning.sql (PostgreSQL 11+)")
+    parser.add_argument('--seed', action='store_true', help="Load synthetic data")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per scenario")
+    parser.add_argument('--threads', type=int, default=1, help="Concurrent requests")
+    parser.add_argument('--only', action='append', help="Run only this scenario")
+    parser.add_argument('--save', nargs='?', const='', metavar='PATH', 
+        help="Save the results as a baseline")
+    parser.add_argument('--compare', nargs='?', const='', metavar='PATH', 
+        help="Compare the results to a baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, 
+        help="Allowed regression before --compare fails, as a fraction")
+    args = parser.parse_args(argv)
+
+    if args.setup or args.seed:
+        prepare(args)
+
+    import pygsm
+
+    # Built once, so the timings don't include setting up the app
+    app = pygsm.create_app()
+
+    servers, players = load_ids()
+    available = scenarios(servers, players)
+
+    results = {}
+
+    for name, make_request in available.items():
+
+        if args.only and name not in args.only:
+            continue
+
+        # Warm up caches and connections
+        run_scenario(app, make_request, min(100, args.requests), args.threads)
+
+        result = results[name] = run_scenario(app, make_request, args.requests, args.threads)
+
+        print("%-20s %8.1f req/s  p50 %7.2fms  p99 %7.2fms  errors %s" % (name, 
+            result['throughput'], result['p50'] * 1000, result['p99'] * 1000, result['errors']))
+
+    report = {
+        'scale': args.scale,
+        'requests': args.requests,
+        'threads': args.threads,
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+    default_path = os.path.join(BASELINE_DIR, '%s.json' % args.scale)
+
+    if args.compare is not None:
+        with open(args.compare or default_path) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    else:
+        regressions = []
+
+    if args.save is not None:
+        path = args.save or default_path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+        print("Saved results to %s" % path)
+
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
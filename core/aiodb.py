@@ -0,0 +1,92 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+aiodb.py
+
+asyncpg connection pool for the async serving mode(pygsm_async.py).  
+asyncpg is only needed for that mode.
+"""
+import sys, json
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+from core import log
+from core.config import settings
+
+# We want to assign directly to this module
+this = sys.modules[__name__]
+
+this.pool = None
+
+async def init_connection(conn):
+    """ Decode JSON columns like psycopg2 does """
+
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, 
+        schema='pg_catalog')
+
+async def connect():
+    """ Create the database connection pool """
+
+    if asyncpg is None:
+        raise RuntimeError("The async serving mode requires asyncpg.  Install it with `pip install -r requirements-async.txt`.")
+
+    this.pool = await asyncpg.create_pool(
+        database    = settings['DB_NAME'],
+        user        = settings['DB_USER'],
+        password    = settings['DB_PASS'],
+        host        = settings['DB_HOST'],
+        port        = settings['DB_PORT'],
+        min_size    = settings['DB_POOL_MIN'],
+        max_size    = settings['DB_POOL_MAX'],
+        init        = init_connection,
+        # asyncpg prepares every statement.  A transaction-mode pooler 
+        # can not keep them.
+        statement_cache_size = 100 if settings['DB_PREPARE'] else 0
+    )
+
+    log.info("Async database pool ready")
+
+    return this.pool
+
+async def close():
+    """ Close the database connection pool """
+
+    if this.pool is not None:
+        await this.pool.close()
+        this.pool = None
+
+def pool_stats():
+    """ Utilization stats for the connection pool """
+
+    if this.pool is None:
+        return {}
+
+    size = this.pool.get_size()
+    idle = this.pool.get_idle_size()
+
+    return {
+        'size': size,
+        'in_use': size - idle,
+        'max': settings['DB_POOL_MAX'],
+    }
@@ -23,16 +23,44 @@ auth.py
 
 This file handles authentication for the API on methods that require it.
 """
-import uuid
+import time, uuid
 from hug.authentication import authenticator
-from core import log
-from core.db import db_connection, db_cursor
+from core import log, db, metrics, queries
+from core.cache import TTLCache
+from core.lazy import singleton
 from core.config import settings
 
 """ Exceptions """
 class InvalidValidator(TypeError): pass
 class AuthenticationFailed(Exception): pass
 
+@singleton
+def psk_cache():
+    """ Validated PSKs, keyed by PSK.  Unknown PSKs are cached as False with 
+        a shorter TTL. """
+    return TTLCache(settings['AUTH_CACHE_SIZE'], settings['AUTH_CACHE_TTL'])
+
+metrics.Gauges('pygsm_auth_cache', lambda: psk_cache().stats())
+
+auth_seconds = metrics.Histogram('pygsm_auth_seconds', 
+    "Time spent authenticating PSKs", ('result', ))
+
+def cache_psk(psk, row):
+    """ Cache the psk table row of a PSK, or None if the PSK is unknown.  
+        Returns the cached entry. """
+
+    if row:
+        psk_entry = {
+            'development': row['development'],
+            'description': row['description'],
+        }
+        psk_cache().set(psk, psk_entry)
+    else:
+        psk_entry = False
+        psk_cache().set(psk, psk_entry, settings['AUTH_CACHE_NEGATIVE_TTL'])
+
+    return psk_entry
+
 """ PSK Format verification functions 
 
     These functions, as well as any user-defined ones, should take one 
@@ -129,14 +157,10 @@ class Auth(object):
         except AssertionError:
             return False
 
-    def check_db(self):
-        """ Check the PSK against the database """
+    def load(self, psk_entry):
+        """ Fill in the user from a PSK entry made by cache_psk """
 
-        db_cursor.execute("""SELECT psk, development, description FROM 
-            psk WHERE active = true AND psk = %s""", [self.psk])
-        
-        if db_cursor.rowcount > 0:
-            psk_entry = db_cursor.fetchone()
+        if psk_entry:
             self.description = psk_entry['description']
             self.development = psk_entry['development']
             self.anonymous = False
@@ -144,6 +168,19 @@ class Auth(object):
         else:
             return False
 
+    def check_db(self):
+        """ Check the PSK against the database """
+
+        psk_entry = psk_cache().get(self.psk)
+
+        if psk_entry is None:
+
+            db_cursor = queries.run(db.cursor(), 'psk', [self.psk])
+
+            psk_entry = cache_psk(self.psk, db_cursor.fetchone())
+        
+        return self.load(psk_entry)
+
     def authenticate(self, type_name = 'string'):
         """ Authenticate with the PSK """
 
@@ -168,11 +205,23 @@ class Auth(object):
 
 def authenticate(psk):
     """ Authenticate with the PSK """
+    start = time.perf_counter()
     auth = Auth(psk)
     try:
         auth.authenticate(settings['AUTH_PSK_FORMAT'])
     except AuthenticationFailed:
+        auth_seconds.observe(time.perf_counter() - start, 'failed')
         log.info("Authentication failed")
         return None
 
+    auth_seconds.observe(time.perf_counter() - start, 'success')
     return auth
+
+def invalidate(psk = None):
+    """ Drop a PSK from the auth cache, or all of them if none is given.  
+        Call this after changing or deactivating a PSK. """
+    psk_cache().invalidate(psk)
+
+def cache_stats():
+    """ Hit/miss counters for the auth cache """
+    return psk_cache().stats()
\ No newline at end of file
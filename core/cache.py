@@ -0,0 +1,100 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+cache.py
+
+A small, thread-safe in-process cache with LRU eviction and per-entry 
+expiration.
+"""
+import time, threading
+from collections import OrderedDict
+
+class TTLCache(object):
+    """ Bounded LRU cache where every entry expires after a TTL """
+
+    def __init__(self, size = 1024, ttl = 60):
+
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default = None):
+        """ Get a cached value, or default if missing or expired """
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            entry = self._entries.get(key)
+
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def set(self, key, value, ttl = None):
+        """ Cache a value.  ttl overrides the cache's default TTL. """
+
+        if self.size < 1:
+            return
+
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key = None):
+        """ Remove a key from the cache, or everything if no key is given """
+
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """ Hit/miss counters and current size """
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size': self.size,
+            }
@@ -18,58 +18,180 @@ See the GNU General Public License for more details. You should have
 received a copy of the GNU General Public License along with pygsm. If 
 not, see <http://www.gnu.org/licenses/>.
 """
-import sys, configparser, logging
+import sys, configparser, logging, threading
 
 from utilities import exists
 
-config = configparser.ConfigParser()
-if not config.read('pygsm.cfg'):
-    print("ERROR: Could not parse pygsm.cfg.  Make sure the config file exists and is readable.")
-    sys.exit(1)
+class ConfigError(Exception):
+    """ The config file is missing or invalid """
 
-settings = {}
+class Settings(object):
+    """ The settings of pygsm.cfg.  Read on first use, so importing pygsm
+        has no side effects.  Call load() first to read another file or to
+        catch a bad config at startup. """
 
-""" 
-Logging config 
-"""
-
-# defaults
-default_logfile = "/tmp/pygsm.log"
-default_loglevel = logging.DEBUG
-
-# If the Logging config section exists, use its parameters
-if exists(config, 'Logging'):
-    settings['LOG_FILE'] = config.get('Logging', 'file', fallback=default_logfile)
-    settings['LOG_LEVEL'] = getattr(logging, config.get('Logging', 'level', fallback='DEBUG'), default_loglevel)
-
-# otherwise, use the defaults
-else:
-    print("ERROR: Logging section of config file is missing!")
-    settings['LOG_FILE'] = default_logfile
-    settings['LOG_LEVEL'] = default_loglevel
-
-""" 
-DB config 
-"""
-
-# Check and make sure the section exists
-if not exists(config, 'Database'):
-    print("ERROR: Database section must be defined in pygsm.cfg for pygsm to function")
-    sys.exit(1)
-
-settings['DB_HOST'] = config.get('Database', 'hostname', fallback='localhost')
-settings['DB_PORT'] = config.getint('Database', 'port', fallback=5432)
-settings['DB_NAME'] = config.get('Database', 'name', fallback='pygsm')
-settings['DB_USER'] = config.get('Database', 'user', fallback=None)
-settings['DB_PASS'] = config.get('Database', 'password', fallback=None)
-
-# Optional preferences
-settings['GAME_MAX_AGE'] = config.getint('Pref', 'game_max_age', fallback=30)
+    def __init__(self):
+        # Replaced as a whole by load(), so readers never see it half done
+        self.values = None
 
-# Auth
-settings['AUTH_PSK_FORMAT'] = config.get('Auth', 'psk_format', fallback='string')
+    def __getitem__(self, key):
+        return (self.values or self.ensure_loaded())[key]
+
+    def get(self, key, default = None):
+        return (self.values or self.ensure_loaded()).get(key, default)
 
-# Make sure we have the required settings
-if not (settings['DB_HOST'] and settings['DB_USER'] and settings['DB_PASS']):
-    print("ERROR: hostname, username, and password must be defined in pygsm.cfg for pygsm to function")
-    sys.exit(1)
+    def __contains__(self, key):
+        return key in (self.values or self.ensure_loaded())
+
+    def ensure_loaded(self):
+        with load_lock:
+            if self.values is None:
+                load()
+            return self.values
+
+this = sys.modules[__name__]
+
+settings = Settings()
+load_lock = threading.Lock()
+
+def load(path = 'pygsm.cfg'):
+    """ Read the settings from a config file.  Raises ConfigError if it is
+        missing or invalid. """
+
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise ConfigError("Could not parse %s.  Make sure the config file exists and is readable." % path)
+
+    # Filled in here, and published to the module's settings once it is valid
+    settings = {}
+
+    """ 
+    Logging config 
+    """
+
+    # defaults
+    default_logfile = "/tmp/pygsm.log"
+    default_loglevel = logging.DEBUG
+
+    # If the Logging config section exists, use its parameters
+    if exists(config, 'Logging'):
+        settings['LOG_FILE'] = config.get('Logging', 'file', fallback=default_logfile)
+        settings['LOG_LEVEL'] = getattr(logging, config.get('Logging', 'level', fallback='DEBUG'), default_loglevel)
+
+    # otherwise, use the defaults
+    else:
+        print("ERROR: Logging section of config file is missing!")
+        settings['LOG_FILE'] = default_logfile
+        settings['LOG_LEVEL'] = default_loglevel
+
+    """ 
+    DB config 
+    """
+
+    # Check and make sure the section exists
+    if not exists(config, 'Database'):
+        raise ConfigError("Database section must be defined in %s for pygsm to function" % path)
+
+    settings['DB_HOST'] = config.get('Database', 'hostname', fallback='localhost')
+    settings['DB_PORT'] = config.getint('Database', 'port', fallback=5432)
+    settings['DB_NAME'] = config.get('Database', 'name', fallback='pygsm')
+    settings['DB_USER'] = config.get('Database', 'user', fallback=None)
+    settings['DB_PASS'] = config.get('Database', 'password', fallback=None)
+
+    # Connection pool
+    settings['DB_POOL_MIN'] = config.getint('Database', 'pool_min', fallback=1)
+    settings['DB_POOL_MAX'] = config.getint('Database', 'pool_max', fallback=10)
+    settings['DB_POOL_TIMEOUT'] = config.getfloat('Database', 'pool_timeout', fallback=10.0)
+
+    # Prepared statements.  Turn off behind a transaction-mode pooler.
+    settings['DB_PREPARE'] = config.getboolean('Database', 'prepare', fallback=True)
+
+    # Read replicas for read-only requests, as host or host:port separated by 
+    # commas.  They use the name, user and password of the primary.
+    settings['DB_REPLICAS'] = []
+    settings['DB_REPLICA_MAX_LAG'] = config.getfloat('Database', 'replica_max_lag', fallback=5.0)
+    settings['DB_REPLICA_CHECK_INTERVAL'] = config.getfloat('Database', 'replica_check_interval', fallback=1.0)
+
+    for replica in config.get('Database', 'replicas', fallback='').split(','):
+        host, _, port = replica.strip().partition(':')
+
+        if not host:
+            continue
+
+        if port and not port.isdigit():
+            raise ConfigError("Invalid port in replica %s in %s" % (replica.strip(), path))
+
+        settings['DB_REPLICAS'].append((host, int(port or settings['DB_PORT'])))
+
+    # Optional preferences
+    settings['GAME_MAX_AGE'] = config.getint('Pref', 'game_max_age', fallback=30)
+    settings['SERVER_TIMEOUT'] = config.getint('Pref', 'server_timeout', fallback=300)
+    settings['SERVER_LIST_MAX_AGE'] = config.getfloat('Pref', 'server_list_max_age', fallback=5.0)
+    settings['SERVER_LIST_MIN_AGE'] = config.getfloat('Pref', 'server_list_min_age', fallback=1.0)
+    settings['BATCH_MAX_SIZE'] = config.getint('Pref', 'batch_max_size', fallback=1000)
+    settings['PAGE_MAX_SIZE'] = config.getint('Pref', 'page_max_size', fallback=1000)
+    settings['ETAG_MAX_AGE'] = config.getfloat('Pref', 'etag_max_age', fallback=60.0)
+
+    # Auth
+    settings['AUTH_PSK_FORMAT'] = config.get('Auth', 'psk_format', fallback='string')
+    settings['AUTH_CACHE_SIZE'] = config.getint('Auth', 'cache_size', fallback=1024)
+    settings['AUTH_CACHE_TTL'] = config.getfloat('Auth', 'cache_ttl', fallback=60.0)
+    settings['AUTH_CACHE_NEGATIVE_TTL'] = config.getfloat('Auth', 'cache_negative_ttl', fallback=5.0)
+
+    # Leaderboard
+    settings['LEADERBOARD_WRITE_BEHIND'] = config.getboolean('Leaderboard', 'write_behind', fallback=False)
+    settings['LEADERBOARD_FLUSH_SIZE'] = config.getint('Leaderboard', 'flush_size', fallback=500)
+    settings['LEADERBOARD_FLUSH_INTERVAL'] = config.getfloat('Leaderboard', 'flush_interval', fallback=1.0)
+    settings['LEADERBOARD_FLUSH_ON_SHUTDOWN'] = config.getboolean('Leaderboard', 'flush_on_shutdown', fallback=True)
+
+    # Maintenance
+    settings['MAINTENANCE_ENABLED'] = config.getboolean('Maintenance', 'enabled', fallback=False)
+    settings['MAINTENANCE_INTERVAL'] = config.getfloat('Maintenance', 'interval', fallback=60.0)
+    settings['MAINTENANCE_BATCH_SIZE'] = config.getint('Maintenance', 'batch_size', fallback=1000)
+    settings['PARTITION_INTERVAL'] = config.get('Maintenance', 'partition_interval', fallback='month')
+    settings['PARTITION_AHEAD'] = config.getint('Maintenance', 'partition_ahead', fallback=2)
+
+    # UDP heartbeats
+    settings['UDP_ENABLED'] = config.getboolean('Heartbeat', 'udp_enabled', fallback=False)
+    settings['UDP_HOST'] = config.get('Heartbeat', 'udp_host', fallback='0.0.0.0')
+    settings['UDP_PORT'] = config.getint('Heartbeat', 'udp_port', fallback=27900)
+    settings['UDP_FLUSH_INTERVAL'] = config.getfloat('Heartbeat', 'udp_flush_interval', fallback=1.0)
+
+    # Heartbeat coalescing
+    settings['HEARTBEAT_COALESCE'] = config.getboolean('Heartbeat', 'coalesce', fallback=False)
+    settings['HEARTBEAT_REFRESH'] = config.getfloat('Heartbeat', 'refresh', fallback=60.0)
+    settings['HEARTBEAT_FLUSH_INTERVAL'] = config.getfloat('Heartbeat', 'flush_interval', fallback=10.0)
+
+    # Server events
+    settings['EVENTS_MAX_SUBSCRIBERS'] = config.getint('Events', 'max_subscribers', fallback=100)
+    settings['EVENTS_KEEPALIVE'] = config.getfloat('Events', 'keepalive', fallback=15.0)
+    settings['EVENTS_BUFFER_SIZE'] = config.getint('Events', 'buffer_size', fallback=4096)
+    settings['EVENTS_RESYNC'] = config.getfloat('Events', 'resync', fallback=60.0)
+
+    # Output
+    settings['OUTPUT_COMPRESS'] = config.getboolean('Output', 'compress', fallback=True)
+    settings['OUTPUT_COMPRESS_MIN_SIZE'] = config.getint('Output', 'compress_min_size', fallback=1024)
+    settings['OUTPUT_COMPRESS_LEVEL'] = config.getint('Output', 'compress_level', fallback=6)
+    settings['OUTPUT_MSGPACK'] = config.getboolean('Output', 'msgpack', fallback=True)
+
+    # Pre-forked workers
+    settings['WORKERS'] = config.getint('Workers', 'workers', fallback=0)
+    settings['WORKERS_SHARED_SIZE'] = config.getint('Workers', 'shared_size', fallback=16)
+    settings['WORKERS_LEADER_LOCK'] = config.get('Workers', 'leader_lock', fallback='/tmp/pygsm.leader')
+
+    # Make sure we have the required settings
+    if not (settings['DB_HOST'] and settings['DB_USER'] and settings['DB_PASS']):
+        raise ConfigError("hostname, username, and password must be defined in %s for pygsm to function" % path)
+
+    if settings['PARTITION_INTERVAL'] not in ('day', 'week', 'month'):
+        raise ConfigError("partition_interval must be day, week, or month in %s" % path)
+
+    if settings['DB_POOL_MIN'] > settings['DB_POOL_MAX']:
+        raise ConfigError("pool_min can not be larger than pool_max in %s" % path)
+
+    if settings['HEARTBEAT_COALESCE'] and max(settings['HEARTBEAT_REFRESH'], settings['HEARTBEAT_FLUSH_INTERVAL']) >= settings['SERVER_TIMEOUT']:
+        raise ConfigError("Heartbeat refresh and flush_interval must be shorter than server_timeout in %s" % path)
+
+    this.settings.values = settings
+
+    return this.settings
\ No newline at end of file
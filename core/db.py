@@ -18,41 +18,468 @@ See the GNU General Public License for more details. You should have
 received a copy of the GNU General Public License along with pygsm. If 
 not, see <http://www.gnu.org/licenses/>.
 """
-import sys, psycopg2, psycopg2.extensions, psycopg2.extras
+"""
+db.py
+
+Database connection handling.  Connections are kept in a thread-safe pool
+and checked out per-request, so concurrent handlers never share a cursor
+or a transaction.  Read-only requests can be routed to read replicas, 
+which are only used while they lag less than replica_max_lag seconds 
+behind the primary.
+"""
+import re, sys, time, random, threading
+import psycopg2, psycopg2.extensions, psycopg2.extras, psycopg2.pool
+from contextlib import contextmanager
 
-from core import log
+from core import log, metrics, prefork
 from core.config import settings
 
+""" Exceptions """
+class PoolTimeout(psycopg2.pool.PoolError): pass
+
+query_seconds = metrics.Histogram('pygsm_db_query_seconds', 
+    "Time spent executing SQL statements", ('statement', ))
+query_rows = metrics.Counter('pygsm_db_query_rows_total', 
+    "Rows returned or changed by SQL statements", ('statement', ))
+query_errors = metrics.Counter('pygsm_db_query_errors_total', 
+    "SQL statements that raised an error", ('statement', ))
+replica_reads = metrics.Counter('pygsm_db_replica_reads_total', 
+    "Connections checked out for read-only work, by the server that served them", ('server', ))
+
+# Statement labels by query text
+statement_labels = {}
+statement_end = re.compile(r'\s(VALUES|WHERE|SET)\s')
+
+def statement_label(query):
+    """ Short, stable label for a query.  Everything from the first 
+        VALUES, WHERE or SET is left out so queries with generated VALUES 
+        lists share one label. """
+
+    label = statement_labels.get(query)
+
+    if label is None:
+        text = query.decode('utf8') if isinstance(query, bytes) else str(query)
+        text = ' '.join(text.split())
+        text = statement_end.split(text, 1)[0][:80]
+
+        # Don't let generated queries grow this forever
+        if len(statement_labels) < 1000:
+            statement_labels[query] = text
+
+        label = text
+
+    return label
+
+class InstrumentedCursor(psycopg2.extras.DictCursor):
+    """ DictCursor that records timing and row counts of every statement """
+
+    def execute(self, query, vars = None):
+
+        label = statement_label(query)
+        start = time.perf_counter()
+
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            query_errors.inc(label)
+            raise
+        finally:
+            query_seconds.observe(time.perf_counter() - start, label)
+
+        if self.rowcount > 0:
+            query_rows.inc(label, amount=self.rowcount)
+
+        return result
+
+class Connection(psycopg2.extensions.connection):
+    """ Connection that remembers the statements prepared on it """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+        # Replica the connection belongs to, None for the primary
+        self.replica = None
+
+# Seconds a replica is behind the primary.  A replica that is streaming 
+# from the primary and has replayed everything it received is current, 
+# however old its last transaction is.  Without a running WAL receiver it 
+# may be any amount behind, so its lag is unknown (NULL).  Roles without 
+# pg_read_all_stats only see the receiver's pid, not its status.
+lag_query = """SELECT CASE 
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver 
+        WHERE pid IS NOT NULL AND COALESCE(status, 'streaming') = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) 
+    END AS lag"""
+
+class Replica(object):
+    """ Connection pool of a read replica and how far it lags behind """
+
+    # Seconds to wait for a new connection, and before trying a replica 
+    # again that could not be reached, so requests don't keep waiting on 
+    # one that is down
+    connect_timeout = 2
+    retry_interval = 30.0
+
+    def __init__(self, host, port):
+
+        self.name = '%s:%s' % (host, port)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            0,
+            settings['DB_POOL_MAX'],
+            database    = settings['DB_NAME'],
+            user        = settings['DB_USER'],
+            password    = settings['DB_PASS'],
+            host        = host,
+            port        = port,
+            connect_timeout = self.connect_timeout,
+            connection_factory = Connection
+        )
+        self.slots = threading.BoundedSemaphore(settings['DB_POOL_MAX'])
+
+        # Lag in seconds as of the last check, None if unknown or the 
+        # replica could not be reached
+        self.lag = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def usable(self):
+        """ Whether the replica was close enough to the primary when last 
+            checked """
+
+        return self.lag is not None and self.lag <= settings['DB_REPLICA_MAX_LAG']
+
+    def claim_check(self):
+        """ Whether the caller should check the lag now.  Only one caller 
+            gets to per check_interval. """
+
+        with self._lock:
+            now = time.monotonic()
+
+            if self.checked_at is not None and now - self.checked_at < settings['DB_REPLICA_CHECK_INTERVAL']:
+                return False
+
+            self.checked_at = now
+            return True
+
+    def checkout(self):
+        """ Take a connection to the replica without waiting.  Returns None 
+            if the replica is busy, unreachable or lags too far behind. """
+
+        check = self.claim_check()
+
+        if not (check or self.usable()):
+            return None
+
+        if not self.slots.acquire(blocking=False):
+            return None
+
+        try:
+            conn = self.pool.getconn()
+        except Exception as e:
+            self.slots.release()
+            self.unavailable(e)
+            return None
+
+        conn.replica = self
+
+        if check:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(lag_query)
+                    lag = cur.fetchone()[0]
+                conn.rollback()
+            except Exception as e:
+                self.checkin(conn)
+                self.unavailable(e)
+                return None
+
+            was_usable = self.usable()
+            self.lag = None if lag is None else float(lag)
+
+            if not self.usable():
+                if was_usable and self.lag is None:
+                    log.warning("Read replica %s is not streaming from the primary, reading from the primary" % self.name)
+                elif was_usable:
+                    log.warning("Read replica %s lags %s seconds behind, reading from the primary" % (self.name, self.lag))
+
+                self.checkin(conn)
+                return None
+
+        return conn
+
+    def unavailable(self, error):
+        """ Stop using the replica until retry_interval has passed """
+
+        log.warning("Read replica %s is unavailable: %s" % (self.name, error))
+
+        with self._lock:
+            self.lag = None
+            self.checked_at = time.monotonic() + self.retry_interval - settings['DB_REPLICA_CHECK_INTERVAL']
+
+    def checkin(self, conn):
+        """ Return a connection to the replica's pool """
+
+        try:
+            self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
 # We want to assign directly to this module
 this = sys.modules[__name__]
 
-this.db_connection = None
-this.db_cursor = None
+this.pool = None
+
+# Limits the amount of connections checked out at once so callers wait
+# for a free connection instead of the pool raising immediately
+this.pool_slots = None
+
+# Read replica pools
+this.replicas = []
+
+# The pools are opened on first use, or by connect() at startup
+this.connect_lock = threading.RLock()
+
+# Connection checked out for the current request, per thread, and whether 
+# the request only reads
+this.local = threading.local()
+
+this.stats_lock = threading.Lock()
+this.stats = {
+    'checkouts': 0,
+    'timeouts': 0,
+    'in_use': 0,
+    'wait_total': 0.0,
+    'wait_max': 0.0,
+    'replica_fallbacks': 0,
+}
 
 # functions
 def connect():
-    """ Connect to the database """
+    """ Create the database connection pool, unless it is open already """
+
+    with this.connect_lock:
+
+        if this.pool is not None:
+            return this.pool
 
-    this.db_connection = psycopg2.connect(
-        database    = settings['DB_NAME'],
-        user        = settings['DB_USER'],
-        password    = settings['DB_PASS'],
-        host        = settings['DB_HOST'],
-        port        = settings['DB_PORT']
-    )
+        psycopg2.extras.register_uuid()
+        psycopg2.extras.register_default_jsonb(globally=True)
 
-    if this.db_connection.status != psycopg2.extensions.STATUS_READY:
+        this.replicas = [Replica(host, port) for host, port in settings['DB_REPLICAS']]
+        this.pool_slots = threading.BoundedSemaphore(settings['DB_POOL_MAX'])
+        this.pool = psycopg2.pool.ThreadedConnectionPool(
+            settings['DB_POOL_MIN'],
+            settings['DB_POOL_MAX'],
+            database    = settings['DB_NAME'],
+            user        = settings['DB_USER'],
+            password    = settings['DB_PASS'],
+            host        = settings['DB_HOST'],
+            port        = settings['DB_PORT'],
+            connection_factory = Connection
+        )
+
+    return this.pool
+
+def close():
+    """ Close the connections of the pools """
+
+    with this.connect_lock:
+
+        if this.pool is not None:
+            this.pool.closeall()
+            this.pool = None
+
+        for replica in this.replicas:
+            replica.pool.closeall()
+
+        this.replicas = []
+
+def checkout_replica():
+    """ Take a connection to a usable read replica, or None if there is 
+        none.  Replicas are tried in random order to spread the reads. """
+
+    replicas = list(this.replicas)
+    random.shuffle(replicas)
+
+    for replica in replicas:
+        conn = replica.checkout()
+
+        if conn is not None:
+            replica_reads.inc(replica.name)
+            return conn
+
+    return None
+
+def checkout(read_only = False):
+    """ Take a connection out of the pool, waiting for one if necessary.  
+        Read-only work goes to a read replica if one is usable, and to the 
+        primary otherwise. """
+
+    if this.pool is None:
+        connect()
+
+    if read_only and this.replicas:
+        conn = checkout_replica()
+
+        if conn is not None:
+            return conn
+
+        with this.stats_lock:
+            this.stats['replica_fallbacks'] += 1
+
+        replica_reads.inc('primary')
+
+    start = time.monotonic()
+
+    if not this.pool_slots.acquire(timeout=settings['DB_POOL_TIMEOUT']):
+        with this.stats_lock:
+            this.stats['timeouts'] += 1
+        log.error("ERROR: Timed out waiting for a database connection!")
+        raise PoolTimeout("Timed out waiting for a database connection")
+
+    try:
+        conn = this.pool.getconn()
+    except Exception:
+        this.pool_slots.release()
+        raise
+
+    if conn.status != psycopg2.extensions.STATUS_READY:
         # oops
         log.error("ERROR: Database connection failed!")
-    else:
-        # get the cursor
-        this.db_cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-    return this.db_connection
+    waited = time.monotonic() - start
+
+    with this.stats_lock:
+        this.stats['checkouts'] += 1
+        this.stats['in_use'] += 1
+        this.stats['wait_total'] += waited
+        this.stats['wait_max'] = max(this.stats['wait_max'], waited)
+
+    return conn
+
+def checkin(conn):
+    """ Return a connection to the pool.  Any open transaction is rolled 
+        back by the pool. """
+
+    if conn.replica is not None:
+        conn.replica.checkin(conn)
+        return
+
+    try:
+        this.pool.putconn(conn)
+    finally:
+        this.pool_slots.release()
+        with this.stats_lock:
+            this.stats['in_use'] -= 1
+
+def connection():
+    """ Get the connection for the current request, checking one out of 
+        the pool on first use """
+
+    conn = getattr(this.local, 'connection', None)
+
+    if conn is None:
+        conn = checkout(getattr(this.local, 'read_only', False))
+        this.local.connection = conn
+        this.local.cursor = conn.cursor(cursor_factory=InstrumentedCursor)
+
+    return conn
+
+def cursor():
+    """ Get the cursor for the current request """
+
+    connection()
+
+    return this.local.cursor
+
+def route(read_only = False):
+    """ Set whether the current request only reads.  Its connection then 
+        comes from a read replica if one is usable.  A replica connection 
+        the request already has is given back when it has to write. """
+
+    conn = getattr(this.local, 'connection', None)
+
+    if conn is not None and conn.replica is not None and not read_only:
+        release()
+
+    this.local.read_only = read_only
+
+def release():
+    """ Return the current request's connection to the pool """
+
+    conn = getattr(this.local, 'connection', None)
+
+    if conn is None:
+        return
+
+    this.local.cursor.close()
+    this.local.connection = None
+    this.local.cursor = None
+
+    checkin(conn)
+
+@contextmanager
+def transaction():
+    """ Check out a connection for a unit of work outside of a request.  
+        Commits on success and rolls back on failure. """
+
+    conn = checkout()
+
+    try:
+        with conn.cursor(cursor_factory=InstrumentedCursor) as cur:
+            yield cur
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        checkin(conn)
+
+def stream(query, params = None, itersize = 1000, read_only = False):
+    """ Run a query on a server-side cursor and yield its rows as they are 
+        fetched, itersize rows at a time.  The generator holds its own 
+        connection until it is exhausted or closed. """
+
+    conn = checkout(read_only)
+
+    try:
+        with conn.cursor(name='pygsm_stream', cursor_factory=InstrumentedCursor) as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+
+            for row in cur:
+                yield row
+    finally:
+        checkin(conn)
+
+def pool_stats():
+    """ Wait-time and utilization stats for the connection pool """
+
+    with this.stats_lock:
+        stats = dict(this.stats)
+
+    stats['size'] = settings['DB_POOL_MAX']
+    stats['utilization'] = stats['in_use'] / stats['size']
+    stats['wait_avg'] = stats['wait_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+
+    if this.replicas:
+        lags = [r.lag for r in this.replicas if r.lag is not None]
+        stats['replicas'] = len(this.replicas)
+        stats['replicas_usable'] = len([r for r in this.replicas if r.usable()])
+        stats['replica_lag_max'] = max(lags) if lags else None
+
+    return stats
+
+metrics.Gauges('pygsm_db_pool', pool_stats)
 
 # setup
 if __name__ != '__main__':
 
-    connect()
-    psycopg2.extras.register_uuid()
-    psycopg2.extras.register_default_jsonb(this.db_connection)
\ No newline at end of file
+    # Connections can't be shared across a fork, so pre-forked workers 
+    # open their own
+    prefork.before_fork(close)
+    prefork.on_startup(connect)
+    prefork.on_shutdown(close)
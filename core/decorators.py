@@ -18,19 +18,24 @@ See the GNU General Public License for more details. You should have
 received a copy of the GNU General Public License along with pygsm. If 
 not, see <http://www.gnu.org/licenses/>.
 """
+from functools import wraps
 from psycopg2.extensions import TRANSACTION_STATUS_INERROR
-from core.db import db_connection, db_cursor
+from core import db
 
 def rollback_on_failure(func):
     """ Decorateor that will rollback failed transactions """
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         
         result = func(*args, **kwargs)
         
+        db_connection = db.connection()
         status = db_connection.get_transaction_status()
 
         if status == TRANSACTION_STATUS_INERROR:
             db_connection.rollback()
 
         return result
+
+    return wrapper
\ No newline at end of file
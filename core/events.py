@@ -0,0 +1,220 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+events.py
+
+In-process bus for server list changes, used by GET /server/events to 
+push changes to subscribers.  Events are encoded once into Server-Sent 
+Events frames and kept in a shared ring buffer.  Subscribers read from 
+the buffer by sequence number, so publishing costs the same no matter how 
+many subscribers there are.
+"""
+import os, time, asyncio, binascii, threading
+from collections import deque
+
+from core import metrics, prefork
+from core.config import settings
+from core.lazy import singleton
+from core.output import encode
+
+class Lagged(Exception):
+    """ The subscriber fell behind further than the ring buffer reaches """
+    pass
+
+def frame(event_id, event, data):
+    """ Encode a Server-Sent Events frame """
+    return b'id: %s\nevent: %s\ndata: %s\n\n' % (event_id.encode('ascii'), event.encode('ascii'), data)
+
+def new_tag():
+    """ Random tag for the event ids of a process """
+    return binascii.hexlify(os.urandom(4)).decode('ascii')
+
+class EventBus(object):
+    """ Ring buffer of published events with blocking and async waits """
+
+    def __init__(self, size = 1024):
+
+        # (seq, channel, frame)
+        self.events = deque(maxlen=size)
+
+        # (time.monotonic(), seq) of the buffered events
+        self.times = deque(maxlen=size)
+        self.seq = 0
+
+        # Every process numbers its events itself, so its ids carry a tag 
+        # and ids of other processes are not mistaken for its own
+        self.tag = new_tag()
+
+        self._cond = threading.Condition()
+
+        # Event loop: asyncio.Event set on the next publish
+        self._loops = {}
+
+    def publish(self, channel, event, data):
+        """ Publish an event on a channel.  data must be encoded JSON. """
+
+        with self._cond:
+            self.seq += 1
+            self.events.append((self.seq, channel, frame(self.event_id(self.seq), event, data)))
+            self.times.append((time.monotonic(), self.seq))
+            self._cond.notify_all()
+            loops = list(self._loops)
+
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake_loop, loop)
+            except RuntimeError:
+                # Loop is closed
+                self._loops.pop(loop, None)
+
+    def event_id(self, seq):
+        """ The Last-Event-ID of an event """
+        return '%s-%d' % (self.tag, seq)
+
+    def parse_id(self, event_id):
+        """ The seq of a Last-Event-ID, or None if it is not one of this 
+            process's events """
+
+        tag, _, seq = (event_id or '').partition('-')
+
+        if tag != self.tag or not seq.isdigit():
+            return None
+
+        seq = int(seq)
+
+        return seq if seq <= self.seq else None
+
+    def _wake_loop(self, loop):
+        """ Wake all async waiters of a loop.  Runs in that loop. """
+
+        waiters = self._loops.get(loop)
+
+        if waiters is not None:
+            self._loops[loop] = asyncio.Event()
+            waiters.set()
+
+    def seq_at(self, stamp):
+        """ The last seq published before a time.monotonic() time.  The 
+            events after it may be missing from state read at that time. """
+
+        with self._cond:
+
+            for published, seq in reversed(self.times):
+                if published <= stamp:
+                    return seq
+
+            if not self.times:
+                return self.seq
+
+            # Events from before the oldest buffered one may be gone too, 
+            # so replaying from there raises Lagged
+            return self.times[0][1] - (2 if len(self.times) == self.times.maxlen else 1)
+
+    def since(self, after, channel = None):
+        """ Frames published after seq after, optionally only for one 
+            channel.  Returns the frames and the last seq.  Raises Lagged 
+            if some of them are no longer buffered. """
+
+        with self._cond:
+
+            if self.seq == after:
+                return [], after
+
+            if not self.events or self.events[0][0] > after + 1:
+                raise Lagged()
+
+            frames = [f for seq, c, f in self.events 
+                if seq > after and (channel is None or c == channel)]
+
+            return frames, self.seq
+
+    def wait(self, after, channel = None, timeout = None):
+        """ since(), blocking up to timeout seconds for new events """
+
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq != after, timeout)
+
+        return self.since(after, channel)
+
+    async def wait_async(self, after, channel = None, timeout = None):
+        """ wait() for an asyncio event loop """
+
+        loop = asyncio.get_event_loop()
+
+        with self._cond:
+            waiters = self._loops.setdefault(loop, asyncio.Event())
+            pending = self.seq == after
+
+        if pending:
+            try:
+                await asyncio.wait_for(waiters.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.since(after, channel)
+
+@singleton
+def server_events():
+    """ The server events of this process """
+    return EventBus(settings['EVENTS_BUFFER_SIZE'])
+
+@prefork.on_startup
+def tag_worker_events():
+    """ Give a worker its own event ids if the bus was created before the 
+        fork """
+
+    if server_events.built():
+        server_events().tag = new_tag()
+
+metrics.Gauges('pygsm_server_events', lambda: { 'seq': server_events().seq })
+
+subscribers = metrics.Counter('pygsm_server_event_subscriptions_total', 
+    "Subscriptions to GET /server/events")
+
+@singleton
+def subscriber_slots():
+    """ Limits the amount of open event streams of this process.  Take a 
+        slot without blocking and answer 503 when there is none. """
+    return threading.BoundedSemaphore(settings['EVENTS_MAX_SUBSCRIBERS'])
+
+def server_result(beat):
+    """ Format a heartbeat like a GET /server result """
+    return {
+        'hostname': beat.hostname,
+        'port': beat.port,
+        'name': beat.name,
+        'activePlayers': beat.active,
+        'maxPlayers': beat.max,
+        'game_uuid': str(beat.game_uuid),
+        'region': beat.region,
+        }
+
+def publish_updates(beats):
+    """ Publish servers that were added or updated """
+
+    for beat in beats:
+        server_events().publish(bool(beat.dev), 'update', encode(server_result(beat)))
+
+def publish_removes(servers):
+    """ Publish servers that went down, as (hostname, port, dev) """
+
+    for hostname, port, dev in servers:
+        server_events().publish(bool(dev), 'remove', encode({ 'hostname': hostname, 'port': port }))
@@ -0,0 +1,294 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+heartbeat.py
+
+Writes server heartbeats("pings") to the database.  Every heartbeat path 
+(POST /server and POST /server/batch) goes through here so servers are 
+stored the same way no matter how they checked in.  The *_async functions 
+do the same with an asyncpg connection for pygsm_async.py.
+"""
+import time, threading
+from collections import namedtuple, OrderedDict
+
+from core import log, db, metrics, queries, prefork
+from core.config import settings
+from core.lazy import singleton
+from utilities import int4
+
+Heartbeat = namedtuple('Heartbeat', 
+    ('hostname', 'port', 'name', 'active', 'max', 'dev', 'game_uuid', 'region'))
+
+# A heartbeat without a region keeps the one the server already has
+Heartbeat.__new__.__defaults__ = (None, )
+
+heartbeats = metrics.Counter('pygsm_heartbeats_total', 
+    "Heartbeats by whether they were written or only refreshed liveness", ('result', ))
+
+def check(beat):
+    """ Check the numbers of a heartbeat against the ping columns, so one 
+        bad server can not fail the statement of a batch.  Returns the 
+        heartbeat.  Raises ValueError. """
+
+    int4(beat.port, 'port', 1, 65535)
+    int4(beat.active, 'activePlayers', 0)
+    int4(beat.max, 'maxPlayers', 0)
+
+    return beat
+
+def create_games(db_cursor, beats):
+    """ Make sure the games of the heartbeats exist.  Heartbeats without a 
+        game_uuid get a new game.  Returns the heartbeats with their 
+        game_uuid filled in, and the amount of games created. """
+
+    known = [b for b in beats if b.game_uuid]
+    unknown = [b for b in beats if not b.game_uuid]
+
+    inserted = []
+
+    if known:
+        queries.run(db_cursor, 'existing_games', ([b.game_uuid for b in known], ))
+        existing = set(row[0] for row in db_cursor.fetchall())
+
+        missing = sorted(dict((b.game_uuid, b.dev) for b in known if b.game_uuid not in existing).items())
+
+        if missing:
+            queries.run(db_cursor, 'lock_games', ([m[0] for m in missing], ))
+            queries.run(db_cursor, 'insert_games', ([m[0] for m in missing], [m[1] for m in missing]))
+            inserted = db_cursor.fetchall()
+
+    created = []
+
+    if unknown:
+        queries.run(db_cursor, 'new_games', ([b.dev for b in unknown], ))
+        created = db_cursor.fetchall()
+
+    for beat, row in zip(unknown, created):
+        known.append(beat._replace(game_uuid=row[0]))
+
+    return known, len(inserted) + len(created)
+
+def upsert_pings(db_cursor, beats):
+    """ Add or update the ping rows of the heartbeats in one statement.  
+        When a server shows up more than once, the last heartbeat wins.  
+        With coalescing, rows that already hold the state of their 
+        heartbeat are not rewritten, and only the time of the heartbeat is 
+        kept in the registry.  Returns the heartbeats that were written. """
+
+    # ON CONFLICT can not touch the same row twice in one statement
+    latest = latest_beats(beats)
+
+    if not latest:
+        return []
+
+    if not settings['HEARTBEAT_COALESCE']:
+        queries.run(db_cursor, 'upsert_pings', ping_columns(latest))
+        heartbeats.inc('written', amount=len(latest))
+        return latest
+
+    queries.run(db_cursor, 'coalesce_pings', ping_columns(latest) + [settings['HEARTBEAT_REFRESH']])
+
+    return coalesced(latest, [(row[0], row[1]) for row in db_cursor.fetchall()])
+
+def coalesced(beats, written):
+    """ Record the heartbeats whose rows were not written in the registry.  
+        Returns the ones that were written. """
+
+    written = set(written)
+    changed = [b for b in beats if (b.hostname, b.port) in written]
+    unchanged = [b for b in beats if (b.hostname, b.port) not in written]
+
+    registry().seen(unchanged)
+
+    heartbeats.inc('written', amount=len(changed))
+    heartbeats.inc('coalesced', amount=len(unchanged))
+
+    return changed
+
+def latest_beats(beats):
+    """ The last heartbeat of every server """
+
+    latest = OrderedDict()
+    for beat in beats:
+        latest[(beat.hostname, beat.port)] = beat
+
+    return list(latest.values())
+
+def ping_columns(beats):
+    """ The upsert_pings parameters of the heartbeats, one list per column """
+
+    return [[getattr(b, field) for b in beats] for field in 
+        ('hostname', 'port', 'name', 'active', 'max', 'dev', 'game_uuid', 'region')]
+
+async def create_games_async(conn, beats):
+    """ create_games for an asyncpg connection """
+
+    known = [b for b in beats if b.game_uuid]
+    unknown = [b for b in beats if not b.game_uuid]
+
+    inserted = []
+
+    if known:
+        existing = set(row[0] for row in await conn.fetch(
+            queries.catalog['existing_games'].numbered, [b.game_uuid for b in known]))
+
+        missing = sorted(dict((b.game_uuid, b.dev) for b in known if b.game_uuid not in existing).items())
+
+        if missing:
+            await conn.execute(queries.catalog['lock_games'].numbered, [m[0] for m in missing])
+            inserted = await conn.fetch(queries.catalog['insert_games'].numbered, 
+                [m[0] for m in missing], [m[1] for m in missing])
+
+    created = []
+
+    if unknown:
+        created = await conn.fetch(queries.catalog['new_games'].numbered, [b.dev for b in unknown])
+
+    for beat, row in zip(unknown, created):
+        known.append(beat._replace(game_uuid=row[0]))
+
+    return known, len(inserted) + len(created)
+
+async def upsert_pings_async(conn, beats):
+    """ upsert_pings for an asyncpg connection """
+
+    latest = latest_beats(beats)
+
+    if not latest:
+        return []
+
+    if not settings['HEARTBEAT_COALESCE']:
+        await conn.execute(queries.catalog['upsert_pings'].numbered, *ping_columns(latest))
+        heartbeats.inc('written', amount=len(latest))
+        return latest
+
+    rows = await conn.fetch(queries.catalog['coalesce_pings'].numbered, 
+        *ping_columns(latest), settings['HEARTBEAT_REFRESH'])
+
+    return coalesced(latest, [(row[0], row[1]) for row in rows])
+
+class Registry(object):
+    """ Times of the heartbeats that did not change their server.  Those 
+        only refresh an in-memory liveness time, and the times are flushed 
+        to the ping table in bulk.  Whether a heartbeat changed anything is 
+        up to the database, so this holds no state that other processes 
+        could make stale. """
+
+    def __init__(self, flush_interval = 10):
+
+        # Seconds between liveness flushes
+        self.flush_interval = flush_interval
+
+        # (hostname, port): seen at, since the last flush
+        self.pending = {}
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def seen(self, beats):
+        """ Record the liveness of heartbeats for the next flush """
+
+        if not beats:
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            for beat in beats:
+                self.pending[(beat.hostname, beat.port)] = now
+
+        if self._thread is None:
+            self.start()
+
+    def forget(self, hostname, port):
+        """ Forget a server, so no liveness is written for it """
+
+        with self._lock:
+            self.pending.pop((hostname, port), None)
+
+    def flush(self):
+        """ Write the liveness of coalesced heartbeats """
+
+        now = time.monotonic()
+
+        with self._lock:
+            pending, self.pending = self.pending, {}
+
+        seen = [(hostname, port, now - at) for (hostname, port), at in pending.items()]
+
+        if not seen:
+            return 0
+
+        try:
+            with db.transaction() as db_cursor:
+                seen.sort()
+                queries.run(db_cursor, 'refresh_pings', list(map(list, zip(*seen))))
+        except Exception as e:
+            log.error("Writing liveness of %s servers failed: %s" % (len(seen), e))
+            return 0
+
+        return len(seen)
+
+    def _run(self):
+        """ Flusher thread """
+
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def start(self):
+        """ Start the flusher thread """
+
+        with self._lock:
+
+            if self._thread:
+                return
+
+            self._thread = threading.Thread(target=self._run, name='heartbeat-flush', daemon=True)
+            self._thread.start()
+
+class NoRegistry(object):
+    """ Stand-in for Registry when coalescing is disabled """
+
+    def seen(self, beats):
+        pass
+
+    def forget(self, hostname, port):
+        pass
+
+    def flush(self):
+        pass
+
+@singleton
+def registry():
+    """ The registry for the heartbeat settings """
+
+    if settings['HEARTBEAT_COALESCE']:
+        return Registry(settings['HEARTBEAT_FLUSH_INTERVAL'])
+
+    return NoRegistry()
+
+@prefork.on_shutdown
+def flush_registry():
+    """ A stopping worker writes the liveness it has seen """
+
+    if registry.built():
+        registry().flush()
\ No newline at end of file
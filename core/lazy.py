@@ -0,0 +1,50 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+lazy.py
+
+Module-level objects that are created on first use instead of on import, 
+so importing pygsm reads no config and opens nothing.
+"""
+import threading, functools
+
+def singleton(factory):
+    """ Make a factory return the object it created on its first call 
+        every time.  The result also has built(), which tells whether that 
+        call happened yet. """
+
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+
+        if not instance:
+            with lock:
+                # Another thread may have created it while this one waited
+                if not instance:
+                    instance.append(factory())
+
+        return instance[0]
+
+    get.built = lambda: bool(instance)
+
+    return get
@@ -0,0 +1,377 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+leaderboard.py
+
+Leaderboard writes.  Kills and deaths are either written right away or, 
+with write_behind enabled in the Leaderboard config section, queued in 
+memory and flushed in bulk.
+"""
+import math, time, atexit, threading
+from datetime import datetime, timezone
+
+import psycopg2
+
+from core import log, db, metrics, queries, prefork
+from core.config import settings
+from core.lazy import singleton
+from core.versions import versions
+from utilities import int4
+
+def player_id(value):
+    """ Check a game_player_id.  Raises ValueError if it can not be one. """
+    return int4(value, 'game_player_id', 1)
+
+def check_stats(game_player_id, kills = 0, deaths = 0):
+    """ Check a kill/death delta before it is written or queued, so it can 
+        not fail the statement it is written with.  Raises ValueError. """
+
+    player_id(game_player_id)
+    int4(kills, 'kills')
+    int4(deaths, 'deaths')
+
+def record_stats(db_cursor, deltas):
+    """ Add kills and deaths for a dict of game_player_id to (kills, deaths) 
+        in one statement.  Inserts the leaderboard rows and updates the 
+        players' totals.  Unknown game_player_ids are skipped.  Returns the 
+        amount of players written. """
+
+    if not deltas:
+        return 0
+
+    queries.run(db_cursor, 'record_stats', stats_columns(deltas))
+
+    return db_cursor.rowcount
+
+def stats_columns(deltas):
+    """ The record_stats parameters of a set of deltas, one list per column """
+
+    rows = sorted(deltas.items())
+
+    return [r[0] for r in rows], [r[1][0] for r in rows], [r[1][1] for r in rows]
+
+async def record_stats_async(conn, deltas):
+    """ record_stats for an asyncpg connection """
+
+    if not deltas:
+        return 0
+
+    status = await conn.execute(queries.catalog['record_stats'].numbered, *stats_columns(deltas))
+
+    # Status is "INSERT 0 <rows>"
+    return int(status.split()[-1])
+
+def event_time(value):
+    """ Unix time of a kill event, given as Unix time or an ISO 8601 
+        string.  Times without a zone are UTC.  Raises ValueError for 
+        times that are not finite, in the future or older than 
+        game_max_age days. """
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            stamp = float(value)
+        except OverflowError:
+            raise ValueError("timestamp must be a finite number")
+    elif isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        stamp = parsed.timestamp()
+    else:
+        raise ValueError("timestamp must be a Unix time or an ISO 8601 string")
+
+    if not math.isfinite(stamp):
+        raise ValueError("timestamp must be a finite number")
+
+    now = time.time()
+
+    # Allow for clocks that are a little ahead
+    if stamp > now + 60:
+        raise ValueError("timestamp is in the future")
+    elif stamp < now - settings['GAME_MAX_AGE'] * 86400:
+        raise ValueError("timestamp is older than %s days" % settings['GAME_MAX_AGE'])
+
+    return stamp
+
+def record_kills(db_cursor, events):
+    """ Write a list of kill events of (alive_game_player_id, 
+        dead_game_player_id, Unix time or None) in one statement.  Events 
+        with an unknown game_player_id are skipped.  Returns None for every 
+        written event and an error message for every skipped one, in 
+        order. """
+
+    players = sorted(set(p for event in events for p in event[:2] if p))
+
+    queries.run(db_cursor, 'known_players', (players, ))
+    known = set(row[0] for row in db_cursor.fetchall())
+
+    errors = []
+    valid = []
+
+    for event in events:
+        unknown = [str(p) for p in event[:2] if p and p not in known]
+
+        if unknown:
+            errors.append("Unknown game_player_id %s" % ', '.join(unknown))
+        else:
+            errors.append(None)
+            valid.append(event)
+
+    if valid:
+        queries.run(db_cursor, 'record_kills', [list(column) for column in zip(*valid)])
+
+    return errors
+
+def rebuild_totals():
+    """ Recompute leaderboard_total from the leaderboard rows.  Writes to 
+        the leaderboard wait until the rebuild is done.  Returns the amount 
+        of players. """
+
+    with db.transaction() as db_cursor:
+
+        db_cursor.execute("LOCK TABLE leaderboard, leaderboard_total IN SHARE ROW EXCLUSIVE MODE")
+        db_cursor.execute("DELETE FROM leaderboard_total")
+        db_cursor.execute("""INSERT INTO leaderboard_total 
+            (game_player_id, game_uuid, dev, kills, deaths, updated_at)
+            SELECT game_player_id, gp.game_uuid, g.dev, SUM(kills), SUM(deaths), now()
+            FROM leaderboard
+            JOIN game_player gp USING (game_player_id)
+            JOIN game g USING (game_uuid)
+            GROUP BY game_player_id, gp.game_uuid, g.dev""")
+        players = db_cursor.rowcount
+
+    versions().bump('leaderboard')
+
+    return players
+
+def ranking(db_cursor, order = 'kills', dev = False, game_uuid = None, 
+    limit = 100, after = None):
+    """ Query the players ranked by kills, deaths or K/D, best first.  
+        after is the (score, game_player_id) of the last row of the 
+        previous page.  Returns the rows with a score column. """
+
+    params = [game_uuid] if game_uuid else [dev]
+
+    if after:
+        params.extend(after)
+
+    params.append(limit)
+
+    queries.run(db_cursor, queries.ranking_name(order, bool(game_uuid), bool(after)), params)
+
+    return db_cursor.fetchall()
+
+class KillBuffer(object):
+    """ Queues kill/death deltas and flushes them merged per player """
+
+    def __init__(self, flush_size = 500, flush_interval = 1.0):
+
+        # Flush once this many events are queued
+        self.flush_size = flush_size
+
+        # Flush at least this often, in seconds
+        self.flush_interval = flush_interval
+
+        self.deltas = {}
+        self.events = 0
+
+        self.flushes = 0
+        self.flushed_events = 0
+        self.dropped = 0
+        self.flush_last = 0.0
+        self.flush_max = 0.0
+        self.flush_total = 0.0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def add(self, game_player_id, kills = 0, deaths = 0):
+        """ Queue a kill/death delta for a player """
+
+        if not self._running:
+            self.start()
+
+        with self._lock:
+            current = self.deltas.get(game_player_id, (0, 0))
+            self.deltas[game_player_id] = (current[0] + kills, current[1] + deaths)
+            self.events += 1
+            full = self.events >= self.flush_size
+
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """ Write everything queued so far """
+
+        with self._flush_lock:
+
+            with self._lock:
+                deltas, self.deltas = self.deltas, {}
+                events, self.events = self.events, 0
+
+            if not deltas:
+                return 0
+
+            start = time.monotonic()
+            written, dropped, failed = self._write(deltas)
+            elapsed = time.monotonic() - start
+
+            if len(failed) == len(deltas):
+                self._requeue(deltas, events)
+                return 0
+            elif failed:
+                self._requeue(failed, len(failed))
+                events -= len(failed)
+
+            if written:
+                versions().bump('leaderboard')
+
+            if dropped:
+                log.warning("Leaderboard flush dropped %s game_player_ids" % dropped)
+
+            self.flushes += 1
+            self.flushed_events += events
+            self.dropped += dropped
+            self.flush_last = elapsed
+            self.flush_total += elapsed
+            self.flush_max = max(self.flush_max, elapsed)
+
+            return written
+
+    def _write(self, deltas):
+        """ Write deltas in as few transactions as possible.  When the 
+            database rejects the data, they are written in halves until 
+            the bad players are found, which are dropped.  When it can not 
+            be reached, what is left is returned to be queued again.  
+            Returns the amount of players written, the amount dropped and 
+            the deltas that failed. """
+
+        written = dropped = 0
+        pending = [sorted(deltas.items())]
+
+        while pending:
+            rows = pending.pop()
+
+            try:
+                with db.transaction() as db_cursor:
+                    count = record_stats(db_cursor, dict(rows))
+
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                if len(rows) > 1:
+                    middle = len(rows) // 2
+                    pending.extend((rows[middle:], rows[:middle]))
+                else:
+                    log.error("Leaderboard flush dropped game_player_id %s: %s" % (rows[0][0], e))
+                    dropped += 1
+                continue
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, db.PoolTimeout) as e:
+                failed = dict(rows)
+                for rows in pending:
+                    failed.update(rows)
+                log.error("Leaderboard flush of %s players failed: %s" % (len(failed), e))
+                return written, dropped, failed
+
+            except Exception as e:
+                log.error("Leaderboard flush dropped %s players: %s" % (len(rows), e))
+                dropped += len(rows)
+                continue
+
+            # Unknown game_player_ids are skipped
+            written += count
+            dropped += len(rows) - count
+
+        return written, dropped, {}
+
+    def _requeue(self, deltas, events):
+        """ Put deltas from a failed flush back in the queue """
+
+        with self._lock:
+            for game_player_id, (kills, deaths) in deltas.items():
+                current = self.deltas.get(game_player_id, (0, 0))
+                self.deltas[game_player_id] = (current[0] + kills, current[1] + deaths)
+            self.events += events
+
+    def _run(self):
+        """ Flusher thread """
+
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        """ Start the flusher thread """
+
+        with self._lock:
+
+            if self._running:
+                return
+
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='leaderboard-flush', daemon=True)
+            self._thread.start()
+
+        if settings['LEADERBOARD_FLUSH_ON_SHUTDOWN']:
+            atexit.register(self.stop)
+
+    def stop(self):
+        """ Stop the flusher thread and write what is left """
+
+        self._running = False
+        self._wakeup.set()
+
+        if self._thread:
+            self._thread.join(self.flush_interval + 5)
+
+        self.flush()
+
+    def stats(self):
+        """ Queue depth and flush latency """
+
+        with self._lock:
+            return {
+                'queued_events': self.events,
+                'queued_players': len(self.deltas),
+                'flushes': self.flushes,
+                'flushed_events': self.flushed_events,
+                'dropped': self.dropped,
+                'flush_last': self.flush_last,
+                'flush_max': self.flush_max,
+                'flush_avg': self.flush_total / self.flushes if self.flushes else 0.0,
+            }
+
+@singleton
+def kill_buffer():
+    """ The write-behind buffer of this process """
+    return KillBuffer(settings['LEADERBOARD_FLUSH_SIZE'], settings['LEADERBOARD_FLUSH_INTERVAL'])
+
+metrics.Gauges('pygsm_leaderboard_buffer', lambda: kill_buffer().stats())
+
+@prefork.on_shutdown
+def flush_kill_buffer():
+    """ A stopping worker writes what it has queued """
+
+    if kill_buffer.built() and settings['LEADERBOARD_FLUSH_ON_SHUTDOWN']:
+        kill_buffer().stop()
\ No newline at end of file
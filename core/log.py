@@ -18,22 +18,41 @@ See the GNU General Public License for more details. You should have
 received a copy of the GNU General Public License along with pygsm. If 
 not, see <http://www.gnu.org/licenses/>.
 """
-import logging
+import sys, logging, threading
 from datetime import datetime
 
 from core.config import settings
 
-logging.basicConfig(filename = settings['LOG_FILE'], level = settings['LOG_LEVEL'])
+this = sys.modules[__name__]
+
+this.configured = False
+configure_lock = threading.Lock()
+
+def configure():
+    """ Open the log file of the settings.  Done on the first message, so
+        importing this does not read the config or touch the file. """
+
+    with configure_lock:
+        if this.configured:
+            return
+
+        logging.basicConfig(filename = settings['LOG_FILE'], level = settings['LOG_LEVEL'])
+        this.configured = True
+
+    logging.debug("Log opened on %s" % datetime.now())
 
 def debug(msg):
+    this.configured or configure()
     logging.debug(msg)
 def info(msg):
+    this.configured or configure()
     logging.info(msg)
 def warning(msg):
+    this.configured or configure()
     logging.warning(msg)
 def error(msg):
+    this.configured or configure()
     logging.error(msg)
 def critical(msg):
-    logging.critical(msg)
-
-debug("Log opened on %s" % datetime.now())
\ No newline at end of file
+    this.configured or configure()
+    logging.critical(msg)
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+metrics.py
+
+Lightweight counters and histograms, rendered in the Prometheus text 
+format by GET /metrics.  This module must not import anything from pygsm 
+so every other module can use it.
+"""
+import bisect, threading
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+# Every metric and gauge collector, in registration order
+registry = []
+
+def escape(value):
+    """ Escape a label value """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra = None):
+    """ Format label names and values as {a="1",b="2"} """
+
+    pairs = ['%s="%s"' % (name, escape(value)) for name, value in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+class Counter(object):
+    """ A value that only goes up, per set of labels """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels = ()):
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+        registry.append(self)
+
+    def inc(self, *labels, amount = 1):
+        """ Increment the counter for the given label values """
+
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+
+        with self._lock:
+            values = list(self.values.items())
+
+        return ['%s%s %s' % (self.name, format_labels(self.labels, labels), value) 
+            for labels, value in values]
+
+class Histogram(object):
+    """ Distribution of observed values, per set of labels """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels = (), buckets = DEFAULT_BUCKETS):
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+
+        # labels: [bucket counts..., +Inf count, sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        """ Record a value for the given label values """
+
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self):
+
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self.values.items()]
+
+        lines = []
+
+        for labels, counts in values:
+
+            total = 0
+
+            for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                total += count
+                lines.append('%s_bucket%s %s' % (self.name, 
+                    format_labels(self.labels, labels, 'le="%s"' % bound), total))
+
+            lines.append('%s_sum%s %s' % (self.name, format_labels(self.labels, labels), counts[-1]))
+            lines.append('%s_count%s %s' % (self.name, format_labels(self.labels, labels), total))
+
+        return lines
+
+class Gauges(object):
+    """ Exposes the numbers in the dict returned by a function as gauges 
+        named prefix_key.  None values are left out. """
+
+    kind = 'gauge'
+
+    def __init__(self, prefix, collect, help = None):
+
+        self.prefix = prefix
+        self.collect = collect
+        self.help = help
+
+        registry.append(self)
+
+    def render(self):
+
+        lines = []
+
+        for key, value in sorted(self.collect().items()):
+
+            if value is None:
+                continue
+
+            name = '%s_%s' % (self.prefix, key)
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %s' % (name, float(value)))
+
+        return lines
+
+def render():
+    """ Render all metrics in the Prometheus text format """
+
+    lines = []
+
+    for metric in registry:
+
+        if isinstance(metric, Gauges):
+            lines.extend(metric.render())
+            continue
+
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend(metric.render())
+
+    return '\n'.join(lines) + '\n'
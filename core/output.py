@@ -0,0 +1,251 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+output.py
+
+Output formats for the API.  The default format negotiates the response 
+with the client: MessagePack instead of JSON for clients that ask for it 
+in Accept, and gzip or deflate compression of large bodies for clients 
+that allow it in Accept-Encoding.  msgpack is only needed for the former.
+"""
+import io, zlib, json as _json
+from uuid import UUID
+from decimal import Decimal
+from datetime import date, datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import hug
+
+from core.config import settings
+
+def encode_default(o):
+    """ Encode values the json module does not know about """
+
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+
+    raise TypeError("%r is not JSON serializable" % o)
+
+def encode(obj):
+    """ Encode an object the same way the JSON output would """
+    return _json.dumps(obj, default=encode_default, ensure_ascii=False).encode('utf8')
+
+def pack_default(o):
+    """ Encode values msgpack does not know about like the JSON output """
+
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    elif isinstance(o, UUID):
+        return str(o)
+    elif isinstance(o, Decimal):
+        return float(o)
+
+    raise TypeError("%r is not MessagePack serializable" % o)
+
+def pack(content):
+    """ Encode content as MessagePack.  Bytes are taken to be encoded JSON. """
+
+    if isinstance(content, bytes):
+        content = _json.loads(content.decode('utf8'))
+
+    return msgpack.packb(content, default=pack_default, use_bin_type=True)
+
+def quality(header, *values):
+    """ The highest q value an Accept style header gives any of values, or 
+        0 if it lists none of them """
+
+    best = 0.0
+
+    for part in (header or '').split(','):
+        fields = part.split(';')
+
+        if fields[0].strip().lower() not in values:
+            continue
+
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        best = max(best, q)
+
+    return best
+
+def negotiate(accept = None, accept_encoding = None):
+    """ Pick the format and content coding of a response from the request 
+        headers.  Returns 'json' or 'msgpack', and 'gzip', 'deflate' or 
+        None. """
+
+    media = 'json'
+
+    if msgpack is not None and settings['OUTPUT_MSGPACK']:
+        packed = quality(accept, 'application/msgpack', 'application/x-msgpack')
+
+        # JSON stays the default unless the client prefers MessagePack
+        if packed > quality(accept, 'application/json'):
+            media = 'msgpack'
+
+    coding = None
+
+    if settings['OUTPUT_COMPRESS']:
+        gzip = quality(accept_encoding, 'gzip', 'x-gzip')
+        deflate = quality(accept_encoding, 'deflate')
+
+        if gzip and gzip >= deflate:
+            coding = 'gzip'
+        elif deflate:
+            coding = 'deflate'
+
+    return media, coding
+
+def compressor(coding):
+    """ A zlib compressor for a content coding """
+
+    # gzip and zlib (HTTP deflate) headers
+    wbits = 31 if coding == 'gzip' else 15
+
+    return zlib.compressobj(settings['OUTPUT_COMPRESS_LEVEL'], zlib.DEFLATED, wbits)
+
+def compress(body, coding):
+    """ Compress a body with a content coding """
+
+    c = compressor(coding)
+    return c.compress(body) + c.flush()
+
+def compress_stream(chunks, coding):
+    """ Compress an iterable of chunks with a content coding """
+
+    c = compressor(coding)
+
+    for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+
+    yield c.flush()
+
+class Stream(io.RawIOBase):
+    """ File-like object that reads from an iterable of bytes, so a body 
+        can be sent while it is still being generated """
+
+    def __init__(self, chunks, close = None):
+
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+        # Called when the WSGI server is done with the stream
+        self._close = close
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return size
+
+    def close(self):
+
+        if not self.closed and self._close:
+            self._close()
+
+        super().close()
+
+@hug.format.content_type('application/json; charset=utf-8')
+def json(content, request=None, response=None, **kwargs):
+    """ JSON output that passes already encoded bodies and streams through 
+        as-is """
+
+    if isinstance(content, bytes) or hasattr(content, 'read'):
+        return content
+
+    return hug.output_format.json(content, request=request, response=response, **kwargs)
+
+@hug.format.content_type('application/json; charset=utf-8')
+def api(content, request=None, response=None, **kwargs):
+    """ The default output.  JSON, or MessagePack for clients that prefer 
+        it, compressed when the client accepts it and the body is at least 
+        compress_min_size bytes.  Streams are always JSON and compressed 
+        regardless of size. """
+
+    if request is None or response is None:
+        return json(content, request=request, response=response, **kwargs)
+
+    media, coding = negotiate(request.get_header('Accept'), 
+        request.get_header('Accept-Encoding'))
+
+    response.set_header('Vary', 'Accept, Accept-Encoding')
+
+    if hasattr(content, 'read'):
+
+        if coding:
+            response.set_header('Content-Encoding', coding)
+            chunks = iter(lambda: content.read(65536), b'')
+            return Stream(compress_stream(chunks, coding), close=content.close)
+
+        return content
+
+    if media == 'msgpack':
+        response.content_type = 'application/msgpack'
+        body = pack(content)
+    else:
+        body = json(content, request=request, response=response, **kwargs)
+
+    if coding and len(body) >= settings['OUTPUT_COMPRESS_MIN_SIZE']:
+        response.set_header('Content-Encoding', coding)
+        body = compress(body, coding)
+
+    return body
+
+@hug.format.content_type('text/plain; version=0.0.4; charset=utf-8')
+def prometheus(content, **kwargs):
+    """ Prometheus text exposition format """
+    return content.encode('utf8')
+
+@hug.format.content_type('text/event-stream; charset=utf-8')
+def event_stream(content, request=None, response=None, **kwargs):
+    """ Server-Sent Events.  Anything other than a stream, like an error, 
+        is sent as JSON. """
+
+    if hasattr(content, 'read'):
+        return content
+
+    if response is not None:
+        response.content_type = json.content_type
+
+    return json(content, request=request, response=response, **kwargs)
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+partitions.py
+
+Upkeep of the time partitions of the game and leaderboard tables, for
+databases that have sql/0005_partitioning.sql applied.  Partitions are
+created partition_ahead intervals in advance, and dropped whole once
+everything in them is older than game_max_age days.  The legacy
+partitions made from the old tables by the migration can be split into
+regular partitions with split_legacy().  Nothing is done for tables that
+are not partitioned.
+"""
+import re
+from datetime import datetime, timedelta
+from psycopg2 import sql
+
+from core import log, db
+from core.config import settings
+
+# Partitioned tables and the columns to move when splitting them
+tables = {
+    'game': ('game_uuid', 'stamp', 'dev'),
+    'leaderboard': ('leaderboard_id', 'game_player_id', 'kills', 'deaths', 'stamp'),
+}
+
+def floor(stamp, interval = 'month'):
+    """ Start of the interval a time is in """
+
+    day = datetime(stamp.year, stamp.month, stamp.day)
+
+    if interval == 'month':
+        return day.replace(day=1)
+    elif interval == 'week':
+        return day - timedelta(days=day.weekday())
+
+    return day
+
+def advance(stamp, interval = 'month'):
+    """ Start of the interval after the one a time is in """
+
+    start = floor(stamp, interval)
+
+    if interval == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    elif interval == 'week':
+        return start + timedelta(days=7)
+
+    return start + timedelta(days=1)
+
+def partition_name(table, start):
+    return '%s_p%s' % (table, start.strftime('%Y%m%d'))
+
+def database_now():
+    """ The current time as the database stamps rows """
+
+    with db.transaction() as db_cursor:
+        db_cursor.execute("SELECT localtimestamp AS now")
+        return db_cursor.fetchone()['now']
+
+def is_partitioned(db_cursor, table):
+    """ Whether a table is partitioned """
+
+    db_cursor.execute("""SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass(%s)""", (table, ))
+
+    return db_cursor.rowcount > 0
+
+bound_pattern = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+def parse_bound(bound):
+    """ A partition bound as a datetime, or None for MINVALUE/MAXVALUE """
+
+    if bound in ('MINVALUE', 'MAXVALUE'):
+        return None
+
+    return datetime.strptime(bound.strip("'")[:19], '%Y-%m-%d %H:%M:%S')
+
+def partitions(db_cursor, table):
+    """ The range partitions of a table as (name, lower, upper), oldest
+        first.  Open bounds are None. """
+
+    db_cursor.execute("""SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)""", (table, ))
+
+    found = []
+
+    for row in db_cursor.fetchall():
+        match = bound_pattern.search(row['bound'])
+        if match:
+            found.append((row['relname'], parse_bound(match.group(1)), parse_bound(match.group(2))))
+
+    return sorted(found, key=lambda p: p[1] or datetime.min)
+
+def create_partition(db_cursor, table, start, end):
+    """ Add a partition for [start, end) to a table """
+
+    log.info("Creating partition %s for %s to %s" % (partition_name(table, start), start, end))
+
+    db_cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+        sql.Identifier(partition_name(table, start)), sql.Identifier(table)), (start, end))
+
+def create_partitions(table, interval = 'month', ahead = 2, now = None):
+    """ Add partitions to a table up to ahead intervals after the current
+        one.  Returns the amount of partitions created. """
+
+    now = now or database_now()
+
+    horizon = floor(now, interval)
+    for _ in range(ahead + 1):
+        horizon = advance(horizon, interval)
+
+    created = 0
+
+    with db.transaction() as db_cursor:
+
+        existing = partitions(db_cursor, table)
+        start = existing[-1][2] if existing else floor(now, interval)
+
+        # Also fills the gap if maintenance has not run for a while
+        while start is not None and start < horizon:
+            end = advance(start, interval)
+            create_partition(db_cursor, table, start, end)
+            start = end
+            created += 1
+
+    return created
+
+def subtract_totals(db_cursor, partition):
+    """ Take the kills and deaths of a leaderboard partition out of the 
+        players' totals, before it is dropped """
+
+    # No new rows while they are counted
+    db_cursor.execute(sql.SQL("LOCK TABLE {} IN EXCLUSIVE MODE").format(partition))
+
+    # Lock the totals in the order record_stats does
+    db_cursor.execute(sql.SQL("""SELECT 1 FROM leaderboard_total
+        WHERE game_player_id IN (SELECT game_player_id FROM {})
+        ORDER BY game_player_id FOR UPDATE""").format(partition))
+
+    db_cursor.execute(sql.SQL("""UPDATE leaderboard_total t
+        SET kills = t.kills - d.kills, deaths = t.deaths - d.deaths, updated_at = now()
+        FROM (
+            SELECT game_player_id, SUM(kills) AS kills, SUM(deaths) AS deaths
+            FROM {} GROUP BY game_player_id
+        ) d
+        WHERE t.game_player_id = d.game_player_id""").format(partition))
+
+def drop_expired(table, cutoff):
+    """ Drop the partitions of a table that end before cutoff.  Game
+        partitions with a game that a server still uses are kept, and the
+        players and stats of their games are deleted first.  The stats of 
+        leaderboard partitions are taken out of the totals.  Returns the
+        amount of partitions dropped. """
+
+    with db.transaction() as db_cursor:
+        expired = [p for p in partitions(db_cursor, table) if p[2] is not None and p[2] <= cutoff]
+
+    dropped = 0
+
+    for name, lower, upper in expired:
+
+        partition = sql.Identifier(name)
+
+        with db.transaction() as db_cursor:
+
+            if table == 'game':
+
+                # Stop new references to these games through the triggers,
+                # which take row locks.  Reads go on.
+                db_cursor.execute(sql.SQL("LOCK TABLE {} IN EXCLUSIVE MODE").format(partition))
+
+                db_cursor.execute(sql.SQL("""SELECT 1 FROM ping
+                    WHERE game_uuid IN (SELECT game_uuid FROM {}) LIMIT 1""").format(partition))
+
+                if db_cursor.rowcount > 0:
+                    log.info("Keeping partition %s, a server still uses one of its games" % name)
+                    continue
+
+                games = sql.SQL("SELECT game_uuid FROM {}").format(partition)
+
+                db_cursor.execute(sql.SQL("""DELETE FROM leaderboard
+                    WHERE game_player_id IN (
+                        SELECT game_player_id FROM game_player WHERE game_uuid IN ({})
+                    )""").format(games))
+                db_cursor.execute(sql.SQL("DELETE FROM leaderboard_total WHERE game_uuid IN ({})").format(games))
+                db_cursor.execute(sql.SQL("DELETE FROM game_player WHERE game_uuid IN ({})").format(games))
+
+            elif table == 'leaderboard':
+                subtract_totals(db_cursor, partition)
+
+            log.info("Dropping partition %s" % name)
+
+            db_cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(sql.Identifier(table), partition))
+            db_cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+
+        dropped += 1
+
+    return dropped
+
+def maintain(interval = None, ahead = None, now = None):
+    """ Create upcoming and drop expired partitions of every partitioned
+        table.  Returns the amount of partitions created and dropped. """
+
+    interval = interval or settings['PARTITION_INTERVAL']
+    ahead = settings['PARTITION_AHEAD'] if ahead is None else ahead
+    now = now or database_now()
+
+    cutoff = now - timedelta(days=settings['GAME_MAX_AGE'])
+
+    created = 0
+    dropped = 0
+
+    for table in tables:
+
+        with db.transaction() as db_cursor:
+            partitioned = is_partitioned(db_cursor, table)
+
+        if partitioned:
+            created += create_partitions(table, interval, ahead, now)
+            dropped += drop_expired(table, cutoff)
+
+    return created, dropped
+
+def split_legacy(table, interval = None, now = None):
+    """ Move the oldest interval of rows out of the legacy partition of a
+        table into a partition of its own, in one transaction.  Writes to
+        the table wait until it is done.  Returns the amount of rows moved,
+        or None once the legacy partition is gone. """
+
+    interval = interval or settings['PARTITION_INTERVAL']
+    now = now or database_now()
+
+    parent = sql.Identifier(table)
+    columns = sql.SQL(', ').join(map(sql.Identifier, tables[table]))
+
+    with db.transaction() as db_cursor:
+
+        legacy = [p for p in partitions(db_cursor, table) if p[0] == table + '_legacy']
+
+        if not legacy:
+            return None
+
+        name, lower, upper = legacy[0]
+        partition = sql.Identifier(name)
+
+        db_cursor.execute(sql.SQL("SELECT min(stamp) AS oldest FROM {}").format(partition))
+        oldest = db_cursor.fetchone()['oldest']
+
+        db_cursor.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {}").format(parent, partition))
+
+        if oldest is None:
+
+            # Empty, but its range may still be needed for new rows
+            db_cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+
+            if upper > now:
+                create_partition(db_cursor, table, max(lower or floor(now, interval), floor(now, interval)), upper)
+
+            return 0
+
+        start = floor(oldest, interval)
+        if lower is not None:
+            start = max(start, lower)
+        end = min(advance(start, interval), upper)
+
+        create_partition(db_cursor, table, start, end)
+
+        db_cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} WHERE stamp < %s").format(
+            parent, columns, columns, partition), (end, ))
+        moved = db_cursor.rowcount
+
+        if end < upper:
+            db_cursor.execute(sql.SQL("DELETE FROM {} WHERE stamp < %s").format(partition), (end, ))
+            db_cursor.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+                parent, partition), (end, upper))
+        else:
+            db_cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+
+    return moved
@@ -0,0 +1,273 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+prefork.py
+
+Pre-fork launcher, run with `python manage.py serve`.  The parent process 
+binds the listening socket, forks the workers, and starts a new worker 
+when one dies.  Every worker serves the WSGI app on the shared socket with 
+a threaded server.
+
+Modules register hooks here for what must not be shared across the fork: 
+before_fork hooks run in the parent, on_startup hooks in every worker 
+before it serves, and on_shutdown hooks when it stops.  That is how each 
+worker gets its own database connections.
+"""
+import os, sys, time, fcntl, signal, socket, threading
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+from core import log
+
+# We want to assign directly to this module
+this = sys.modules[__name__]
+
+# Index of this worker, None when not running under the launcher
+this.worker_id = None
+
+this.before_fork_hooks = []
+this.startup_hooks = []
+this.shutdown_hooks = []
+this.leader_hooks = []
+
+# The leader lock file, open for as long as this process holds the lock
+this.leader_file = None
+this.election_lock = threading.Lock()
+this.electing = False
+
+# Workers that die sooner than this after starting are started again only 
+# after a pause, so a broken worker does not fork in a tight loop
+restart_delay = 1.0
+
+def before_fork(func):
+    """ Register a function to run in the parent before forking """
+    this.before_fork_hooks.append(func)
+    return func
+
+def on_startup(func):
+    """ Register a function to run in every worker before it serves """
+    this.startup_hooks.append(func)
+    return func
+
+def on_shutdown(func):
+    """ Register a function to run in every worker when it stops.  These 
+        run in reverse order. """
+    this.shutdown_hooks.append(func)
+    return func
+
+def on_leader(func):
+    """ Register a function to run once this process becomes the leader """
+    this.leader_hooks.append(func)
+    return func
+
+def is_leader():
+    """ Whether this process runs the tasks that are needed once per host, 
+        like maintenance and the UDP listener.  That is the process that 
+        holds the leader lock, see elect(). """
+
+    return this.leader_file is not None
+
+def elect(path, retry = 5.0):
+    """ Try to become the leader of the processes that use the lock file 
+        path, whether they are workers of the launcher, of another server 
+        like gunicorn, or on their own.  The leader runs the leader hooks.  
+        The others keep trying every retry seconds, so one of them takes 
+        over when the leader stops.  Returns whether this process leads. """
+
+    with this.election_lock:
+        if this.electing:
+            return is_leader()
+        this.electing = True
+
+    if take_lead(path):
+        return True
+
+    def campaign():
+        while not take_lead(path):
+            time.sleep(retry)
+
+    threading.Thread(target=campaign, name='leader-election', daemon=True).start()
+
+    return False
+
+def take_lead(path):
+    """ Lock the leader lock file and run the leader hooks.  Returns 
+        whether this process holds the lock. """
+
+    try:
+        leader_file = open(path, 'a')
+    except OSError as e:
+        log.error("Could not open the leader lock %s: %s" % (path, e))
+        return False
+
+    try:
+        fcntl.flock(leader_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        leader_file.close()
+        return False
+
+    this.leader_file = leader_file
+
+    log.info("Process %s is the leader" % os.getpid())
+    run_hooks(this.leader_hooks)
+
+    return True
+
+def run_hooks(hooks):
+    """ Run hooks, logging the ones that fail """
+
+    for hook in hooks:
+        try:
+            hook()
+        except Exception as e:
+            log.error("Worker hook %s failed: %s" % (hook.__name__, e))
+
+class RequestHandler(WSGIRequestHandler):
+    """ Request handler that leaves logging to the app's metrics """
+
+    def log_message(self, format, *args):
+        pass
+
+class WorkerServer(ThreadingMixIn, WSGIServer):
+    """ Threaded WSGI server on an inherited listening socket """
+
+    daemon_threads = True
+
+    def __init__(self, sock, app):
+
+        WSGIServer.__init__(self, sock.getsockname(), RequestHandler, bind_and_activate=False)
+
+        self.socket.close()
+        self.socket = sock
+
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(app)
+
+def run_worker(worker_id, sock, app_factory):
+    """ Serve in a forked worker until told to stop """
+
+    this.worker_id = worker_id
+
+    run_hooks(this.startup_hooks)
+
+    server = WorkerServer(sock, app_factory())
+
+    # shutdown() waits for serve_forever(), so it can't run in this thread
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log.info("Worker %s (pid %s) serving" % (worker_id, os.getpid()))
+
+    server.serve_forever()
+
+    # In reverse, so hooks registered later still have what earlier ones 
+    # set up, like the database connections
+    run_hooks(reversed(this.shutdown_hooks))
+
+    log.info("Worker %s (pid %s) stopped" % (worker_id, os.getpid()))
+
+def serve(app_factory, host = '0.0.0.0', port = 8000, workers = None):
+    """ Fork workers that serve the WSGI app returned by app_factory on 
+        host:port, and keep them running until SIGTERM or SIGINT.  
+        app_factory is called in every worker after its startup hooks. """
+
+    workers = workers or os.cpu_count() or 1
+
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+
+    run_hooks(this.before_fork_hooks)
+
+    children = {}
+    stopping = []
+
+    def spawn(worker_id):
+
+        pid = os.fork()
+
+        if pid == 0:
+
+            code = 0
+
+            try:
+                run_worker(worker_id, sock, app_factory)
+            except BaseException as e:
+                log.error("Worker %s failed: %s" % (worker_id, e))
+                code = 1
+            finally:
+                # Don't return into the parent's code
+                os._exit(code)
+
+        children[pid] = (worker_id, time.monotonic())
+
+    def stop(signum, frame):
+
+        if not stopping:
+            log.info("Stopping %s workers" % len(children))
+
+        stopping.append(signum)
+
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log.info("Serving on %s:%s with %s workers" % (host, port, workers))
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    while children:
+
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        worker_id, started = children.pop(pid, (None, None))
+
+        if worker_id is None or stopping:
+            continue
+
+        log.error("Worker %s (pid %s) exited with status %s, starting it again" % (worker_id, pid, status))
+
+        if time.monotonic() - started < restart_delay:
+            time.sleep(restart_delay)
+
+        # Stopped while sleeping
+        if not stopping:
+            spawn(worker_id)
+
+    sock.close()
+
+    return 0
@@ -0,0 +1,350 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+queries.py
+
+Catalog of the SQL statements pygsm runs on the request and heartbeat
+paths.  Every statement is defined once here and run by name, so its
+metrics are labelled by that name.  The hot ones are prepared once per
+connection, and later calls only send EXECUTE with the parameters, which
+skips parsing and planning them again.
+
+Placeholders are written as %s with a cast, e.g. %s::int.  The casts give
+the parameter types to prepare a statement with, and the $1-style text
+for asyncpg is derived from the same definition.
+"""
+import re
+from itertools import count
+
+from core import db
+from core.config import settings
+
+placeholder = re.compile(r'%s::(\w+(?:\[\])?)')
+
+class Query(object):
+    """ A named SQL statement """
+
+    def __init__(self, name, text, prepare = False):
+
+        self.name = name
+        self.text = text
+        self.prepare = prepare
+        self.types = placeholder.findall(text)
+
+        if len(self.types) != text.count('%s'):
+            raise ValueError("Every placeholder of query %s needs a cast" % name)
+
+        number = count(1)
+
+        # Same statement with $1, $2, ... for PREPARE and asyncpg
+        self.numbered = re.sub(r'%s', lambda m: '$%d' % next(number), text)
+
+        if self.types:
+            self.prepare_text = "PREPARE %s (%s) AS %s" % (name, ', '.join(self.types), self.numbered)
+            self.execute_text = "EXECUTE %s (%s)" % (name, ', '.join('%%s::%s' % t for t in self.types))
+        else:
+            self.prepare_text = "PREPARE %s AS %s" % (name, self.numbered)
+            self.execute_text = "EXECUTE %s" % name
+
+        # Label the metrics of every form of the statement by its name
+        db.statement_labels[self.text] = name
+        db.statement_labels[self.execute_text] = name
+        db.statement_labels[self.prepare_text] = 'PREPARE ' + name
+
+catalog = {}
+
+def define(name, text, prepare = False):
+    """ Add a statement to the catalog """
+
+    catalog[name] = Query(name, text, prepare)
+
+    return catalog[name]
+
+def run(db_cursor, name, params = ()):
+    """ Run a statement of the catalog on a cursor.  Prepared statements
+        are prepared on the cursor's connection the first time they are
+        run on it.  Returns the cursor. """
+
+    query = catalog[name]
+
+    if not (query.prepare and settings['DB_PREPARE']):
+        db_cursor.execute(query.text, params)
+        return db_cursor
+
+    # Prepared statements belong to the session and outlive transactions,
+    # so they stay usable until the pool closes the connection
+    prepared = db_cursor.connection.prepared
+
+    if name not in prepared:
+        db_cursor.execute(query.prepare_text)
+        prepared.add(name)
+
+    db_cursor.execute(query.execute_text, params)
+
+    return db_cursor
+
+""" Authentication """
+
+define('psk', """SELECT psk, development, description FROM psk
+    WHERE active = true AND psk = %s::varchar""", prepare=True)
+
+""" Servers """
+
+# Takes the server timeout in seconds
+define('live_servers', """SELECT hostname, port, name, ping, active, max, dev, game_uuid, region
+    FROM ping
+    WHERE ping > now() - %s::float8 * interval '1 second'
+    AND down = false""", prepare=True)
+
+# Takes one array per column.  ON CONFLICT can not touch the same row twice
+# in one statement, so the servers must be unique.
+define('upsert_pings', """INSERT INTO ping
+    (hostname, port, name, ping, active, max, dev, game_uuid, region)
+    SELECT v.hostname, v.port, v.name, now(), v.active, v.max, v.dev, v.game_uuid, v.region
+    FROM unnest(%s::varchar[], %s::int[], %s::varchar[], %s::int[], %s::int[],
+        %s::boolean[], %s::uuid[], %s::varchar[])
+        AS v (hostname, port, name, active, max, dev, game_uuid, region)
+    ON CONFLICT ON CONSTRAINT ping_hostname_port_key DO UPDATE
+    SET name = EXCLUDED.name, ping = EXCLUDED.ping,
+    active = EXCLUDED.active, max = EXCLUDED.max, dev = EXCLUDED.dev,
+    game_uuid = EXCLUDED.game_uuid, down = false,
+    region = COALESCE(EXCLUDED.region, ping.region)""", prepare=True)
+
+# upsert_pings for heartbeat coalescing.  Rows that already hold the
+# state of the heartbeat are left alone unless they are older than the
+# refresh seconds it takes last, so the database rather than any one
+# process decides what changed.  Returns the servers that were written.
+define('coalesce_pings', """INSERT INTO ping
+    (hostname, port, name, ping, active, max, dev, game_uuid, region)
+    SELECT v.hostname, v.port, v.name, now(), v.active, v.max, v.dev, v.game_uuid, v.region
+    FROM unnest(%s::varchar[], %s::int[], %s::varchar[], %s::int[], %s::int[],
+        %s::boolean[], %s::uuid[], %s::varchar[])
+        AS v (hostname, port, name, active, max, dev, game_uuid, region)
+    ON CONFLICT ON CONSTRAINT ping_hostname_port_key DO UPDATE
+    SET name = EXCLUDED.name, ping = EXCLUDED.ping,
+    active = EXCLUDED.active, max = EXCLUDED.max, dev = EXCLUDED.dev,
+    game_uuid = EXCLUDED.game_uuid, down = false,
+    region = COALESCE(EXCLUDED.region, ping.region)
+    WHERE ping.down
+    OR (ping.name, ping.active, ping.max, ping.dev, ping.game_uuid)
+        IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.active, EXCLUDED.max, EXCLUDED.dev, EXCLUDED.game_uuid)
+    OR (EXCLUDED.region IS NOT NULL AND EXCLUDED.region IS DISTINCT FROM ping.region)
+    OR ping.ping < now() - %s::float8 * interval '1 second'
+    RETURNING hostname, port""", prepare=True)
+
+# Takes the hostnames, ports and seconds since the servers were last seen.
+# Never moves a ping back, as another process may have written a newer one.
+define('refresh_pings', """UPDATE ping
+    SET ping = GREATEST(ping.ping, now() - v.age * interval '1 second')
+    FROM unnest(%s::varchar[], %s::int[], %s::float8[]) AS v (hostname, port, age)
+    WHERE ping.hostname = v.hostname AND ping.port = v.port""", prepare=True)
+
+define('server_down', """UPDATE ping SET down = true
+    WHERE hostname = %s::varchar AND port = %s::int RETURNING dev""")
+
+""" Games """
+
+define('existing_games', """SELECT game_uuid FROM game
+    WHERE game_uuid = ANY(%s::uuid[])""", prepare=True)
+
+# game_uuid is not unique on its own once game is partitioned, so new
+# games are locked to keep them from being added twice
+define('lock_games', """SELECT pg_advisory_xact_lock(hashtext(u::text))
+    FROM unnest(%s::uuid[]) AS u""", prepare=True)
+
+define('insert_games', """INSERT INTO game (game_uuid, stamp, dev)
+    SELECT v.game_uuid, now(), v.dev
+    FROM unnest(%s::uuid[], %s::boolean[]) AS v (game_uuid, dev)
+    WHERE NOT EXISTS (SELECT 1 FROM game g WHERE g.game_uuid = v.game_uuid)
+    RETURNING game_uuid""", prepare=True)
+
+# One new game per dev flag, returned in the same order
+define('new_games', """INSERT INTO game (stamp, dev)
+    SELECT now(), v.dev FROM unnest(%s::boolean[]) WITH ORDINALITY AS v (dev, n)
+    ORDER BY v.n
+    RETURNING game_uuid""", prepare=True)
+
+define('game', """SELECT game_uuid, stamp FROM game
+    WHERE game_uuid = %s::uuid AND dev = %s::boolean""")
+
+# Recent games.  Take the maximum age in days and the dev flag.
+recent_games = """SELECT game_uuid, stamp FROM game
+    WHERE stamp > now() - %s::int * interval '1 day' AND dev = %s::boolean"""
+
+define('games', recent_games + " ORDER BY stamp DESC, game_uuid DESC")
+define('games_page', recent_games + " ORDER BY stamp DESC, game_uuid DESC LIMIT %s::int")
+define('games_page_after', recent_games + """ AND (stamp, game_uuid) < (%s::timestamp, %s::uuid)
+    ORDER BY stamp DESC, game_uuid DESC LIMIT %s::int""")
+
+""" Players """
+
+define('add_player', """INSERT INTO game_player (game_uuid, meta)
+    VALUES (%s::uuid, %s::jsonb) RETURNING game_player_id""", prepare=True)
+
+# Several players of one game, in order.  Takes the game_uuid and an array 
+# of their meta data.
+define('add_players', """INSERT INTO game_player (game_uuid, meta)
+    SELECT %s::uuid, p.meta FROM unnest(%s::jsonb[]) WITH ORDINALITY AS p (meta, n)
+    ORDER BY p.n
+    RETURNING game_player_id""", prepare=True)
+
+define('player', """SELECT game_player_id, game_uuid, meta
+    FROM game_player gp
+    WHERE game_player_id = %s::int""")
+
+define('game_players', """SELECT game_player_id, game_uuid, meta
+    FROM game_player gp
+    WHERE game_uuid = %s::uuid""")
+
+# Players of recent games.  Take the maximum age in days and the dev flag.
+recent_players = """SELECT game_player_id, game_uuid
+    FROM game_player gp
+    JOIN game g USING (game_uuid)
+    WHERE g.stamp > now() - %s::int * interval '1 day'
+    AND g.dev = %s::boolean"""
+
+define('players', recent_players + " ORDER BY game_player_id DESC")
+define('players_page', recent_players + " ORDER BY game_player_id DESC LIMIT %s::int")
+define('players_page_after', recent_players + """ AND game_player_id < %s::int
+    ORDER BY game_player_id DESC LIMIT %s::int""")
+
+""" Leaderboard """
+
+# Inserts the leaderboard rows of a set of deltas and adds them to the
+# players' totals.  Takes the game_player_ids, kills and deaths as arrays.
+# Sorted, so concurrent writers lock leaderboard_total rows in the same
+# order.
+define('record_stats', """WITH v (game_player_id, game_uuid, dev, kills, deaths) AS (
+        SELECT v.game_player_id, gp.game_uuid, g.dev, v.kills, v.deaths
+        FROM unnest(%s::int[], %s::int[], %s::int[]) AS v (game_player_id, kills, deaths)
+        JOIN game_player gp USING (game_player_id)
+        JOIN game g USING (game_uuid)
+    ), l AS (
+        INSERT INTO leaderboard (game_player_id, kills, deaths)
+        SELECT game_player_id, kills, deaths FROM v
+    )
+    INSERT INTO leaderboard_total
+    (game_player_id, game_uuid, dev, kills, deaths, updated_at)
+    SELECT game_player_id, game_uuid, dev, kills, deaths, now() FROM v
+    ORDER BY game_player_id
+    ON CONFLICT (game_player_id) DO UPDATE
+    SET kills = leaderboard_total.kills + EXCLUDED.kills,
+    deaths = leaderboard_total.deaths + EXCLUDED.deaths,
+    updated_at = EXCLUDED.updated_at""", prepare=True)
+
+# Takes the killer and victim of each kill, either of which may be null, 
+# and its Unix time or null for now.  Every kill gets its own leaderboard 
+# rows, and the totals are added up per player.
+define('record_kills', """WITH e (alive, dead, stamp) AS (
+        SELECT e.alive, e.dead, COALESCE(to_timestamp(e.stamp)::timestamp, localtimestamp)
+        FROM unnest(%s::int[], %s::int[], %s::float8[]) AS e (alive, dead, stamp)
+    ), v (game_player_id, kills, deaths, stamp) AS (
+        SELECT alive, 1, 0, stamp FROM e WHERE alive IS NOT NULL
+        UNION ALL
+        SELECT dead, 0, 1, stamp FROM e WHERE dead IS NOT NULL
+    ), l AS (
+        INSERT INTO leaderboard (game_player_id, kills, deaths, stamp)
+        SELECT game_player_id, v.kills, v.deaths, v.stamp FROM v
+        JOIN game_player gp USING (game_player_id)
+    )
+    INSERT INTO leaderboard_total
+    (game_player_id, game_uuid, dev, kills, deaths, updated_at)
+    SELECT game_player_id, gp.game_uuid, g.dev, SUM(v.kills), SUM(v.deaths), now()
+    FROM v
+    JOIN game_player gp USING (game_player_id)
+    JOIN game g USING (game_uuid)
+    GROUP BY game_player_id, gp.game_uuid, g.dev
+    ORDER BY game_player_id
+    ON CONFLICT (game_player_id) DO UPDATE
+    SET kills = leaderboard_total.kills + EXCLUDED.kills,
+    deaths = leaderboard_total.deaths + EXCLUDED.deaths,
+    updated_at = EXCLUDED.updated_at""", prepare=True)
+
+define('known_players', """SELECT game_player_id FROM game_player
+    WHERE game_player_id = ANY(%s::int[])""", prepare=True)
+
+define('leaderboard_player', """SELECT gp.game_player_id, gp.game_uuid, gp.meta,
+    COALESCE(t.kills, 0) AS kills, COALESCE(t.deaths, 0) AS deaths
+    FROM game_player gp
+    LEFT JOIN leaderboard_total t USING (game_player_id)
+    WHERE gp.game_player_id = %s::int""")
+
+define('leaderboard_entry', """SELECT gp.game_player_id, gp.game_uuid, gp.meta,
+    SUM(kills) AS kills, SUM(deaths) AS deaths
+    FROM leaderboard l
+    JOIN game_player gp USING (game_player_id)
+    WHERE leaderboard_id = %s::int
+    GROUP BY gp.game_player_id""")
+
+# Ranking expressions and their types.  These must match the
+# leaderboard_total indexes so a top-N read walks an index instead of
+# sorting.
+rankings = {
+    'kills': ("t.kills", 'int'),
+    'deaths': ("t.deaths", 'int'),
+    'kd': ("(t.kills::float8 / GREATEST(t.deaths, 1))", 'float8'),
+}
+
+def ranking_name(order, game = False, after = False):
+    """ Catalog name of a ranking query """
+
+    return 'ranking_%s%s%s' % (order, '_game' if game else '', '_after' if after else '')
+
+def define_rankings():
+    """ Add a ranking query for every order, with and without a game and a
+        page to start after """
+
+    for order, (score, score_type) in rankings.items():
+        for game in (False, True):
+            for after in (False, True):
+
+                expression = score
+                player = "t.game_player_id"
+
+                if game:
+
+                    # Every player of the game, including those without stats yet
+                    expression = score.replace("t.kills", "COALESCE(t.kills, 0)").replace("t.deaths", "COALESCE(t.deaths, 0)")
+                    player = "gp.game_player_id"
+                    query = """SELECT gp.game_player_id, gp.game_uuid, gp.meta,
+                        COALESCE(t.kills, 0) AS kills, COALESCE(t.deaths, 0) AS deaths,
+                        {score} AS score
+                        FROM game_player gp
+                        LEFT JOIN leaderboard_total t USING (game_player_id)
+                        WHERE gp.game_uuid = %s::uuid"""
+
+                else:
+
+                    query = """SELECT t.game_player_id, t.game_uuid, gp.meta,
+                        t.kills, t.deaths, {score} AS score
+                        FROM leaderboard_total t
+                        JOIN game_player gp USING (game_player_id)
+                        WHERE t.dev = %s::boolean"""
+
+                if after:
+                    query += " AND ({score}, {player}) < (%s::{score_type}, %s::int)"
+
+                query += " ORDER BY {score} DESC, {player} DESC LIMIT %s::int"
+
+                define(ranking_name(order, game, after),
+                    query.format(score=expression, player=player, score_type=score_type))
+
+define_rankings()
@@ -0,0 +1,202 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+reaper.py
+
+Scheduled maintenance that keeps the hot tables small.  Servers that 
+stopped pinging are marked down, and games older than game_max_age are 
+deleted along with their players and leaderboard rows.  All work is done 
+in bounded batches, each in its own transaction.  On a partitioned 
+database, upcoming partitions are created and expired ones dropped too 
+(see core/partitions.py).
+"""
+import time, threading
+
+from core import log, db, metrics, partitions
+from core.config import settings
+from core.lazy import singleton
+from core.events import publish_removes
+from core.versions import versions
+
+def reap_servers(batch_size = 1000):
+    """ Mark servers down that have not pinged within server_timeout, and 
+        delete servers that have been down for longer than game_max_age.  
+        Returns the amount of servers marked down and deleted. """
+
+    marked = 0
+    deleted = 0
+
+    while True:
+        with db.transaction() as db_cursor:
+            db_cursor.execute("""UPDATE ping SET down = true
+                WHERE ping_id IN (
+                    SELECT ping_id FROM ping
+                    WHERE down = false
+                    AND ping < now() - %s * interval '1 second'
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ) RETURNING hostname, port, dev""", (settings['SERVER_TIMEOUT'], batch_size))
+            down = db_cursor.fetchall()
+            count = len(down)
+
+        publish_removes([(row['hostname'], row['port'], row['dev']) for row in down])
+
+        marked += count
+        if count < batch_size:
+            break
+
+    while True:
+        with db.transaction() as db_cursor:
+            db_cursor.execute("""DELETE FROM ping
+                WHERE ping_id IN (
+                    SELECT ping_id FROM ping
+                    WHERE down = true
+                    AND ping < now() - interval '%s days'
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )""", (settings['GAME_MAX_AGE'], batch_size))
+            count = db_cursor.rowcount
+
+        deleted += count
+        if count < batch_size:
+            break
+
+    return marked, deleted
+
+def prune_games(batch_size = 1000):
+    """ Delete games older than game_max_age that no server is using, with 
+        their players and leaderboard rows.  Returns the amount of games 
+        deleted. """
+
+    pruned = 0
+
+    while True:
+        with db.transaction() as db_cursor:
+            db_cursor.execute("""SELECT game_uuid FROM game g
+                WHERE stamp < now() - interval '%s days'
+                AND NOT EXISTS (SELECT 1 FROM ping p WHERE p.game_uuid = g.game_uuid)
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED""", (settings['GAME_MAX_AGE'], batch_size))
+            games = [row['game_uuid'] for row in db_cursor.fetchall()]
+
+            if games:
+                db_cursor.execute("""DELETE FROM leaderboard 
+                    WHERE game_player_id IN (
+                        SELECT game_player_id FROM game_player 
+                        WHERE game_uuid = ANY(%s)
+                    )""", (games, ))
+                db_cursor.execute("DELETE FROM leaderboard_total WHERE game_uuid = ANY(%s)", (games, ))
+                db_cursor.execute("DELETE FROM game_player WHERE game_uuid = ANY(%s)", (games, ))
+                db_cursor.execute("DELETE FROM game WHERE game_uuid = ANY(%s)", (games, ))
+
+        pruned += len(games)
+        if len(games) < batch_size:
+            break
+
+    if pruned:
+        versions().bump('game', 'game_player', 'leaderboard')
+
+    return pruned
+
+class Reaper(object):
+    """ Runs the maintenance tasks on an interval in a background thread """
+
+    def __init__(self, interval = 60, batch_size = 1000):
+
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.runs = 0
+        self.servers_down = 0
+        self.servers_deleted = 0
+        self.games_pruned = 0
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+        self.run_last = 0.0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self):
+        """ Run all maintenance tasks once """
+
+        start = time.monotonic()
+
+        try:
+            marked, deleted = reap_servers(self.batch_size)
+            pruned = prune_games(self.batch_size)
+            created, dropped = partitions.maintain()
+        except Exception as e:
+            log.error("Maintenance failed: %s" % e)
+            return
+
+        self.runs += 1
+        self.servers_down += marked
+        self.servers_deleted += deleted
+        self.games_pruned += pruned
+        self.partitions_created += created
+        self.partitions_dropped += dropped
+        self.run_last = time.monotonic() - start
+
+        if dropped:
+            versions().bump('game', 'game_player', 'leaderboard')
+
+        log.info("Maintenance: %s servers down, %s servers deleted, %s games pruned, %s partitions created, %s partitions dropped in %.3fs" % (marked, deleted, pruned, created, dropped, self.run_last))
+
+    def _run(self):
+        """ Maintenance thread """
+
+        while not self._stop.wait(self.interval):
+            self.run()
+
+    def start(self):
+        """ Start the maintenance thread """
+
+        if self._thread:
+            return
+
+        self._thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the maintenance thread """
+
+        self._stop.set()
+
+    def stats(self):
+        """ Maintenance counters """
+
+        return {
+            'runs': self.runs,
+            'servers_down': self.servers_down,
+            'servers_deleted': self.servers_deleted,
+            'games_pruned': self.games_pruned,
+            'partitions_created': self.partitions_created,
+            'partitions_dropped': self.partitions_dropped,
+            'run_last': self.run_last,
+        }
+
+@singleton
+def reaper():
+    """ The maintenance task """
+    return Reaper(settings['MAINTENANCE_INTERVAL'], settings['MAINTENANCE_BATCH_SIZE'])
+
+metrics.Gauges('pygsm_maintenance', lambda: reaper().stats())
\ No newline at end of file
@@ -0,0 +1,386 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+serverlist.py
+
+In-memory snapshot of the live servers shown by GET /server.  Each server 
+is kept already encoded as JSON so a read only has to shuffle and join 
+them.  The snapshot is refreshed once it is older than server_list_max_age
+seconds, or sooner after a write marked it dirty.  The filters of 
+GET /server are answered from indexes built along with the snapshot, and 
+a limited result is a random sample, so a filtered read only touches the 
+servers that can match.
+
+Under the pre-fork launcher the rows of the snapshot are also kept in 
+shared memory.  Whichever worker finds them stale refreshes them from the 
+database for every worker, and the others load them from there.
+"""
+import time, pickle, random, bisect, hashlib, threading
+
+from core import log, db, metrics, queries, prefork
+from core.lazy import singleton
+from core.shared import SharedBuffer
+from core.config import settings
+from core.output import encode
+from core.events import server_events
+
+class Snapshot(object):
+    """ Encoded servers with indexes for the GET /server filters """
+
+    def __init__(self, rows = ()):
+
+        self.servers = []
+
+        # Per server: (game_uuid, region, has free slots, casefolded name)
+        self.fields = []
+
+        # Positions in servers by game_uuid and by region
+        self.games = {}
+        self.regions = {}
+
+        # Positions of servers with free slots
+        self.free = []
+
+        # (casefolded name, position), sorted for prefix searches
+        self.names = []
+
+        for row in rows:
+            self.add(row)
+
+        self.names.sort()
+
+    def __len__(self):
+        return len(self.servers)
+
+    def add(self, row):
+        """ Add a ping row """
+
+        position = len(self.servers)
+        game_uuid = str(row['game_uuid'])
+        name = row['name'].casefold()
+        free = row['active'] < row['max']
+
+        self.servers.append(encode({
+            'hostname': row['hostname'],
+            'port': row['port'],
+            'name': row['name'],
+            'ping': row['ping'],
+            'activePlayers': row['active'],
+            'maxPlayers': row['max'],
+            'game_uuid': game_uuid,
+            'region': row['region'],
+            }))
+        self.fields.append((game_uuid, row['region'], free, name))
+
+        self.games.setdefault(game_uuid, []).append(position)
+        self.regions.setdefault(row['region'], []).append(position)
+        if free:
+            self.free.append(position)
+        self.names.append((name, position))
+
+    def prefixed(self, prefix):
+        """ Positions of the servers whose name starts with prefix """
+
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self.names, (prefix, ))
+        end = bisect.bisect_left(self.names, (prefix + '\U0010ffff', ))
+
+        return [position for _, position in self.names[start:end]]
+
+    def select(self, game_uuid = None, free = False, name = None, 
+        region = None, limit = None):
+        """ The encoded servers matching all of the given filters in random 
+            order, at most limit of them """
+
+        # Start from the smallest index that applies and check the other 
+        # filters on those servers only
+        indexes = []
+
+        if game_uuid is not None:
+            indexes.append(self.games.get(str(game_uuid), []))
+        if region is not None:
+            indexes.append(self.regions.get(region, []))
+        if free:
+            indexes.append(self.free)
+        if name:
+            indexes.append(self.prefixed(name))
+
+        if not indexes:
+            candidates = range(len(self.servers))
+        else:
+            candidates = min(indexes, key=len)
+
+        if len(indexes) > 1:
+            folded = name.casefold() if name else None
+            candidates = [p for p in candidates if self.matches(p, 
+                game_uuid, free, folded, region)]
+
+        if limit is None or limit > len(candidates):
+            limit = len(candidates)
+
+        return [self.servers[p] for p in random.sample(candidates, limit)]
+
+    def matches(self, position, game_uuid, free, name, region):
+        """ Whether a server matches the filters.  name must be casefolded. """
+
+        server_game, server_region, server_free, server_name = self.fields[position]
+
+        return ((game_uuid is None or server_game == str(game_uuid))
+            and (region is None or server_region == region)
+            and (not free or server_free)
+            and (not name or server_name.startswith(name)))
+
+    def etag(self):
+        """ Hash of the servers, independent of their order """
+        return 'W/"%s"' % hashlib.sha1(b'\n'.join(sorted(self.servers))).hexdigest()[:20]
+
+class ServerList(object):
+    """ Snapshot of live servers, split into dev and non-dev """
+
+    # Seconds a worker may take to refresh the shared rows before another 
+    # one takes over
+    lease = 30.0
+
+    def __init__(self, max_age = 5, min_age = 1):
+
+        # Staleness bound
+        self.max_age = max_age
+
+        # Minimum time between refreshes, even when dirty
+        self.min_age = min_age
+
+        self.servers = { True: Snapshot(), False: Snapshot() }
+        self.taken_at = None
+
+        # Content hash and wall clock time it last changed
+        self.etags = { True: None, False: None }
+        self.modified = { True: None, False: None }
+
+        # Last server event included in the snapshot
+        self.seq = 0
+        self.dirty = False
+        self.refreshes = 0
+
+        # SharedBuffer with the rows for all workers, and the generation of 
+        # it the snapshot was loaded from.  See share().
+        self.shared = None
+        self.generation = 0
+
+        self._lock = threading.Lock()
+
+    def age(self):
+        """ Seconds since the snapshot was taken """
+
+        if self.taken_at is None:
+            return None
+
+        return time.monotonic() - self.taken_at
+
+    def stale(self):
+        """ Whether or not the snapshot needs a refresh """
+
+        age = self.age()
+
+        if age is None or age >= self.max_age:
+            return True
+
+        dirty = self.dirty or (self.shared is not None and self.shared.dirty)
+
+        return dirty and age >= self.min_age
+
+    def invalidate(self):
+        """ Mark the snapshot dirty after a write """
+        self.dirty = True
+
+        if self.shared is not None:
+            self.shared.dirty = True
+
+    def share(self, shared):
+        """ Keep the rows in a SharedBuffer, so the workers forked after 
+            this refresh them once for all of them """
+        self.shared = shared
+
+    def load(self, rows, seq = 0):
+        """ Replace the snapshot with the given ping rows.  seq is the last 
+            server event published before the rows were read. """
+
+        servers = { 
+            True: Snapshot(row for row in rows if row['dev']),
+            False: Snapshot(row for row in rows if not row['dev']),
+            }
+
+        now = time.time()
+
+        for dev, snapshot in servers.items():
+            etag = snapshot.etag()
+
+            if etag != self.etags[dev]:
+                self.etags[dev] = etag
+                self.modified[dev] = now
+
+        self.servers = servers
+        self.seq = seq
+        self.taken_at = time.monotonic()
+        self.refreshes += 1
+
+    def refresh(self, publish = True):
+        """ Rebuild the snapshot from the database, and put the rows in 
+            shared memory if publish is set """
+
+        db_cursor = db.cursor()
+        read_at = time.monotonic()
+
+        # Clear the flag first so writes during the query mark it again
+        self.dirty = False
+        if self.shared is not None:
+            self.shared.dirty = False
+        seq = server_events().seq
+
+        queries.run(db_cursor, 'live_servers', (settings['SERVER_TIMEOUT'], ))
+        rows = db_cursor.fetchall()
+
+        self.load(rows, seq)
+
+        if self.shared is not None and publish:
+            self.publish(rows, read_at)
+
+    def publish(self, rows, read_at):
+        """ Put the rows in shared memory for the other workers.  Call with 
+            the lease held. """
+
+        data = pickle.dumps([dict(row) for row in rows], pickle.HIGHEST_PROTOCOL)
+
+        if self.shared.write(data, read_at):
+            self.generation = self.shared.generation()
+        else:
+            log.warning("The server list could not be put in shared memory, every worker reads it itself.  Raise shared_size in the Workers section if it is too large.")
+
+    def adopt(self):
+        """ Load the rows from shared memory if another worker refreshed 
+            them """
+
+        if self.shared.generation() == self.generation:
+            return
+
+        shared = self.shared.read()
+
+        if shared is None:
+            return
+
+        generation, read_at, data = shared
+
+        # Replay this worker's events from when the rows were read
+        self.load(pickle.loads(data), server_events().seq_at(read_at))
+        self.taken_at = read_at
+        self.generation = generation
+
+    def get(self, dev = False):
+        """ Get the encoded servers in random order """
+
+        self.update()
+
+        return self.shuffled(dev)
+
+    def update(self):
+        """ Refresh the snapshot if it is stale """
+
+        if self.shared is not None:
+            return self.update_shared()
+
+        if self.stale():
+
+            # Only one thread refreshes.  The others keep serving the old 
+            # snapshot unless there is none yet.
+            if self._lock.acquire(blocking=self.taken_at is None):
+                try:
+                    if self.stale():
+                        self.refresh()
+                finally:
+                    self._lock.release()
+
+    def update_shared(self):
+        """ update() for rows kept in shared memory """
+
+        self.adopt()
+
+        if not self.stale():
+            return
+
+        # One thread per worker
+        if not self._lock.acquire(blocking=self.taken_at is None):
+            return
+
+        try:
+            self.adopt()
+
+            if not self.stale():
+                return
+
+            # Only one worker refreshes, under a lease that runs out if it 
+            # dies or hangs.  The others keep serving the old snapshot, or 
+            # read the rows themselves if they have none yet.
+            if self.shared.claim(self.lease):
+                try:
+                    self.adopt()
+                    if self.stale():
+                        self.refresh()
+                finally:
+                    self.shared.unclaim()
+
+            elif self.taken_at is None:
+                self.refresh(publish=False)
+        finally:
+            self._lock.release()
+
+    def validators(self, dev = False):
+        """ The ETag and Last-Modified time of the current snapshot.  The 
+            ETag only depends on the servers, so it is the same for every 
+            process. """
+
+        return self.etags[bool(dev)], self.modified[bool(dev)]
+
+    def shuffled(self, dev = False, **filters):
+        """ The encoded servers of the current snapshot in random order.  
+            Takes the filters of Snapshot.select. """
+
+        return self.servers[bool(dev)].select(**filters)
+
+    def stats(self):
+        """ Snapshot age and size """
+
+        return {
+            'age': self.age(),
+            'refreshes': self.refreshes,
+            'servers': len(self.servers[False]),
+            'servers_dev': len(self.servers[True]),
+        }
+
+@singleton
+def server_list():
+    """ The server list of this process """
+    return ServerList(settings['SERVER_LIST_MAX_AGE'], settings['SERVER_LIST_MIN_AGE'])
+
+metrics.Gauges('pygsm_server_list', lambda: server_list().stats())
+
+@prefork.before_fork
+def share_server_list():
+    """ Keep the server list in shared memory for the workers """
+    server_list().share(SharedBuffer(settings['WORKERS_SHARED_SIZE'] * 1024 * 1024))
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+shared.py
+
+Shared memory for state that every pre-forked worker reads but only one 
+needs to compute.  A SharedBuffer holds one blob that is replaced as a 
+whole.  It is double buffered: a writer fills the half readers are not 
+using and then switches over, so readers never wait for writers.  
+Whoever computes the blob holds a lease on it, which runs out on its own 
+if that process dies or hangs.
+"""
+import os, mmap, time, struct, multiprocessing
+
+class SharedBuffer(object):
+    """ Blob in anonymous shared memory.  Create it before forking. """
+
+    # generation, taken_at, length, half.  The generation is odd while the 
+    # header is being written.  A dirty flag follows it.
+    header = struct.Struct('<QdQB')
+    dirty_offset = header.size
+
+    # Lease expiry as time.monotonic(), and the pid holding it
+    lease = struct.Struct('<dQ')
+    lease_offset = 32
+    header_size = 48
+
+    # Seconds to wait for the lock.  It is only held for memory copies, so 
+    # running out means its holder died in there.
+    lock_timeout = 1.0
+
+    def __init__(self, size):
+
+        self.map = mmap.mmap(-1, size)
+        self.capacity = (size - self.header_size) // 2
+
+        # Serializes writers and lease changes across processes
+        self.lock = multiprocessing.Lock()
+
+    def generation(self):
+        """ Changes every time the blob is replaced.  0 if it never was. """
+        return struct.unpack_from('<Q', self.map, 0)[0]
+
+    def read(self, retries = 10):
+        """ The generation, taken_at time and blob.  Returns None if 
+            nothing was written yet or a writer kept replacing it. """
+
+        for _ in range(retries):
+
+            generation, taken_at, length, half = self.header.unpack_from(self.map, 0)
+
+            if generation == 0:
+                return None
+            elif generation % 2:
+                continue
+
+            start = self.header_size + half * self.capacity
+            data = self.map[start:start + length]
+
+            # The header or the half may have been rewritten meanwhile
+            if self.generation() == generation:
+                return generation, taken_at, data
+
+        return None
+
+    def claim(self, duration):
+        """ Take the lease for duration seconds, unless another process 
+            holds it.  Returns whether this process has it. """
+
+        if not self.lock.acquire(timeout=self.lock_timeout):
+            return False
+
+        try:
+            now = time.monotonic()
+            expires, pid = self.lease.unpack_from(self.map, self.lease_offset)
+
+            if expires > now and pid != os.getpid():
+                return False
+
+            self.lease.pack_into(self.map, self.lease_offset, now + duration, os.getpid())
+            return True
+        finally:
+            self.lock.release()
+
+    def unclaim(self):
+        """ Give up the lease, if this process still holds it """
+
+        if not self.lock.acquire(timeout=self.lock_timeout):
+            return
+
+        try:
+            expires, pid = self.lease.unpack_from(self.map, self.lease_offset)
+
+            if pid == os.getpid():
+                self.lease.pack_into(self.map, self.lease_offset, 0.0, 0)
+        finally:
+            self.lock.release()
+
+    def write(self, data, taken_at):
+        """ Replace the blob.  taken_at is the time.monotonic() the data is 
+            from, which is the same clock in every process.  Returns False 
+            if the data does not fit or the lock could not be taken. """
+
+        if len(data) > self.capacity:
+            return False
+
+        if not self.lock.acquire(timeout=self.lock_timeout):
+            return False
+
+        try:
+            self._write(data, taken_at)
+        finally:
+            self.lock.release()
+
+        return True
+
+    def _write(self, data, taken_at):
+
+        generation, _, _, half = self.header.unpack_from(self.map, 0)
+        half = 1 - half if generation else 0
+
+        # Fill the half readers don't use, then switch them over to it
+        start = self.header_size + half * self.capacity
+        self.map[start:start + len(data)] = data
+
+        struct.pack_into('<Q', self.map, 0, generation + 1)
+        self.header.pack_into(self.map, 0, generation + 1, taken_at, len(data), half)
+        struct.pack_into('<Q', self.map, 0, generation + 2)
+
+    @property
+    def dirty(self):
+        """ Flag for any process to mark the blob outdated """
+        return bool(self.map[self.dirty_offset])
+
+    @dirty.setter
+    def dirty(self, value):
+        self.map[self.dirty_offset] = 1 if value else 0
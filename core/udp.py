@@ -0,0 +1,237 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+udp.py
+
+UDP heartbeat listener.  Game servers can send a small binary heartbeat 
+instead of calling POST /server.  Heartbeats are authenticated with the 
+same PSKs, queued per server, and written in bulk every flush_interval 
+seconds, so many heartbeats from one server only cost one write.
+
+Packet format, in network byte order:
+
+    magic       2 bytes     b'PG'
+    version     1 byte      1
+    psk         1 byte length, then the PSK
+    hostname    1 byte length, then the UTF-8 hostname.  If empty, the 
+                source address of the packet is used.
+    port        uint16
+    active      uint16      active players
+    max         uint16      maximum players
+    game_uuid   16 bytes    all zeros to start a new game
+    name        1 byte length, then the UTF-8 server name
+"""
+import time, uuid, struct, threading, socketserver
+
+from core import log, db, metrics
+from core.auth import authenticate
+from core.config import settings
+from core.lazy import singleton
+from core.heartbeat import Heartbeat, create_games, upsert_pings
+from core.serverlist import server_list
+from core.events import publish_updates
+from core.versions import versions
+
+MAGIC = b'PG'
+VERSION = 1
+
+numbers = struct.Struct('!HHH16s')
+
+received = metrics.Counter('pygsm_udp_heartbeats_total', 
+    "UDP heartbeats received")
+rejected = metrics.Counter('pygsm_udp_heartbeats_rejected_total', 
+    "UDP heartbeats that were invalid or failed authentication", ('reason', ))
+written = metrics.Counter('pygsm_udp_heartbeats_written_total', 
+    "Servers written from UDP heartbeats")
+
+def read_string(packet, offset):
+    """ Read a length-prefixed string.  Returns it and the next offset. """
+
+    if offset >= len(packet):
+        raise ValueError("Packet too short")
+
+    end = offset + 1 + packet[offset]
+
+    if end > len(packet):
+        raise ValueError("Packet too short")
+
+    return packet[offset + 1:end], end
+
+def encode_heartbeat(psk, hostname, port, name, active, max = 8, game_uuid = None):
+    """ Build a heartbeat packet """
+
+    fields = [MAGIC, bytes((VERSION, ))]
+
+    for value in (psk, hostname):
+        value = value.encode('utf8')
+        fields.append(bytes((len(value), )) + value)
+
+    game_uuid = game_uuid.bytes if game_uuid else bytes(16)
+    fields.append(numbers.pack(port, active, max, game_uuid))
+
+    name = name.encode('utf8')
+    fields.append(bytes((len(name), )) + name)
+
+    return b''.join(fields)
+
+def decode_heartbeat(packet):
+    """ Parse a heartbeat packet.  Returns (psk, hostname, port, name, 
+        active, max, game_uuid).  Raises ValueError if it is invalid. """
+
+    if packet[:2] != MAGIC or packet[2:3] != bytes((VERSION, )):
+        raise ValueError("Not a heartbeat packet")
+
+    psk, offset = read_string(packet, 3)
+    hostname, offset = read_string(packet, offset)
+
+    if offset + numbers.size > len(packet):
+        raise ValueError("Packet too short")
+
+    port, active, max, game_uuid = numbers.unpack_from(packet, offset)
+    name, offset = read_string(packet, offset + numbers.size)
+
+    game_uuid = uuid.UUID(bytes=game_uuid) if any(game_uuid) else None
+
+    return (psk.decode('utf8'), hostname.decode('utf8'), port, name.decode('utf8'), 
+        active, max, game_uuid)
+
+class HeartbeatHandler(socketserver.BaseRequestHandler):
+    """ Handles one heartbeat packet """
+
+    def handle(self):
+
+        packet = self.request[0]
+        received.inc()
+
+        try:
+            psk, hostname, port, name, active, max, game_uuid = decode_heartbeat(packet)
+        except (ValueError, UnicodeError) as e:
+            rejected.inc('invalid')
+            log.debug("Invalid heartbeat from %s: %s" % (self.client_address[0], e))
+            return
+
+        try:
+            auth = authenticate(psk) if psk else None
+        finally:
+            db.release()
+
+        if not auth:
+            rejected.inc('auth')
+            return
+
+        self.server.listener.queue(Heartbeat(hostname or self.client_address[0], port, name, 
+            active, max, auth.development, game_uuid))
+
+class HeartbeatListener(object):
+    """ Receives heartbeats and writes them in bulk """
+
+    def __init__(self, host = '0.0.0.0', port = 27900, flush_interval = 1.0):
+
+        self.address = (host, port)
+        self.flush_interval = flush_interval
+
+        self.pending = {}
+        self.server = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def queue(self, beat):
+        """ Queue a heartbeat.  A newer heartbeat of the same server 
+            replaces the queued one. """
+
+        with self._lock:
+            self.pending[(beat.hostname, beat.port)] = beat
+
+    def flush(self):
+        """ Write the queued heartbeats """
+
+        with self._lock:
+            beats, self.pending = list(self.pending.values()), {}
+
+        if not beats:
+            return 0
+
+        try:
+            with db.transaction() as db_cursor:
+                created, new_games = create_games(db_cursor, beats)
+                changed = upsert_pings(db_cursor, created)
+        except Exception as e:
+            log.error("Writing %s UDP heartbeats failed: %s" % (len(beats), e))
+            return 0
+
+        written.inc(amount=len(changed))
+
+        if changed:
+            server_list().invalidate()
+            publish_updates(changed)
+        if new_games:
+            versions().bump('game')
+
+        return len(changed)
+
+    def _flush_loop(self):
+        """ Flusher thread """
+
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+        self.flush()
+
+    def start(self):
+        """ Start listening in background threads """
+
+        if self.server:
+            return
+
+        self.server = socketserver.UDPServer(self.address, HeartbeatHandler)
+        self.server.listener = self
+
+        threading.Thread(target=self.server.serve_forever, name='udp-heartbeat', daemon=True).start()
+        threading.Thread(target=self._flush_loop, name='udp-heartbeat-flush', daemon=True).start()
+
+        log.info("Listening for UDP heartbeats on %s:%s" % self.address)
+
+    def stop(self):
+        """ Stop listening and write what is left """
+
+        self._stop.set()
+
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def serve_forever(self):
+        """ Listen in the foreground until interrupted """
+
+        self.start()
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            self.stop()
+
+@singleton
+def listener():
+    """ The UDP heartbeat listener """
+    return HeartbeatListener(settings['UDP_HOST'], settings['UDP_PORT'], settings['UDP_FLUSH_INTERVAL'])
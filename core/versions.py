@@ -0,0 +1,104 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+versions.py
+
+Change counters for the tables behind the read endpoints, used for their 
+ETag and Last-Modified headers.  Writes bump the counters of the tables 
+they touched once they are committed, so a request from a client that 
+already has the current version can be answered with a 304 before any 
+query runs.
+
+Only writes made by this process are seen, so a version also expires 
+after etag_max_age seconds.  That bounds how long writes made through 
+other processes, or directly in the database, go unnoticed.
+"""
+import time, uuid, threading
+
+from core import metrics
+from core.config import settings
+from core.lazy import singleton
+
+class Versions(object):
+    """ Change counter and change time per table """
+
+    def __init__(self, max_age = 60):
+
+        self.max_age = max_age
+
+        # Tells the versions of different processes apart
+        self.boot = uuid.uuid4().hex[:8]
+
+        # Table: (counter, wall clock time of the change)
+        self.versions = {}
+
+        self._lock = threading.Lock()
+
+    def bump(self, *tables):
+        """ Mark tables changed.  Call after the write is committed. """
+
+        now = time.time()
+
+        with self._lock:
+            for table in tables:
+                counter = self.versions.get(table, (0, now))[0]
+                self.versions[table] = (counter + 1, now)
+
+    def get(self, table):
+        """ The counter and change time of a table """
+
+        now = time.time()
+
+        with self._lock:
+            counter, changed = self.versions.get(table, (0, None))
+
+            if changed is None or now - changed >= self.max_age:
+                counter, changed = counter + 1, now
+                self.versions[table] = (counter, changed)
+
+            return counter, changed
+
+    def validators(self, *tables):
+        """ The ETag and Last-Modified time of a response built from the 
+            given tables """
+
+        tag = [self.boot]
+        modified = 0
+
+        for table in tables:
+            counter, changed = self.get(table)
+            tag.append('%s.%d' % (table, counter))
+            modified = max(modified, changed)
+
+        return 'W/"%s"' % '-'.join(tag), modified
+
+    def stats(self):
+        """ Current counters """
+
+        with self._lock:
+            return { table: counter for table, (counter, _) in self.versions.items() }
+
+@singleton
+def versions():
+    """ The table versions of this process """
+    return Versions(settings['ETAG_MAX_AGE'])
+
+metrics.Gauges('pygsm_versions', lambda: versions().stats())
@@ -0,0 +1,119 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+manage.py
+
+Maintenance commands for pygsm.  Run `python manage.py --help` for a list.
+"""
+import sys, argparse
+
+def rebuild_totals(args):
+    """ Recompute the leaderboard totals from the leaderboard """
+    from core.leaderboard import rebuild_totals
+
+    players = rebuild_totals()
+    print("Rebuilt leaderboard totals for %s players" % players)
+
+def maintenance(args):
+    """ Mark stale servers down and delete expired games """
+    from core.reaper import reaper
+
+    reaper().run()
+    stats = reaper().stats()
+    print("%s servers down, %s servers deleted, %s games pruned, %s partitions created, %s partitions dropped" % (stats['servers_down'], stats['servers_deleted'], stats['games_pruned'], stats['partitions_created'], stats['partitions_dropped']))
+
+def partitions(args):
+    """ Create upcoming and drop expired game and leaderboard partitions """
+    from core import partitions
+
+    created, dropped = partitions.maintain()
+    print("%s partitions created, %s partitions dropped" % (created, dropped))
+
+    if not args.migrate:
+        return
+
+    # One interval per transaction, so writes are only held up briefly
+    for table in partitions.tables:
+        while True:
+            moved = partitions.split_legacy(table)
+            if moved is None:
+                break
+            print("Moved %s rows out of %s_legacy" % (moved, table))
+
+def udp(args):
+    """ Run the UDP heartbeat listener """
+    from core.udp import listener
+
+    listener().serve_forever()
+
+def serve(args):
+    """ Serve pygsm with pre-forked worker processes """
+    import pygsm
+    from core import prefork
+    from core.config import settings
+
+    return prefork.serve(lambda: pygsm.create_app(args.config), 
+        args.host, args.port, args.workers or settings['WORKERS'])
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description="pygsm maintenance commands")
+    parser.add_argument('--config', default='pygsm.cfg', help="config file to use")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('rebuild-totals', help=rebuild_totals.__doc__.strip())
+    command.set_defaults(func=rebuild_totals)
+
+    command = commands.add_parser('maintenance', help=maintenance.__doc__.strip())
+    command.set_defaults(func=maintenance)
+
+    command = commands.add_parser('partitions', help=partitions.__doc__.strip())
+    command.add_argument('--migrate', action='store_true', 
+        help="also move the rows of the legacy partitions into regular partitions")
+    command.set_defaults(func=partitions)
+
+    command = commands.add_parser('udp', help=udp.__doc__.strip())
+    command.set_defaults(func=udp)
+
+    command = commands.add_parser('serve', help=serve.__doc__.strip())
+    command.add_argument('--host', default='0.0.0.0')
+    command.add_argument('--port', type=int, default=8000)
+    command.add_argument('--workers', type=int, default=None, 
+        help="worker processes, overrides workers in the Workers section")
+    command.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+
+    from core import config
+
+    try:
+        config.load(args.config)
+    except config.ConfigError as e:
+        print("ERROR: %s" % e)
+        return 1
+
+    args.func(args)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,14 +16,183 @@ port        = 5432
 name        = pygsm
 user        = 
 password    = 
+; Minimum and maximum amount of pooled connections.  Each concurrent 
+; request holds one connection for its duration.
+; Default: 1, 10
+;pool_min    = 1
+;pool_max    = 10
+; Seconds a request waits for a free connection before failing
+; Default: 10
+;pool_timeout = 10
+; Prepare the frequent statements once per connection instead of having 
+; the database plan them on every call.  Turn this off when connecting 
+; through a pooler in transaction mode, like pgbouncer, which does not 
+; keep a client on the same connection.
+; Default: true
+;prepare     = true
+; Read replicas for GET requests, as host or host:port separated by 
+; commas.  They use the name, user and password above, and get a pool of 
+; up to pool_max connections each.  A replica is only read from while it 
+; lags at most replica_max_lag seconds behind, which is checked every 
+; replica_check_interval seconds.  Otherwise GET requests go to the 
+; primary.  Writes always go to the primary.
+; Default: none, 5, 1
+;replicas    = 10.0.0.2, 10.0.0.3:5433
+;replica_max_lag = 5
+;replica_check_interval = 1
 
 [Pref]
 ; Maximum age of games to display
 ; Default: 30
 ;game_max_age = 30
+; Seconds without a ping after which a server is considered down
+; Default: 300
+;server_timeout = 300
+; Maximum age in seconds of the server list returned by GET /server
+; Default: 5
+;server_list_max_age = 5
+; Minimum seconds between server list refreshes after a server changed
+; Default: 1
+;server_list_min_age = 1
+; Maximum amount of items accepted by batch endpoints
+; Default: 1000
+;batch_max_size = 1000
+; Maximum amount of results per page on paginated endpoints
+; Default: 1000
+;page_max_size = 1000
+; GET /game, /game-player and /leaderboard answer with a 304 when the 
+; client's ETag is still current.  Writes through this process change it 
+; right away, others within etag_max_age seconds.
+; Default: 60
+;etag_max_age = 60
 
 [Auth]
 ; The format the PSK should be in.  Valid options are string, md5, and 
 ; uuid.
 ; Default: string
-;psk_format  = string
\ No newline at end of file
+;psk_format  = string
+; Amount of validated PSKs kept in memory.  Set to 0 to disable the cache.
+; Default: 1024
+;cache_size = 1024
+; Seconds a validated PSK is trusted before it is checked against the DB 
+; again.  Deactivated keys keep working for at most this long.
+; Default: 60
+;cache_ttl = 60
+; Seconds an unknown PSK is remembered as invalid
+; Default: 5
+;cache_negative_ttl = 5
+
+[Leaderboard]
+; Queue kills and deaths in memory and write them in bulk instead of one 
+; insert per request.  Queued stats are not visible on /leaderboard until 
+; they are flushed, and invalid game_player_ids are not reported back.
+; Default: false
+;write_behind = false
+; Flush once this many kill/death events are queued
+; Default: 500
+;flush_size = 500
+; Flush at least every this many seconds
+; Default: 1
+;flush_interval = 1
+; Flush the queue when pygsm exits.  If false, queued stats are lost on 
+; shutdown.
+; Default: true
+;flush_on_shutdown = true
+
+[Maintenance]
+; Periodically mark servers down that stopped pinging, and delete games 
+; older than game_max_age with their players and stats.  This can also be 
+; run with `python manage.py maintenance`.
+; Default: false
+;enabled = false
+; Seconds between maintenance runs
+; Default: 60
+;interval = 60
+; Rows changed per transaction
+; Default: 1000
+;batch_size = 1000
+; With sql/0005_partitioning.sql applied, the size of new game and 
+; leaderboard partitions (day, week, or month), and how many to create 
+; ahead of time.  Partitions are dropped once all of their games are older 
+; than game_max_age.
+; Default: month, 2
+;partition_interval = month
+;partition_ahead = 2
+
+[Heartbeat]
+; Listen for binary UDP heartbeats next to POST /server.  See core/udp.py 
+; for the packet format.  Only the process that holds the leader_lock of 
+; the Workers section listens.  This can also be run on its own with 
+; `python manage.py udp`.
+; Default: false
+;udp_enabled = false
+; Address and port to listen on
+; Default: 0.0.0.0, 27900
+;udp_host = 0.0.0.0
+;udp_port = 27900
+; Seconds between writes of the received heartbeats
+; Default: 1
+;udp_flush_interval = 1
+; Don't rewrite the ping row for heartbeats that did not change anything 
+; in it.  Only the time of the heartbeat is kept, and written in bulk every 
+; flush_interval seconds.  Servers are still fully written at least every 
+; refresh seconds.
+; Default: false
+;coalesce = false
+; Default: 60
+;refresh = 60
+; Default: 10
+;flush_interval = 10
+
+[Events]
+; Most clients connected to GET /server/events at once, per process and in 
+; async mode too.  Each one holds a worker thread under WSGI, so keep this 
+; below the amount of workers.
+; Default: 100
+;max_subscribers = 100
+; Seconds between keepalive comments on an idle stream
+; Default: 15
+;keepalive = 15
+; Server changes kept for clients that reconnect with Last-Event-ID
+; Default: 4096
+;buffer_size = 4096
+; Seconds between fresh snapshots on a stream.  Events are only published 
+; by the process that handled the change, so with several processes this 
+; bounds how long a stream misses changes made through the others.  0 
+; never sends a fresh snapshot.
+; Default: 60
+;resync = 60
+
+[Output]
+; Compress responses with gzip or deflate for clients that send a matching 
+; Accept-Encoding.  Turn this off if a proxy in front of pygsm compresses.
+; Default: true
+;compress = true
+; Smallest body in bytes worth compressing.  Streams are always compressed.
+; Default: 1024
+;compress_min_size = 1024
+; zlib level from 1 (fastest) to 9 (smallest)
+; Default: 6
+;compress_level = 6
+; Send MessagePack to clients that prefer application/msgpack in Accept.  
+; Requires the msgpack package.
+; Default: true
+;msgpack = true
+
+[Workers]
+; Worker processes started by `python manage.py serve`.  0 starts one per 
+; CPU.
+; Default: 0
+;workers     = 0
+; Megabytes of shared memory for the server list the workers share.  It 
+; needs about 300 bytes per live server.  When it does not fit, every 
+; worker reads the server list from the database itself.
+; Default: 16
+;shared_size = 16
+; Maintenance and the UDP listener run in one process per host: the one 
+; that holds a lock on this file.  This is one of the workers of `serve`, 
+; of gunicorn or of any other server.  When it stops, another process 
+; takes over.  Separate instances on one host that should each run them 
+; need a file of their own.
+; Default: /tmp/pygsm.leader
+;leader_lock = /tmp/pygsm.leader
\ No newline at end of file
@@ -21,36 +21,182 @@ not, see <http://www.gnu.org/licenses/>.
 __author__ = "GoInto, LLC"
 __version__ = "0.1.1"
 
+import time
 import hug
+from itertools import chain
 from urllib import parse
 from datetime import datetime, timedelta
+from email.utils import formatdate
 from psycopg2 import IntegrityError, ProgrammingError
 from psycopg2.extras import Json
 from marshmallow import fields
 
-from core import log, zero_uuid
-from core.db import db_connection, db_cursor
+from core import log, db, config, heartbeat, metrics, output, prefork, queries, zero_uuid
 from core.config import settings
+from core.serverlist import server_list
+from core.events import server_events, publish_updates, publish_removes, frame, Lagged, \
+    subscribers, subscriber_slots
 from core.auth import authenticate, optional_api_key
 from core.decorators import rollback_on_failure
-from utilities import response, response_positive, response_error
+from core.heartbeat import Heartbeat, registry
+from core.leaderboard import kill_buffer, ranking, record_stats, record_kills, event_time, \
+    check_stats, player_id
+from core.queries import rankings
+from core.reaper import reaper
+from core.versions import versions
+from core.udp import listener as udp_listener
+from core.output import encode
+from utilities import response, response_encoded, response_page, response_stream, \
+    response_positive, response_error, encode_cursor, decode_cursor, not_modified
+
+hug.API(__name__).http.output_format = output.api
 
 # setup auth
 psk_authentication = hug.authentication.api_key(authenticate)
 psk_optional = optional_api_key(authenticate)
 
+@hug.startup()
+def open_database(api):
+    """ Open the database connection pool before the first request """
+    db.connect()
+
+@hug.startup()
+def elect_leader(api):
+    """ Compete for running the tasks that are needed once per host, if 
+        any are enabled """
+    if settings['MAINTENANCE_ENABLED'] or settings['UDP_ENABLED']:
+        prefork.elect(settings['WORKERS_LEADER_LOCK'])
+
+@prefork.on_leader
+def start_maintenance():
+    """ Start the maintenance thread, if enabled.  Only the leader runs it. """
+    if settings['MAINTENANCE_ENABLED']:
+        reaper().start()
+
+@prefork.on_leader
+def start_udp_listener():
+    """ Start the UDP heartbeat listener, if enabled.  Only the leader 
+        binds the port. """
+    if settings['UDP_ENABLED']:
+        udp_listener().start()
+
+request_seconds = metrics.Histogram('pygsm_http_request_seconds', 
+    "Time spent handling HTTP requests", ('method', 'path', 'status'))
+
+@hug.request_middleware()
+def start_request_timer(request, response):
+    """ Note when handling the request started """
+    request.context['started'] = time.perf_counter()
+
+@hug.request_middleware()
+def route_db_connection(request, response):
+    """ Send the database work of GET requests, which only read, to a read 
+        replica when one is configured """
+    db.route(read_only=request.method in ('GET', 'HEAD'))
+
+@hug.response_middleware()
+def release_db_connection(request, response, resource):
+    """ Return the request's database connection to the pool """
+    db.release()
+
+@hug.response_middleware()
+def record_request_time(request, response, resource):
+    """ Record how long the request took """
+    started = request.context.get('started')
+
+    if started is not None:
+        # Unknown paths share one label
+        path = request.path if resource else '<unknown>'
+        request_seconds.observe(time.perf_counter() - started, 
+            request.method, path, response.status[:3])
+
 @hug.directive()
 def auth_context(default=None, request=None, *args, **kwargs):
     """ Returns the current logged in user """
     return request.context.get('user')
 
+@hug.directive()
+def conditional_get(default=None, request=None, response=None, *args, **kwargs):
+    """ Returns a function that adds the ETag and Last-Modified headers 
+        to the response.  It returns True, and makes the response a 304, 
+        when the client already has that version. """
+
+    def unchanged(etag, modified = None):
+
+        # A replica may not have the change the new version is for yet, and
+        # the response would be cached under it
+        if modified and time.time() - modified < settings['DB_REPLICA_MAX_LAG']:
+            db.route(read_only=False)
+
+        response.set_header('ETag', etag)
+
+        if modified:
+            response.set_header('Last-Modified', formatdate(modified, usegmt=True))
+
+        if not_modified(etag, modified, request.get_header('If-None-Match'), 
+            request.get_header('If-Modified-Since')):
+            response.status = hug.HTTP_304
+            return True
+
+        return False
+
+    return unchanged
+
+@hug.get('/metrics', output=output.prometheus)
+def metrics_text():
+    """ Prometheus metrics """
+    return metrics.render()
+
 @hug.http('/auth-test', accept=('GET', 'POST'), requires=psk_authentication)
 def auth_test():
     """ Simple authentication test """
     return response_positive("Success")
 
+def game_result(row):
+    """ Format a game row """
+    return {
+        'game_uuid': str(row['game_uuid']),
+        'stamp': row['stamp'].isoformat(),
+        }
+
+def player_result(row):
+    """ Format a game player row """
+    return {
+        'game_player_id': row['game_player_id'],
+        'game_uuid': str(row['game_uuid']),
+        }
+
+def page_limit(limit, default = 100):
+    """ The page size of a paged listing.  Raises ValueError unless limit 
+        is from 1 to page_max_size. """
+
+    if limit is None:
+        return min(default, settings['PAGE_MAX_SIZE'])
+
+    if not 1 <= limit <= settings['PAGE_MAX_SIZE']:
+        raise ValueError("limit must be from 1 to %s" % settings['PAGE_MAX_SIZE'])
+
+    return limit
+
+def stream_results(name, params, result, not_found):
+    """ Stream the results of a query of the catalog as they are read from 
+        the database """
+
+    rows = db.stream(queries.catalog[name].text, params, read_only=True)
+    first = next(rows, None)
+
+    if first is None:
+        return response_error(not_found, 404)
+
+    results = (encode(result(row)) for row in chain((first, ), rows))
+
+    return output.Stream(response_stream(results), close=rows.close)
+
 @hug.get('/game', examples='game_uuid=777ab9da-bc9a-4fe5-88da-b925e44909b3', requires=psk_optional)
-def game(game_uuid: hug.types.uuid = None, dev: hug.types.boolean = False, auth: auth_context = None):
+def game(game_uuid: hug.types.uuid = None, dev: hug.types.boolean = False, 
+    limit: hug.types.number = None, cursor: hug.types.text = None, 
+    stream: hug.types.boolean = False, auth: auth_context = None, 
+    unchanged: conditional_get = None):
     """ Returns basic game information """
 
     if (not auth or auth.anonymous) and dev:
@@ -58,21 +204,57 @@ def game(game_uuid: hug.types.uuid = None, dev: hug.types.boolean = False, auth:
     elif dev is None and auth:
         dev = auth.development
 
+    paged = limit is not None or cursor is not None
+    next_cursor = None
+
+    if paged:
+        try:
+            limit = page_limit(limit)
+        except ValueError as e:
+            return response_error(str(e), code=400)
+
+        try:
+            after = decode_cursor(cursor, ('timestamp', 'uuid')) if cursor else None
+        except ValueError:
+            return response_error("Invalid cursor", code=400)
+
+    if unchanged(*versions().validators('game')):
+        return None
+
     if game_uuid:
-        db_cursor.execute("SELECT game_uuid, stamp FROM game WHERE game_uuid=%s AND dev=%s", (game_uuid, dev))
+
+        db_cursor = queries.run(db.cursor(), 'game', (game_uuid, dev))
+        rows = db_cursor.fetchall()
+
     else:
-        db_cursor.execute("SELECT game_uuid, stamp FROM game WHERE stamp > now() - interval '%s days' AND dev = %s", (settings['GAME_MAX_AGE'], dev, ))
 
-    if db_cursor.rowcount > 0:
+        name = 'games'
+        params = [settings['GAME_MAX_AGE'], dev]
 
-        results = []
+        if stream:
+            return stream_results(name, params, game_result, "No games found")
 
-        for row in db_cursor.fetchall():
+        if paged:
+            if after:
+                name = 'games_page_after'
+                params.extend(after)
+            else:
+                name = 'games_page'
 
-            results.append({
-                'game_uuid': str(row['game_uuid']),
-                'stamp': row['stamp'].isoformat(),
-                })
+            params.append(limit)
+
+        db_cursor = queries.run(db.cursor(), name, params)
+        rows = db_cursor.fetchall()
+
+        if paged and len(rows) == limit:
+            next_cursor = encode_cursor([rows[-1]['stamp'].isoformat(), str(rows[-1]['game_uuid'])])
+
+    if rows:
+
+        results = [game_result(row) for row in rows]
+
+        if paged:
+            return response_page(results, next_cursor)
 
         return response(results)
 
@@ -81,7 +263,10 @@ def game(game_uuid: hug.types.uuid = None, dev: hug.types.boolean = False, auth:
         return response_error("No games found", 404)
 
 @hug.get('/server', requires=psk_optional)
-def server(auth: auth_context = None, dev: hug.types.boolean = False):
+def server(auth: auth_context = None, dev: hug.types.boolean = False, 
+    game_uuid: hug.types.uuid = None, free: hug.types.boolean = False, 
+    name: hug.types.text = None, region: hug.types.text = None, 
+    limit: hug.types.number = None, unchanged: conditional_get = None):
     """ Get active servers """
 
     if (not auth or auth.anonymous) and dev:
@@ -89,100 +274,220 @@ def server(auth: auth_context = None, dev: hug.types.boolean = False):
     elif dev is None and auth:
         dev = auth.development
 
-    db_cursor.execute("""SELECT ping_id, hostname, port, name, ping, 
-        active, max, dev, game_uuid 
-        FROM ping
-        WHERE ping > now() - interval '5 minutes'
-        AND down = false
-        AND dev = %s
-        ORDER BY RANDOM()""", (dev, ))
+    if limit is not None and limit < 1:
+        return response_error("limit must be at least 1", code=400)
 
-    if db_cursor.rowcount > 0:
+    server_list().update()
 
-        results = []
+    if unchanged(*server_list().validators(dev)):
+        return None
 
-        for row in db_cursor.fetchall():
-            results.append({
-                'hostname': row['hostname'],
-                'port': row['port'],
-                'name': row['name'],
-                'ping': row['ping'],
-                'activePlayers': row['active'],
-                'maxPlayers': row['max'],
-                'game_uuid': str(row['game_uuid']),
-                })
+    servers = server_list().shuffled(dev, game_uuid=game_uuid, free=free, 
+        name=name, region=region, limit=limit)
 
-        return response(results)
+    if servers:
+
+        return response_encoded(servers)
 
     else:
 
         return response_error("No servers found", 404)
 
+def server_event_stream(dev, seq = None):
+    """ Generate the server list followed by its changes as Server-Sent 
+        Events.  Starts after event seq if given.  A fresh snapshot is sent 
+        every resync seconds for the changes other processes made. """
+
+    resync_at = time.monotonic() + settings['EVENTS_RESYNC']
+
+    while True:
+
+        if settings['EVENTS_RESYNC'] and time.monotonic() >= resync_at:
+            seq = None
+
+        if seq is None:
+            servers = server_list().get(dev)
+            db.release()
+
+            # Replay what changed since the snapshot was taken
+            seq = min(server_list().seq, server_events().seq)
+            resync_at = time.monotonic() + settings['EVENTS_RESYNC']
+            yield frame(server_events().event_id(seq), 'snapshot', b'[' + b', '.join(servers) + b']')
+
+        timeout = settings['EVENTS_KEEPALIVE']
+        if settings['EVENTS_RESYNC']:
+            timeout = max(0, min(timeout, resync_at - time.monotonic()))
+
+        try:
+            frames, last = server_events().wait(seq, dev, timeout)
+        except Lagged:
+            # Too far behind to replay, so start over from a fresh snapshot
+            server_list().invalidate()
+            seq = None
+            continue
+
+        if frames:
+            yield b''.join(frames)
+        elif last == seq:
+            yield b': keepalive\n\n'
+
+        seq = last
+
+@hug.get('/server/events', output=output.event_stream, requires=psk_optional)
+def server_events_stream(request, auth: auth_context = None, dev: hug.types.boolean = False):
+    """ Stream the active servers and their changes """
+
+    if (not auth or auth.anonymous) and dev:
+        return response_error("Permission denied", code=403)
+    elif dev is None and auth:
+        dev = auth.development
+
+    if not subscriber_slots().acquire(blocking=False):
+        return response_error("Too many subscribers", code=503)
+
+    subscribers.inc()
+
+    # Resume after the last event the client saw, if this process sent it 
+    # and it is still buffered
+    seq = server_events().parse_id(request.get_header('Last-Event-ID'))
+
+    events = server_event_stream(bool(dev), seq)
+
+    def close():
+        events.close()
+        subscriber_slots().release()
+
+    return output.Stream(events, close=close)
+
 @rollback_on_failure
 @hug.post('/server', requires=psk_authentication)
 def ping(hostname: hug.types.text, port: hug.types.number, 
     name: hug.types.text, activePlayers: hug.types.number, 
     game_uuid: hug.types.uuid = None, maxPlayers: hug.types.number = 8, 
-    auth: auth_context = None):
+    region: hug.types.text = None, auth: auth_context = None):
     """ Add/update new server """
+
+    db_connection = db.connection()
+    db_cursor = db.cursor()
     
     dev = auth.development
 
-    log.info("ping(hostname: %s, port: %s, name: %s, activePlayers: %s, game_uuid: %s, maxPlayers: %s, dev: %s)" % (hostname, port, name, activePlayers, game_uuid, maxPlayers, dev))
+    log.info("ping(hostname: %s, port: %s, name: %s, activePlayers: %s, game_uuid: %s, maxPlayers: %s, region: %s, dev: %s)" % (hostname, port, name, activePlayers, game_uuid, maxPlayers, region, dev))
 
-    # things we'll populate later, maybe
-    latest = None
-    new_game = False
+    try:
+        beat = heartbeat.check(Heartbeat(hostname, port, name, activePlayers, maxPlayers, dev, game_uuid, region))
+    except ValueError as e:
+        return response_error(str(e), code=400)
 
     # create a new game entry
     try:
-        if game_uuid:
-            db_cursor.execute("INSERT INTO game (game_uuid, stamp, dev) VALUES (%s, now(), %s) ON CONFLICT DO NOTHING RETURNING game_uuid", (game_uuid, dev, ))
-        else:
-            db_cursor.execute("INSERT INTO game (stamp, dev) VALUES (now(), %s) RETURNING game_uuid", (dev, ))
+        beats, new_games = heartbeat.create_games(db_cursor, [beat])
     except Exception as e:
         log.error(str(e))
         return response_error("Could not create new game.", code=500)
-    finally:
-
-        if db_cursor.rowcount > 1:
-            db_connection.commit()
-            game_uuid = db_cursor.fetchone()['game_uuid']
-            new_game = True
 
     # add or update ping
     try:
 
-        db_cursor.execute("""INSERT INTO ping 
-            (hostname, port, name, ping, active, max, dev, game_uuid) 
-            VALUES (%s, %s, %s, now(), %s, %s, %s, %s)
-            ON CONFLICT ON CONSTRAINT ping_hostname_port_key DO UPDATE 
-            SET name = %s, ping = now(), active = %s, max = %s, dev = %s, 
-            game_uuid = %s, down = false""", 
-            (hostname, port, name, activePlayers, maxPlayers, dev, game_uuid,
-            name, activePlayers, maxPlayers, dev, game_uuid))
+        written = heartbeat.upsert_pings(db_cursor, beats)
 
     except Exception as e:
         log.error(str(e))
         return response_error("Internal pygsm error. See logs for more details.")
 
-    if db_cursor.rowcount < 1:
-        log.error("Ping failed!")
-        db_connection.rollback()
-        return response_error("Ping failed for unknown reasons!")
-    else:
+    db_connection.commit()
+
+    # Nothing to announce if the server did not change
+    if written:
+        server_list().invalidate()
+        publish_updates(written)
+    if new_games:
+        versions().bump('game')
+
+    return response_positive("Ping successful!")
+
+@rollback_on_failure
+@hug.post('/server/batch', requires=psk_authentication)
+def ping_batch(body, auth: auth_context = None):
+    """ Add/update many servers at once """
+
+    if not isinstance(body, list):
+        return response_error("Request body must be a JSON array of servers", code=400)
+
+    if len(body) > settings['BATCH_MAX_SIZE']:
+        return response_error("Too many servers. The limit is %s." % settings['BATCH_MAX_SIZE'], code=413)
+
+    dev = auth.development
+
+    log.info("ping_batch(servers: %s, dev: %s)" % (len(body), dev))
+
+    results = []
+    beats = []
+
+    for item in body:
+
+        try:
+            beat = heartbeat.check(Heartbeat(
+                hostname = hug.types.text(item['hostname']),
+                port = hug.types.number(item['port']),
+                name = hug.types.text(item['name']),
+                active = hug.types.number(item['activePlayers']),
+                max = hug.types.number(item.get('maxPlayers', 8)),
+                dev = dev,
+                game_uuid = hug.types.uuid(item['game_uuid']) if item.get('game_uuid') else None,
+                region = hug.types.text(item['region']) if item.get('region') else None,
+            ))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            results.append({
+                'hostname': item.get('hostname') if isinstance(item, dict) else None,
+                'port': item.get('port') if isinstance(item, dict) else None,
+                'success': False,
+                'message': "Invalid server: %s" % e,
+            })
+            continue
+
+        beats.append(beat)
+        results.append({
+            'hostname': beat.hostname,
+            'port': beat.port,
+            'success': True,
+            'message': "Ping successful!",
+        })
+
+    if beats:
+
+        db_connection = db.connection()
+        db_cursor = db.cursor()
+
+        try:
+            created, new_games = heartbeat.create_games(db_cursor, beats)
+            written = heartbeat.upsert_pings(db_cursor, created)
+        except Exception as e:
+            log.error(str(e))
+            db_connection.rollback()
+            return response_error("Internal pygsm error. See logs for more details.")
+
         db_connection.commit()
-        return response_positive("Ping successful!")
+
+        if written:
+            server_list().invalidate()
+            publish_updates(written)
+        if new_games:
+            versions().bump('game')
+
+    return response(results)
 
 @rollback_on_failure
 @hug.delete('/server', requires=psk_authentication)
 def server(hostname: hug.types.text, port: hug.types.number):
     """ Remove an active server """
 
+    db_connection = db.connection()
+    db_cursor = db.cursor()
+
     try:
 
-        db_cursor.execute("""UPDATE ping SET down = true 
-            WHERE hostname = %s AND port = %s""", (hostname, port))
+        queries.run(db_cursor, 'server_down', (hostname, port))
 
     except Exception as e:
         log.error(str(e))
@@ -190,7 +495,11 @@ def server(hostname: hug.types.text, port: hug.types.number):
 
     if db_cursor.rowcount > 0:
 
+        dev = db_cursor.fetchone()['dev']
         db_connection.commit()
+        registry().forget(hostname, port)
+        server_list().invalidate()
+        publish_removes([(hostname, port, dev)])
         return response_positive("Shutdown successful!")
 
     else:
@@ -200,7 +509,9 @@ def server(hostname: hug.types.text, port: hug.types.number):
 
 @hug.get('/game-player', examples="game_player_id=1", requires=psk_optional)
 def game_player(game_player_id: hug.types.number = None, game_uuid: hug.types.uuid = None, 
-    dev: hug.types.boolean = False, auth: auth_context = None):
+    dev: hug.types.boolean = False, limit: hug.types.number = None, 
+    cursor: hug.types.text = None, stream: hug.types.boolean = False, 
+    auth: auth_context = None, unchanged: conditional_get = None):
     """ Show player(s) and their data """
 
     if (not auth or auth.anonymous) and dev:
@@ -208,41 +519,71 @@ def game_player(game_player_id: hug.types.number = None, game_uuid: hug.types.uu
     elif dev is None and auth:
         dev = auth.development
 
+    paged = limit is not None or cursor is not None
+    next_cursor = None
+
+    if paged:
+        try:
+            limit = page_limit(limit)
+        except ValueError as e:
+            return response_error(str(e), code=400)
+
+        try:
+            after = decode_cursor(cursor, ('int', )) if cursor else None
+        except ValueError:
+            return response_error("Invalid cursor", code=400)
+
+    if unchanged(*versions().validators('game', 'game_player')):
+        return None
+
     if game_player_id:
 
-        db_cursor.execute("""SELECT game_player_id, game_uuid, meta 
-            FROM game_player gp
-            WHERE game_player_id = %s""", [game_player_id])
+        db_cursor = queries.run(db.cursor(), 'player', [game_player_id])
+        rows = db_cursor.fetchall()
 
     elif game_uuid:
 
-        db_cursor.execute("""SELECT game_player_id, game_uuid, meta 
-            FROM game_player gp
-            WHERE game_uuid = %s""", [game_uuid])
+        db_cursor = queries.run(db.cursor(), 'game_players', [game_uuid])
+        rows = db_cursor.fetchall()
 
     else:
 
-        db_cursor.execute("""SELECT game_player_id, game_uuid
-            FROM game_player gp
-            JOIN game g USING (game_uuid)
-            WHERE g.stamp > now() - interval '%s days'
-            AND g.dev = %s""", (settings['GAME_MAX_AGE'], dev, ))
+        name = 'players'
+        params = [settings['GAME_MAX_AGE'], dev]
 
-    if db_cursor.rowcount > 0:
+        if stream:
+            return stream_results(name, params, player_result, "No players found.")
+
+        if paged:
+            if after:
+                name = 'players_page_after'
+                params.extend(after)
+            else:
+                name = 'players_page'
+
+            params.append(limit)
+
+        db_cursor = queries.run(db.cursor(), name, params)
+        rows = db_cursor.fetchall()
+
+        if paged and len(rows) == limit:
+            next_cursor = encode_cursor([rows[-1]['game_player_id']])
+
+    if rows:
         players = []
 
-        for row in db_cursor.fetchall():
+        for row in rows:
 
-            players.append({
-                'game_player_id': row['game_player_id'],
-                'game_uuid': str(row['game_uuid']),
-                })
+            players.append(player_result(row))
 
             # Only include the in-depth data if a game_player_id was 
             # specified
             if game_player_id:
                 players[-1]['meta'] = row['meta']
 
+        if paged:
+            return response_page(players, next_cursor)
+
         return response(players)
 
     else:
@@ -251,16 +592,33 @@ def game_player(game_player_id: hug.types.number = None, game_uuid: hug.types.uu
 
 @rollback_on_failure
 @hug.post('/game-player', requires=psk_authentication)
-def add_player(game_uuid: hug.types.uuid, meta: hug.types.json):
-    """ Add a player to the game """
+def add_player(game_uuid: hug.types.uuid, meta: hug.types.json = None, 
+    players: hug.types.json = None):
+    """ Add a player, or a list of players, to the game """
 
     # sanity check
     if game_uuid == zero_uuid:
         return response_error("Invalid UUID")
 
+    if players is not None:
+
+        if meta is not None:
+            return response_error("Send either meta or players", code=400)
+        elif not isinstance(players, list) or not players:
+            return response_error("players must be a JSON array of meta data", code=400)
+        elif len(players) > settings['BATCH_MAX_SIZE']:
+            return response_error("Too many players. The limit is %s." % settings['BATCH_MAX_SIZE'], code=413)
+
+        return add_players(game_uuid, players)
+
+    elif meta is None:
+        return response_error("meta is required", code=400)
+
+    db_connection = db.connection()
+    db_cursor = db.cursor()
+
     try:
-        db_cursor.execute("""INSERT INTO game_player (game_uuid, meta) 
-            VALUES (%s, %s) RETURNING game_player_id""", [game_uuid, Json(meta)])
+        queries.run(db_cursor, 'add_player', [game_uuid, Json(meta)])
     except IntegrityError as e:
         log.warning(str(e))
         return response_error("Invalid game_uuid provided")
@@ -275,6 +633,7 @@ def add_player(game_uuid: hug.types.uuid, meta: hug.types.json):
         return response_error(errmsg)
     else:
         db_connection.commit()
+        versions().bump('game_player', 'leaderboard')
         try:
             new_player = db_cursor.fetchone()
         except ProgrammingError:
@@ -283,10 +642,44 @@ def add_player(game_uuid: hug.types.uuid, meta: hug.types.json):
             "game_player_id": new_player["game_player_id"]
         }, ])
 
+def add_players(game_uuid, players):
+    """ Add a list of players to a game in one statement """
+
+    db_connection = db.connection()
+    db_cursor = db.cursor()
+
+    try:
+        queries.run(db_cursor, 'add_players', [game_uuid, [Json(meta) for meta in players]])
+        rows = db_cursor.fetchall()
+    except IntegrityError as e:
+        log.warning(str(e))
+        db_connection.rollback()
+        return response_error("Invalid game_uuid provided")
+    except Exception as e:
+        log.error(str(e))
+        db_connection.rollback()
+        return response_error("Internal pygsm error. See logs for more details.")
+
+    if len(rows) != len(players):
+        errmsg = "Player insert failed!"
+        log.error(errmsg)
+        db_connection.rollback()
+        return response_error(errmsg)
+
+    db_connection.commit()
+    versions().bump('game_player', 'leaderboard')
+
+    # The ids are drawn in insert order
+    return response([{ "game_player_id": game_player_id } 
+        for game_player_id in sorted(row['game_player_id'] for row in rows)])
+
 @hug.get('/leaderboard', requires=psk_optional)
 def leaderboard(game_player_id: hug.types.number = None, 
     game_uuid: hug.types.uuid = None, leaderboard_id: hug.types.number = None, 
-    dev: hug.types.boolean = False, auth: auth_context = None):
+    order: hug.types.one_of(tuple(rankings)) = 'kills', 
+    limit: hug.types.number = None, cursor: hug.types.text = None, 
+    dev: hug.types.boolean = False, auth: auth_context = None, 
+    unchanged: conditional_get = None):
     """ Show game stats of user(s) """
 
     if (not auth or auth.anonymous) and dev:
@@ -294,42 +687,48 @@ def leaderboard(game_player_id: hug.types.number = None,
     elif dev is None and auth:
         dev = auth.development
 
-    if game_player_id:
+    try:
+        limit = page_limit(limit)
+    except ValueError as e:
+        return response_error(str(e), code=400)
+
+    try:
+        after = decode_cursor(cursor, (rankings[order][1], 'int')) if cursor else None
+    except ValueError:
+        return response_error("Invalid cursor", code=400)
 
-        db_cursor.execute("""SELECT gp.game_player_id,  gp.game_uuid, gp.meta, 
-            COALESCE(SUM(kills), 0) AS kills, COALESCE(SUM(deaths), 0) AS deaths
-            FROM game_player gp 
-            LEFT JOIN leaderboard l USING (game_player_id)
-            WHERE gp.game_player_id = %s
-            GROUP BY game_player_id""", [game_player_id])
+    if unchanged(*versions().validators('game_player', 'leaderboard')):
+        return None
 
-    elif game_uuid:
+    db_cursor = db.cursor()
+
+    ranked = False
+    next_cursor = None
 
-        db_cursor.execute("""SELECT game_player_id,  gp.game_uuid, gp.meta, 
-            COALESCE(SUM(kills), 0) AS kills, COALESCE(SUM(deaths), 0) AS deaths
-            FROM game_player gp 
-            LEFT JOIN leaderboard l USING (game_player_id)
-            WHERE game_uuid = %s
-            GROUP BY game_player_id""", [game_uuid])
+    if game_player_id:
+
+        queries.run(db_cursor, 'leaderboard_player', [game_player_id])
+        rows = db_cursor.fetchall()
 
-    elif leaderboard_id:
+    elif leaderboard_id and not game_uuid:
 
-        db_cursor.execute("""SELECT gp.game_player_id, gp.game_uuid, gp.meta, 
-            SUM(kills) AS kills, SUM(deaths) AS deaths
-            FROM leaderboard l
-            JOIN game_player gp USING (game_player_id)
-            WHERE leaderboard_id = %s
-            GROUP BY gp.game_player_id""", [leaderboard_id])
+        queries.run(db_cursor, 'leaderboard_entry', [leaderboard_id])
+        rows = db_cursor.fetchall()
 
     else:
-        # TODO: aggregate display
-        return response_error("Aggregate leaderboard not yet implemented.  For now, at least one parameter must be specified.", 501)
 
-    if db_cursor.rowcount > 0:
+        # Ranked, either within a game or across all games
+        ranked = True
+        rows = ranking(db_cursor, order, dev, game_uuid, limit, after)
+
+        if len(rows) == limit:
+            next_cursor = encode_cursor([rows[-1]['score'], rows[-1]['game_player_id']])
+
+    if rows:
 
         results = []
 
-        for row in db_cursor.fetchall():
+        for row in rows:
 
             results.append({
                 'kills': row['kills'],
@@ -341,6 +740,9 @@ def leaderboard(game_player_id: hug.types.number = None,
                 }
             })
 
+        if ranked:
+            return response_page(results, next_cursor)
+
         return response(results)
 
     else:
@@ -354,19 +756,31 @@ def leaderboard_add(game_player_id: hug.types.number, kills: hug.types.number,
     """ Add a leaderboard entry for a player """
 
     try:
-        db_cursor.execute("""INSERT INTO leaderboard (game_player_id, kills, deaths)
-            VALUES (%s, %s, %s)""", [game_player_id, kills, deaths])
+        check_stats(game_player_id, kills, deaths)
+    except ValueError as e:
+        return response_error(str(e), code=400)
+
+    if settings['LEADERBOARD_WRITE_BEHIND']:
+        kill_buffer().add(game_player_id, kills, deaths)
+        return response_positive("Successfully queued player stats.")
+
+    db_connection = db.connection()
+    db_cursor = db.cursor()
+
+    try:
+        written = record_stats(db_cursor, {game_player_id: (kills, deaths)})
     except Exception as e:
         log.error(str(e))
         return response_error("Internal pygsm error. See logs for more details.")
 
-    if db_cursor.rowcount < 1:
+    if written < 1:
         errmsg = "Player stats insert failed!"
         log.error(errmsg)
         db_connection.rollback()
         return response_error(errmsg)
     else:
         db_connection.commit()
+        versions().bump('leaderboard')
         return response_positive("Successfully added player stats.")
 
 @rollback_on_failure
@@ -379,6 +793,23 @@ def leaderboard_register_kill(alive_game_player_id: hug.types.number,
     if not alive_game_player_id and not dead_game_player_id:
         return response_error("Invalid parameters", code=400)
 
+    try:
+        for game_player_id in (alive_game_player_id, dead_game_player_id):
+            if game_player_id:
+                player_id(game_player_id)
+    except ValueError as e:
+        return response_error(str(e), code=400)
+
+    if settings['LEADERBOARD_WRITE_BEHIND']:
+        if alive_game_player_id:
+            kill_buffer().add(alive_game_player_id, kills=1)
+        if dead_game_player_id:
+            kill_buffer().add(dead_game_player_id, deaths=1)
+        return response_positive("Successfully queued player stats.")
+
+    db_connection = db.connection()
+    db_cursor = db.cursor()
+
     error = False
     error_code = 500
     error_messages = []
@@ -389,25 +820,19 @@ def leaderboard_register_kill(alive_game_player_id: hug.types.number,
 
         try:
 
-            db_cursor.execute("""INSERT INTO leaderboard (game_player_id, kills, deaths)
-            VALUES (%s, %s, %s)""", [alive_game_player_id, 1, 0])
+            written = record_stats(db_cursor, {alive_game_player_id: (1, 0)})
 
-            if db_cursor.rowcount < 1:
-                errmsg = "Player kill increment failed!"
+            if written < 1:
+                errmsg = "Player kill increment failed! Invalid game_player_id?"
                 log.error(errmsg)
                 db_connection.rollback()
                 error = True
+                error_code = 400
                 error_messages.append(errmsg)
             else:
                 db_connection.commit()
+                versions().bump('leaderboard')
 
-        except IntegrityError:
-            errmsg = "Player kill increment failed! Invalid game_player_id?"
-            log.error(errmsg)
-            db_connection.rollback()
-            error = True
-            error_code = 400
-            error_messages.append(errmsg)
         except Exception as e:
             log.error(str(e))
             db_connection.rollback()
@@ -420,25 +845,19 @@ def leaderboard_register_kill(alive_game_player_id: hug.types.number,
 
         try:
         
-            db_cursor.execute("""INSERT INTO leaderboard (game_player_id, kills, deaths)
-            VALUES (%s, %s, %s)""", [dead_game_player_id, 0, 1])
+            written = record_stats(db_cursor, {dead_game_player_id: (0, 1)})
 
-            if db_cursor.rowcount < 1:
-                errmsg = "Player death increment failed!"
+            if written < 1:
+                errmsg = "Player death increment failed! Invalid game_player_id?"
                 log.error(errmsg)
                 db_connection.rollback()
                 error = True
+                error_code = 400
                 error_messages.append(errmsg)
             else:
                 db_connection.commit()
+                versions().bump('leaderboard')
 
-        except IntegrityError:
-            errmsg = "Player death increment failed! Invalid game_player_id?"
-            log.error(errmsg)
-            db_connection.rollback()
-            error = True
-            error_code = 400
-            error_messages.append(errmsg)
         except Exception as e:
             log.error(str(e))
             db_connection.rollback()
@@ -449,3 +868,97 @@ def leaderboard_register_kill(alive_game_player_id: hug.types.number,
         return response_error(' '.join(error_messages), code=error_code)
     else:
         return response_positive("Successfully updated player stats.")
+
+def kill_event(item):
+    """ The (alive_game_player_id, dead_game_player_id, Unix time or None) 
+        of a kill sent to POST /register-kill/batch.  Raises ValueError, 
+        TypeError or AttributeError if it is invalid. """
+
+    alive = item.get('alive_game_player_id')
+    dead = item.get('dead_game_player_id')
+    stamp = item.get('timestamp')
+
+    event = (
+        player_id(hug.types.number(alive)) if alive else None,
+        player_id(hug.types.number(dead)) if dead else None,
+        event_time(stamp) if stamp is not None else None,
+    )
+
+    if not (event[0] or event[1]):
+        raise ValueError("alive_game_player_id or dead_game_player_id is required")
+
+    return event
+
+@rollback_on_failure
+@hug.post('/register-kill/batch', requires=psk_authentication)
+def leaderboard_register_kills(body):
+    """ Register many kills at once, e.g. from a match log """
+
+    if not isinstance(body, list):
+        return response_error("Request body must be a JSON array of kills", code=400)
+
+    if len(body) > settings['BATCH_MAX_SIZE']:
+        return response_error("Too many kills. The limit is %s." % settings['BATCH_MAX_SIZE'], code=413)
+
+    log.info("register_kills(kills: %s)" % len(body))
+
+    results = []
+    events = []
+
+    for index, item in enumerate(body):
+
+        try:
+            event = kill_event(item)
+        except (TypeError, ValueError, AttributeError) as e:
+            results.append({
+                'success': False,
+                'message': "Invalid kill at index %s: %s" % (index, e),
+            })
+            continue
+
+        events.append(event)
+        results.append(None)
+
+    errors = []
+
+    if events:
+
+        db_connection = db.connection()
+        db_cursor = db.cursor()
+
+        try:
+            errors = record_kills(db_cursor, events)
+        except Exception as e:
+            log.error(str(e))
+            db_connection.rollback()
+            return response_error("Internal pygsm error. See logs for more details.")
+
+        db_connection.commit()
+
+        if None in errors:
+            versions().bump('leaderboard')
+
+    # Fill in the results of the events that were sent to the database
+    errors = iter(errors)
+
+    for i, result in enumerate(results):
+
+        if result is None:
+            error = next(errors)
+            results[i] = {
+                'success': error is None,
+                'message': error or "Successfully updated player stats.",
+            }
+
+    return response(results)
+
+""" Application """
+
+def create_app(config_path = 'pygsm.cfg'):
+    """ Load the config and create the WSGI application, e.g. for a WSGI 
+        server as pygsm:create_app().  Raises ConfigError if the config is 
+        missing or invalid. """
+
+    config.load(config_path)
+
+    return hug.API(__name__).http.server()
@@ -0,0 +1,516 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+pygsm_async.py
+
+Async serving mode.  Serves the hot endpoints (GET /server, POST /server, 
+GET /server/events, POST /register-kill and /auth-test) on an asyncio 
+event loop with aiohttp and asyncpg, so waiting on the database does not 
+tie up a thread per request.  Responses are the same as the ones from pygsm.py.
+
+    python pygsm_async.py --port 8000
+
+Requires the packages in requirements-async.txt.
+"""
+__author__ = "GoInto, LLC"
+__version__ = "0.1.1"
+
+import sys, time, uuid, asyncio, argparse
+from email.utils import formatdate
+
+from aiohttp import web
+
+from core import log, aiodb, config, metrics, output, queries
+from core.config import settings, ConfigError
+from core.lazy import singleton
+from core.auth import Auth, psk_cache, cache_psk, auth_seconds
+from core.heartbeat import Heartbeat, check as check_beat, create_games_async, upsert_pings_async
+from core.leaderboard import kill_buffer, record_stats_async, player_id
+from core.output import encode
+from core.serverlist import ServerList
+from core.versions import versions
+from core.events import server_events, publish_updates, frame, Lagged, subscribers, \
+    subscriber_slots
+from utilities import response_encoded, response_positive, response_error, not_modified
+
+class InvalidParameter(ValueError): pass
+
+metrics.Gauges('pygsm_aiodb_pool', aiodb.pool_stats)
+
+request_seconds = metrics.Histogram('pygsm_async_request_seconds', 
+    "Time spent handling HTTP requests in the async server", ('method', 'path', 'status'))
+
+class AsyncServerList(ServerList):
+    """ Server list snapshot refreshed through asyncpg """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self._async_lock = asyncio.Lock()
+
+    async def get_async(self, dev = False):
+        """ ServerList.get for the event loop """
+
+        await self.update_async()
+
+        return self.shuffled(dev)
+
+    async def update_async(self):
+        """ ServerList.update for the event loop """
+
+        if self.stale():
+
+            # Only one task refreshes.  The others keep serving the old 
+            # snapshot unless there is none yet.
+            if self.taken_at is None or not self._async_lock.locked():
+                async with self._async_lock:
+                    if self.stale():
+                        self.dirty = False
+                        seq = server_events().seq
+                        async with aiodb.pool.acquire() as conn:
+                            self.load(await conn.fetch(queries.catalog['live_servers'].numbered, 
+                                settings['SERVER_TIMEOUT']), seq)
+
+@singleton
+def server_list():
+    """ The server list of this process """
+    return AsyncServerList(settings['SERVER_LIST_MAX_AGE'], settings['SERVER_LIST_MIN_AGE'])
+
+""" Request helpers """
+
+def respond(content, status = 200):
+    """ Send a response built by the utilities response functions """
+
+    if not isinstance(content, bytes):
+        content = encode(content)
+
+    return web.Response(body=content, status=status, 
+        content_type='application/json', charset='utf-8')
+
+def negotiated(request, response):
+    """ Re-encode and compress a JSON response like the output.api format 
+        does for pygsm.py """
+
+    media, coding = output.negotiate(request.headers.get('Accept'), 
+        request.headers.get('Accept-Encoding'))
+
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+
+    if media == 'msgpack':
+        response.body = output.pack(response.body)
+        response.content_type = 'application/msgpack'
+
+    if coding and len(response.body) >= settings['OUTPUT_COMPRESS_MIN_SIZE']:
+        response.body = output.compress(response.body, coding)
+        response.headers['Content-Encoding'] = coding
+
+def unauthorized():
+    """ The response hug sends when authentication fails """
+
+    return respond({ 'errors': { 'Authentication Required': 
+        'Please provide valid X-Api-Key credentials' } }, status=401)
+
+async def get_params(request):
+    """ Query string parameters merged with a form or JSON body """
+
+    params = dict(request.query)
+
+    if request.method == 'POST' and request.can_read_body:
+        if request.content_type == 'application/json':
+            body = await request.json()
+            if isinstance(body, dict):
+                params.update(body)
+        else:
+            params.update(await request.post())
+
+    return params
+
+def param(params, name, convert, default = InvalidParameter):
+    """ Get and convert a parameter like hug's types would """
+
+    value = params.get(name)
+
+    if value is None or value == '':
+        if default is InvalidParameter:
+            raise InvalidParameter({ name: "Required parameter '%s' not supplied" % name })
+        return default
+
+    try:
+        return convert(value)
+    except (TypeError, ValueError) as e:
+        raise InvalidParameter({ name: str(e) })
+
+def boolean(value):
+    """ Same as hug.types.boolean """
+    if isinstance(value, str):
+        return value.lower() not in ('', 'false', '0', 'no', 'off')
+    return bool(value)
+
+async def authenticate(request, required = True):
+    """ Authenticate the request's PSK.  Returns the Auth or None if 
+        authentication failed. """
+
+    start = time.perf_counter()
+    psk = request.headers.get('X-Api-Key')
+    auth = Auth(psk)
+
+    if not psk:
+        if required:
+            return None
+        auth.authenticate()
+        return auth
+
+    if not auth.validate(settings['AUTH_PSK_FORMAT']):
+        psk_entry = False
+    else:
+        psk_entry = psk_cache().get(psk)
+
+        if psk_entry is None:
+            async with aiodb.pool.acquire() as conn:
+                row = await conn.fetchrow(queries.catalog['psk'].numbered, psk)
+            psk_entry = cache_psk(psk, row)
+
+    if not auth.load(psk_entry):
+        auth_seconds.observe(time.perf_counter() - start, 'failed')
+        log.info("Authentication failed")
+        return None
+
+    auth_seconds.observe(time.perf_counter() - start, 'success')
+    return auth
+
+@web.middleware
+async def handle_request(request, handler):
+    """ Time requests and turn parameter errors into hug style errors """
+
+    start = time.perf_counter()
+
+    try:
+        response = await handler(request)
+    except InvalidParameter as e:
+        response = respond({ 'errors': e.args[0] }, status=400)
+
+    if isinstance(response, web.Response) and isinstance(response.body, bytes) \
+        and response.content_type == 'application/json':
+        negotiated(request, response)
+
+    path = request.path if request.match_info.route.resource else '<unknown>'
+    request_seconds.observe(time.perf_counter() - start, request.method, 
+        path, str(response.status))
+
+    return response
+
+""" Endpoints """
+
+routes = web.RouteTableDef()
+
+@routes.route('*', '/auth-test')
+async def auth_test(request):
+    """ Simple authentication test """
+
+    if request.method not in ('GET', 'POST'):
+        raise web.HTTPMethodNotAllowed(request.method, ['GET', 'POST'])
+
+    if not await authenticate(request):
+        return unauthorized()
+
+    return respond(response_positive("Success"))
+
+@routes.get('/server')
+async def server(request):
+    """ Get active servers """
+
+    auth = await authenticate(request, required=False)
+
+    if auth is None:
+        return unauthorized()
+
+    params = await get_params(request)
+    dev = param(params, 'dev', boolean, False)
+
+    if auth.anonymous and dev:
+        return respond(response_error("Permission denied", code=403))
+
+    filters = {
+        'game_uuid': param(params, 'game_uuid', uuid.UUID, None),
+        'free': param(params, 'free', boolean, False),
+        'name': param(params, 'name', str, None),
+        'region': param(params, 'region', str, None),
+        'limit': param(params, 'limit', int, None),
+    }
+
+    if filters['limit'] is not None and filters['limit'] < 1:
+        return respond(response_error("limit must be at least 1", code=400))
+
+    await server_list().update_async()
+
+    etag, modified = server_list().validators(dev)
+    headers = { 'ETag': etag, 'Last-Modified': formatdate(modified, usegmt=True) }
+
+    if not_modified(etag, modified, request.headers.get('If-None-Match'), 
+        request.headers.get('If-Modified-Since')):
+        return web.Response(status=304, headers=headers)
+
+    servers = server_list().shuffled(dev, **filters)
+
+    if servers:
+        response = respond(response_encoded(servers))
+    else:
+        response = respond(response_error("No servers found", 404))
+
+    response.headers.update(headers)
+
+    return response
+
+@routes.get('/server/events')
+async def server_events_stream(request):
+    """ Stream the active servers and their changes """
+
+    auth = await authenticate(request, required=False)
+
+    if auth is None:
+        return unauthorized()
+
+    params = await get_params(request)
+    dev = param(params, 'dev', boolean, False)
+
+    if auth.anonymous and dev:
+        return respond(response_error("Permission denied", code=403))
+
+    if not subscriber_slots().acquire(blocking=False):
+        return respond(response_error("Too many subscribers", code=503))
+
+    subscribers.inc()
+
+    try:
+        await send_server_events(request, dev)
+    finally:
+        subscriber_slots().release()
+
+async def send_server_events(request, dev):
+    """ Send the server list followed by its changes until the client 
+        disconnects """
+
+    # Resume after the last event the client saw, if this process sent it 
+    # and it is still buffered
+    seq = server_events().parse_id(request.headers.get('Last-Event-ID'))
+
+    response = web.StreamResponse(headers={ 'Cache-Control': 'no-cache' })
+    response.content_type = 'text/event-stream'
+    response.charset = 'utf-8'
+    await response.prepare(request)
+
+    resync_at = time.monotonic() + settings['EVENTS_RESYNC']
+
+    while True:
+
+        if settings['EVENTS_RESYNC'] and time.monotonic() >= resync_at:
+            seq = None
+
+        if seq is None:
+            servers = await server_list().get_async(dev)
+            seq = min(server_list().seq, server_events().seq)
+            resync_at = time.monotonic() + settings['EVENTS_RESYNC']
+            await response.write(frame(server_events().event_id(seq), 'snapshot', b'[' + b', '.join(servers) + b']'))
+
+        timeout = settings['EVENTS_KEEPALIVE']
+        if settings['EVENTS_RESYNC']:
+            timeout = max(0, min(timeout, resync_at - time.monotonic()))
+
+        try:
+            frames, last = await server_events().wait_async(seq, dev, timeout)
+        except Lagged:
+            server_list().invalidate()
+            seq = None
+            continue
+
+        if frames:
+            await response.write(b''.join(frames))
+        elif last == seq:
+            await response.write(b': keepalive\n\n')
+
+        seq = last
+
+@routes.post('/server')
+async def ping(request):
+    """ Add/update new server """
+
+    auth = await authenticate(request)
+
+    if auth is None:
+        return unauthorized()
+
+    params = await get_params(request)
+
+    beat = Heartbeat(
+        hostname = param(params, 'hostname', str),
+        port = param(params, 'port', int),
+        name = param(params, 'name', str),
+        active = param(params, 'activePlayers', int),
+        max = param(params, 'maxPlayers', int, 8),
+        dev = auth.development,
+        game_uuid = param(params, 'game_uuid', uuid.UUID, None),
+        region = param(params, 'region', str, None),
+    )
+
+    try:
+        check_beat(beat)
+    except ValueError as e:
+        return respond(response_error(str(e), code=400))
+
+    log.info("ping(hostname: %s, port: %s, name: %s, activePlayers: %s, game_uuid: %s, maxPlayers: %s, region: %s, dev: %s)" % (beat.hostname, beat.port, beat.name, beat.active, beat.game_uuid, beat.max, beat.region, beat.dev))
+
+    async with aiodb.pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+
+                # create a new game entry
+                errmsg = "Could not create new game."
+                beats, new_games = await create_games_async(conn, [beat])
+
+                # add or update ping
+                errmsg = "Internal pygsm error. See logs for more details."
+                written = await upsert_pings_async(conn, beats)
+
+        except Exception as e:
+            log.error(str(e))
+            return respond(response_error(errmsg))
+
+    if written:
+        server_list().invalidate()
+        publish_updates(written)
+    if new_games:
+        versions().bump('game')
+
+    return respond(response_positive("Ping successful!"))
+
+@routes.post('/register-kill')
+async def register_kill(request):
+    """ Register a kill for leaderboard update """
+
+    if not await authenticate(request):
+        return unauthorized()
+
+    params = await get_params(request)
+    alive_game_player_id = param(params, 'alive_game_player_id', int)
+    dead_game_player_id = param(params, 'dead_game_player_id', int, None)
+
+    # sanity check
+    if not alive_game_player_id and not dead_game_player_id:
+        return respond(response_error("Invalid parameters", code=400))
+
+    try:
+        for game_player_id in (alive_game_player_id, dead_game_player_id):
+            if game_player_id:
+                player_id(game_player_id)
+    except ValueError as e:
+        return respond(response_error(str(e), code=400))
+
+    if settings['LEADERBOARD_WRITE_BEHIND']:
+        if alive_game_player_id:
+            kill_buffer().add(alive_game_player_id, kills=1)
+        if dead_game_player_id:
+            kill_buffer().add(dead_game_player_id, deaths=1)
+        return respond(response_positive("Successfully queued player stats."))
+
+    error_code = 500
+    error_messages = []
+
+    updates = (
+        (alive_game_player_id, (1, 0), "Player kill increment failed! Invalid game_player_id?"),
+        (dead_game_player_id, (0, 1), "Player death increment failed! Invalid game_player_id?"),
+    )
+
+    async with aiodb.pool.acquire() as conn:
+
+        for game_player_id, delta, errmsg in updates:
+
+            if not game_player_id:
+                continue
+
+            try:
+                async with conn.transaction():
+                    written = await record_stats_async(conn, {game_player_id: delta})
+            except Exception as e:
+                log.error(str(e))
+                error_messages.append("Internal pygsm error. See logs for more details.")
+                continue
+
+            if written < 1:
+                log.error(errmsg)
+                error_code = 400
+                error_messages.append(errmsg)
+            else:
+                versions().bump('leaderboard')
+
+    if error_messages:
+        return respond(response_error(' '.join(error_messages), code=error_code))
+    else:
+        return respond(response_positive("Successfully updated player stats."))
+
+@routes.get('/metrics')
+async def metrics_text(request):
+    """ Prometheus metrics """
+
+    return web.Response(text=metrics.render(), 
+        content_type='text/plain', charset='utf-8')
+
+""" Application """
+
+async def on_startup(app):
+    await aiodb.connect()
+
+async def on_cleanup(app):
+    await aiodb.close()
+
+def create_app(config_path = 'pygsm.cfg'):
+    """ Load the config and create the aiohttp application.  Raises 
+        ConfigError if the config is missing or invalid. """
+
+    config.load(config_path)
+
+    app = web.Application(middlewares=[handle_request])
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    return app
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description="pygsm async server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--config', default='pygsm.cfg')
+    args = parser.parse_args(argv)
+
+    try:
+        app = create_app(args.config)
+    except ConfigError as e:
+        print("ERROR: %s" % e)
+        return 1
+
+    web.run_app(app, host=args.host, port=args.port)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
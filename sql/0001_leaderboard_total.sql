@@ -0,0 +1,19 @@
+-- Kill and death totals per player.  pygsm keeps these up to date on 
+-- every leaderboard write so /leaderboard does not have to sum up the 
+-- whole leaderboard table.
+--
+-- The existing leaderboard rows are summed up below.  To recompute the 
+-- totals later, run `python manage.py rebuild-totals`.
+-- 
+
+CREATE TABLE leaderboard_total (
+    game_player_id int PRIMARY KEY REFERENCES game_player (game_player_id),
+    kills int DEFAULT 0 NOT NULL,
+    deaths int DEFAULT 0 NOT NULL,
+    updated_at timestamp DEFAULT NOW() NOT NULL
+);
+
+INSERT INTO leaderboard_total (game_player_id, kills, deaths, updated_at)
+SELECT game_player_id, SUM(kills), SUM(deaths), now()
+FROM leaderboard
+GROUP BY game_player_id;
@@ -0,0 +1,19 @@
+-- Ranking support for the aggregate leaderboard.  The game and dev flag 
+-- of each player are copied to leaderboard_total so the rankings can be 
+-- read straight from an index.
+-- 
+
+ALTER TABLE leaderboard_total ADD COLUMN game_uuid uuid;
+ALTER TABLE leaderboard_total ADD COLUMN dev boolean;
+
+UPDATE leaderboard_total t SET game_uuid = gp.game_uuid, dev = g.dev
+FROM game_player gp 
+JOIN game g USING (game_uuid)
+WHERE gp.game_player_id = t.game_player_id;
+
+ALTER TABLE leaderboard_total ALTER COLUMN game_uuid SET NOT NULL;
+
+CREATE INDEX leaderboard_total__game_uuid__idx ON leaderboard_total (game_uuid);
+CREATE INDEX leaderboard_total__kills__idx ON leaderboard_total (dev, kills, game_player_id);
+CREATE INDEX leaderboard_total__deaths__idx ON leaderboard_total (dev, deaths, game_player_id);
+CREATE INDEX leaderboard_total__kd__idx ON leaderboard_total (dev, (kills::float8 / GREATEST(deaths, 1)), game_player_id);
@@ -0,0 +1,4 @@
+-- Index for paginating the game list by (stamp, game_uuid)
+-- 
+
+CREATE INDEX game__dev__stamp__idx ON game (dev, stamp, game_uuid);
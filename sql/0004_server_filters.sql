@@ -0,0 +1,14 @@
+-- Region of a server, for filtering GET /server
+-- 
+
+ALTER TABLE ping ADD COLUMN region varchar;
+
+-- The server list refresh and the reaper only look at servers that are up
+-- 
+
+CREATE INDEX ping__live__idx ON ping (ping) WHERE down = false;
+
+-- Finding the servers of a game, also used when pruning games
+-- 
+
+CREATE INDEX ping__game_uuid__idx ON ping (game_uuid);
@@ -0,0 +1,129 @@
+-- Range partitioning of game and leaderboard by time, so expired games
+-- and leaderboard rows can be dropped a partition at a time instead of
+-- deleted row by row, and queries on recent games only touch recent
+-- partitions.  Requires PostgreSQL 11 or newer.  This one is optional:
+-- pygsm works with the plain tables too.
+-- 
+-- The existing tables become the game_legacy and leaderboard_legacy
+-- partitions, which cover everything up to the end of this month, so no
+-- rows have to be copied here.  Split them up into monthly partitions
+-- afterwards with `python manage.py partitions --migrate`.
+-- 
+-- Partitions for the coming months are created by the maintenance task
+-- (see the Maintenance section of pygsm.cfg) or by running
+-- `python manage.py partitions`.  One of those must run at least once per
+-- partition_interval, or writes fail once the last partition is full.
+-- 
+-- A foreign key can not point at a partitioned table, so the ones to
+-- game (game_uuid) are replaced by triggers that check the game exists
+-- and lock it the same way.
+-- 
+
+CREATE FUNCTION game_exists() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM game WHERE game_uuid = NEW.game_uuid FOR KEY SHARE;
+
+    IF NOT FOUND THEN
+        RAISE foreign_key_violation USING MESSAGE = format(
+            'insert or update on table "%s" violates foreign key: Key (game_uuid)=(%s) is not present in table "game"',
+            TG_TABLE_NAME, NEW.game_uuid);
+    END IF;
+
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE ping DROP CONSTRAINT ping_game_uuid_fkey;
+ALTER TABLE game_player DROP CONSTRAINT game_player_game_uuid_fkey;
+
+-- Every heartbeat sets game_uuid, so updates are only checked when it 
+-- actually changes.  The lookup can not be narrowed to one partition.
+CREATE CONSTRAINT TRIGGER ping__game_uuid__fkey
+    AFTER INSERT ON ping
+    FOR EACH ROW EXECUTE PROCEDURE game_exists();
+CREATE CONSTRAINT TRIGGER ping__game_uuid__fkey_update
+    AFTER UPDATE OF game_uuid ON ping
+    FOR EACH ROW WHEN (OLD.game_uuid IS DISTINCT FROM NEW.game_uuid)
+    EXECUTE PROCEDURE game_exists();
+CREATE CONSTRAINT TRIGGER game_player__game_uuid__fkey
+    AFTER INSERT ON game_player
+    FOR EACH ROW EXECUTE PROCEDURE game_exists();
+CREATE CONSTRAINT TRIGGER game_player__game_uuid__fkey_update
+    AFTER UPDATE OF game_uuid ON game_player
+    FOR EACH ROW WHEN (OLD.game_uuid IS DISTINCT FROM NEW.game_uuid)
+    EXECUTE PROCEDURE game_exists();
+
+-- game
+-- 
+
+ALTER TABLE game RENAME TO game_legacy;
+ALTER INDEX game_pkey RENAME TO game_legacy_pkey;
+ALTER INDEX game__stamp__idx RENAME TO game_legacy__stamp__idx;
+ALTER INDEX game__dev__stamp__idx RENAME TO game_legacy__dev__stamp__idx;
+
+-- game_uuid can only be unique together with the partition key, so pygsm
+-- serializes inserts of the same game itself (see core/heartbeat.py)
+CREATE TABLE game (
+    game_uuid uuid DEFAULT uuid_generate_v4() NOT NULL,
+    stamp timestamp DEFAULT NOW() NOT NULL,
+    dev boolean DEFAULT TRUE,
+    PRIMARY KEY (game_uuid, stamp)
+) PARTITION BY RANGE (stamp);
+CREATE INDEX game__stamp__idx ON game (stamp);
+CREATE INDEX game__dev__stamp__idx ON game (dev, stamp, game_uuid);
+
+-- leaderboard
+-- 
+-- Existing rows are dated by their game.
+-- 
+
+ALTER TABLE leaderboard ADD COLUMN IF NOT EXISTS stamp timestamp;
+
+UPDATE leaderboard l SET stamp = g.stamp
+FROM game_player gp
+JOIN game_legacy g USING (game_uuid)
+WHERE gp.game_player_id = l.game_player_id;
+
+UPDATE leaderboard SET stamp = now() WHERE stamp IS NULL;
+
+ALTER TABLE leaderboard ALTER COLUMN stamp SET NOT NULL;
+ALTER TABLE leaderboard RENAME TO leaderboard_legacy;
+ALTER INDEX leaderboard_pkey RENAME TO leaderboard_legacy_pkey;
+ALTER INDEX leaderboard__game_player_id__idx RENAME TO leaderboard_legacy__game_player_id__idx;
+ALTER SEQUENCE leaderboard_leaderboard_id_seq OWNED BY NONE;
+
+CREATE TABLE leaderboard (
+    leaderboard_id int DEFAULT nextval('leaderboard_leaderboard_id_seq') NOT NULL,
+    game_player_id int REFERENCES game_player (game_player_id) NOT NULL,
+    kills int NOT NULL,
+    deaths int NOT NULL,
+    stamp timestamp DEFAULT NOW() NOT NULL,
+    PRIMARY KEY (leaderboard_id, stamp)
+) PARTITION BY RANGE (stamp);
+CREATE INDEX leaderboard__game_player_id__idx ON leaderboard (game_player_id);
+
+ALTER SEQUENCE leaderboard_leaderboard_id_seq OWNED BY leaderboard.leaderboard_id;
+
+-- Attach the old tables, and add partitions for the next two months
+-- 
+
+DO $$
+DECLARE
+    legacy_end timestamp := date_trunc('month', now()) + interval '1 month';
+    start timestamp;
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['game', 'leaderboard'] LOOP
+
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (MINVALUE) TO (%L)',
+            t, t || '_legacy', legacy_end);
+
+        FOR i IN 0..1 LOOP
+            start := legacy_end + i * interval '1 month';
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                t || '_p' || to_char(start, 'YYYYMMDD'), t, start, start + interval '1 month');
+        END LOOP;
+
+    END LOOP;
+END
+$$;
@@ -0,0 +1,18 @@
+-- Time of every leaderboard row, so POST /register-kill/batch can store 
+-- when the kills of a replayed match log happened.  Already there when 
+-- 0005_partitioning.sql is applied.  Existing rows are dated by their 
+-- game.
+-- 
+
+ALTER TABLE leaderboard ADD COLUMN IF NOT EXISTS stamp timestamp;
+
+UPDATE leaderboard l SET stamp = g.stamp
+FROM game_player gp
+JOIN game g USING (game_uuid)
+WHERE gp.game_player_id = l.game_player_id
+AND l.stamp IS NULL;
+
+UPDATE leaderboard SET stamp = now() WHERE stamp IS NULL;
+
+ALTER TABLE leaderboard ALTER COLUMN stamp SET DEFAULT now();
+ALTER TABLE leaderboard ALTER COLUMN stamp SET NOT NULL;
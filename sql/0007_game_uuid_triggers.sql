@@ -0,0 +1,28 @@
+-- Only check game_uuid on updates that change it.  0005_partitioning.sql 
+-- used to check it on every update of ping, and every heartbeat sets it, 
+-- so each one locked its game and looked it up in every partition of 
+-- game.  Nothing to do if 0005 is not applied, or was applied after this 
+-- change.
+-- 
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['ping', 'game_player'] LOOP
+
+        IF EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = t || '__game_uuid__fkey')
+        AND NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = t || '__game_uuid__fkey_update') THEN
+
+            EXECUTE format('DROP TRIGGER %I ON %I', t || '__game_uuid__fkey', t);
+            EXECUTE format('CREATE CONSTRAINT TRIGGER %I AFTER INSERT ON %I 
+                FOR EACH ROW EXECUTE PROCEDURE game_exists()', t || '__game_uuid__fkey', t);
+            EXECUTE format('CREATE CONSTRAINT TRIGGER %I AFTER UPDATE OF game_uuid ON %I 
+                FOR EACH ROW WHEN (OLD.game_uuid IS DISTINCT FROM NEW.game_uuid) 
+                EXECUTE PROCEDURE game_exists()', t || '__game_uuid__fkey_update', t);
+
+        END IF;
+
+    END LOOP;
+END
+$$;
@@ -0,0 +1,50 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+conftest.py
+
+Shared setup for the unit tests.  They cover the code that needs no
+database, and load a config that points nowhere.
+"""
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import config
+
+@pytest.fixture(scope='session', autouse=True)
+def settings(tmp_path_factory):
+    """ Load a minimal config for the whole test session """
+
+    path = tmp_path_factory.mktemp('config') / 'pygsm.cfg'
+    path.write_text("""[Logging]
+file = %s
+level = WARNING
+
+[Database]
+hostname = localhost
+user = pygsm
+password = pygsm
+""" % (path.parent / 'pygsm.log'))
+
+    return config.load(str(path))
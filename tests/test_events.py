@@ -0,0 +1,139 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_events.py
+
+The ring buffer of server events and its event ids
+"""
+import asyncio, threading
+
+import pytest
+
+from core.events import EventBus, Lagged
+
+def test_since():
+    bus = EventBus(8)
+
+    assert bus.since(0) == ([], 0)
+
+    bus.publish('game-a', 'update', b'{"n": 1}')
+    bus.publish('game-b', 'update', b'{"n": 2}')
+    bus.publish('game-a', 'remove', b'{"n": 3}')
+
+    frames, seq = bus.since(0)
+    assert seq == 3
+    assert frames == [
+        b'id: %s-1\nevent: update\ndata: {"n": 1}\n\n' % bus.tag.encode('ascii'),
+        b'id: %s-2\nevent: update\ndata: {"n": 2}\n\n' % bus.tag.encode('ascii'),
+        b'id: %s-3\nevent: remove\ndata: {"n": 3}\n\n' % bus.tag.encode('ascii'),
+        ]
+
+    assert bus.since(1)[0] == frames[1:]
+    assert bus.since(3) == ([], 3)
+
+def test_channel():
+    bus = EventBus(8)
+
+    bus.publish('game-a', 'update', b'1')
+    bus.publish('game-b', 'update', b'2')
+    bus.publish('game-a', 'update', b'3')
+
+    frames, seq = bus.since(0, 'game-a')
+    assert seq == 3
+    assert [f.split(b'data: ')[1] for f in frames] == [b'1\n\n', b'3\n\n']
+
+    assert bus.since(1, 'game-b') == (bus.since(0, 'game-b')[0], 3)
+    assert bus.since(2, 'game-b') == ([], 3)
+
+def test_lagged():
+    bus = EventBus(4)
+
+    for n in range(6):
+        bus.publish('game', 'update', b'%d' % n)
+
+    # Events 1 and 2 fell out of the buffer
+    with pytest.raises(Lagged):
+        bus.since(0)
+    with pytest.raises(Lagged):
+        bus.since(1)
+
+    frames, seq = bus.since(2)
+    assert len(frames) == 4
+    assert seq == 6
+
+def test_wait():
+    bus = EventBus(4)
+
+    assert bus.wait(0, timeout=0.01) == ([], 0)
+
+    timer = threading.Timer(0.01, bus.publish, ('game', 'update', b'1'))
+    timer.start()
+
+    frames, seq = bus.wait(0, timeout=5)
+    timer.join()
+
+    assert seq == 1
+    assert len(frames) == 1
+
+def test_wait_async():
+    bus = EventBus(4)
+
+    async def waits():
+        assert await bus.wait_async(0, timeout=0.01) == ([], 0)
+
+        asyncio.get_event_loop().call_later(0.01, bus.publish, 'game', 'update', b'1')
+        return await bus.wait_async(0, timeout=5)
+
+    frames, seq = asyncio.run(waits())
+
+    assert seq == 1
+    assert len(frames) == 1
+
+def test_seq_at():
+    bus = EventBus(4)
+
+    assert bus.seq_at(0.0) == 0
+
+    for n in range(4):
+        bus.publish('game', 'update', b'%d' % n)
+
+    # Before everything buffered, with the buffer full: replaying lags
+    with pytest.raises(Lagged):
+        bus.since(bus.seq_at(0.0))
+
+    assert bus.seq_at(float('inf')) == 4
+
+def test_event_ids():
+    bus = EventBus(4)
+    bus.publish('game', 'update', b'1')
+    bus.publish('game', 'update', b'2')
+
+    assert bus.parse_id(bus.event_id(2)) == 2
+    assert bus.parse_id(bus.event_id(0)) == 0
+
+    # Ahead of this process, from another process or not an id at all
+    assert bus.parse_id(bus.event_id(3)) is None
+    assert bus.parse_id(EventBus(4).event_id(1)) is None
+    assert bus.parse_id('%s--1' % bus.tag) is None
+    assert bus.parse_id('%s-x' % bus.tag) is None
+    assert bus.parse_id('2') is None
+    assert bus.parse_id('') is None
+    assert bus.parse_id(None) is None
@@ -0,0 +1,53 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_heartbeat.py
+
+Checks of heartbeats before they are written
+"""
+import pytest
+
+from core import heartbeat
+from core.heartbeat import Heartbeat
+
+def beat(port = 27015, active = 0, max = 8):
+    return Heartbeat('game.example.com', port, 'Dust', active, max, False, None)
+
+@pytest.mark.parametrize('numbers', [
+    (1, 0, 0),
+    (65535, 2**31 - 1, 2**31 - 1),
+])
+def test_check(numbers):
+    assert heartbeat.check(beat(*numbers)) == beat(*numbers)
+
+@pytest.mark.parametrize('numbers', [
+    (0, 0, 8),
+    (65536, 0, 8),
+    (-1, 0, 8),
+    (27015, -1, 8),
+    (27015, 2**31, 8),
+    (27015, 0, -1),
+    (27015, 0, 2**31),
+    (True, 0, 8),
+])
+def test_check_invalid(numbers):
+    with pytest.raises(ValueError):
+        heartbeat.check(beat(*numbers))
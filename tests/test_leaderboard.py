@@ -0,0 +1,148 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_leaderboard.py
+
+Validation of kill events and the write-behind buffer
+"""
+import time, contextlib
+from datetime import datetime, timezone
+
+import psycopg2
+import pytest
+
+from core import db, leaderboard
+from core.leaderboard import KillBuffer, check_stats, event_time
+
+def test_unix_time():
+    now = time.time()
+
+    assert event_time(now) == now
+    assert event_time(int(now)) == int(now)
+
+def test_iso_8601():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    assert event_time(now.isoformat()) == now.timestamp()
+    assert event_time(now.strftime('%Y-%m-%dT%H:%M:%SZ')) == now.timestamp()
+
+    # Without a zone it is UTC
+    assert event_time(now.replace(tzinfo=None).isoformat()) == now.timestamp()
+
+@pytest.mark.parametrize('value', [
+    float('nan'),
+    float('inf'),
+    float('-inf'),
+    10**400,
+    True,
+    None,
+    [],
+    'yesterday',
+    time.time() + 3600,
+    time.time() - 365 * 86400,
+    '2016-01-01T00:00:00Z',
+])
+def test_invalid(value):
+    with pytest.raises(ValueError):
+        event_time(value)
+
+@pytest.mark.parametrize('stats', [
+    (1, 0, 0),
+    (2**31 - 1, 2**31 - 1, -2**31),
+])
+def test_check_stats(stats):
+    check_stats(*stats)
+
+@pytest.mark.parametrize('stats', [
+    (0, 1, 0),
+    (-1, 1, 0),
+    (2**31, 1, 0),
+    (True, 1, 0),
+    (1, 2**31, 0),
+    (1, 0, -2**31 - 1),
+    (1, 1.5, 0),
+])
+def test_check_stats_invalid(stats):
+    with pytest.raises(ValueError):
+        check_stats(*stats)
+
+class Database(object):
+    """ Stands in for record_stats.  Rejects bad players like an integer 
+        overflow would, or fails to connect while down. """
+
+    def __init__(self, bad = (), unknown = ()):
+        self.bad = set(bad)
+        self.unknown = set(unknown)
+        self.down = False
+        self.rows = {}
+
+    def record_stats(self, db_cursor, deltas):
+
+        if self.down:
+            raise psycopg2.OperationalError("server closed the connection")
+
+        if self.bad & set(deltas):
+            raise psycopg2.DataError("integer out of range")
+
+        written = dict((p, d) for p, d in deltas.items() if p not in self.unknown)
+        self.rows.update(written)
+
+        return len(written)
+
+@pytest.fixture
+def database(monkeypatch):
+    database = Database(bad=(3, 6), unknown=(7, ))
+
+    monkeypatch.setattr(leaderboard, 'record_stats', database.record_stats)
+    monkeypatch.setattr(db, 'transaction', contextlib.nullcontext)
+
+    return database
+
+def test_flush(database):
+    buffer = KillBuffer()
+
+    for game_player_id in range(1, 9):
+        buffer.deltas[game_player_id] = (game_player_id, 1)
+    buffer.events = 8
+
+    # The players the database rejects are dropped without the others
+    assert buffer.flush() == 5
+    assert sorted(database.rows) == [1, 2, 4, 5, 8]
+    assert database.rows[4] == (4, 1)
+
+    stats = buffer.stats()
+    assert stats['dropped'] == 3
+    assert stats['queued_players'] == 0
+    assert stats['flushed_events'] == 8
+
+def test_flush_requeues(database):
+    buffer = KillBuffer()
+    buffer.deltas = { 1: (1, 0), 2: (0, 1) }
+    buffer.events = 3
+
+    database.down = True
+    assert buffer.flush() == 0
+    assert buffer.deltas == { 1: (1, 0), 2: (0, 1) }
+    assert buffer.events == 3
+
+    database.down = False
+    assert buffer.flush() == 2
+    assert buffer.stats()['flushed_events'] == 3
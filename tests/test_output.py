@@ -0,0 +1,138 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_output.py
+
+Negotiation and compression of API responses
+"""
+import gzip, zlib
+from uuid import UUID
+from decimal import Decimal
+from datetime import datetime
+
+import pytest
+
+from core import output
+from core.config import settings
+
+@pytest.fixture
+def prefs(monkeypatch):
+    """ Change settings for a test """
+    return lambda key, value: monkeypatch.setitem(settings.values, key, value)
+
+@pytest.mark.parametrize('header, values, expected', [
+    (None, ('gzip', ), 0.0),
+    ('', ('gzip', ), 0.0),
+    ('gzip', ('gzip', ), 1.0),
+    ('GZIP;q=0.5', ('gzip', ), 0.5),
+    ('deflate, gzip;q=0.3', ('gzip', ), 0.3),
+    ('gzip;q=0', ('gzip', ), 0.0),
+    ('gzip;q=bad', ('gzip', ), 0.0),
+    ('br, x-gzip ; q=0.7', ('gzip', 'x-gzip'), 0.7),
+    ('gzip;level=1;q=0.2, gzip;q=0.4', ('gzip', ), 0.4),
+    ('identity', ('gzip', ), 0.0),
+])
+def test_quality(header, values, expected):
+    assert output.quality(header, *values) == expected
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, 'json'),
+    ('*/*', 'json'),
+    ('application/json', 'json'),
+    ('application/msgpack', 'msgpack'),
+    ('application/x-msgpack', 'msgpack'),
+    ('application/json, application/msgpack', 'json'),
+    ('application/json;q=0.5, application/msgpack', 'msgpack'),
+    ('application/msgpack;q=0', 'json'),
+])
+def test_negotiate_media(accept, expected):
+    pytest.importorskip('msgpack')
+
+    assert output.negotiate(accept, None)[0] == expected
+
+def test_msgpack_disabled(prefs):
+    prefs('OUTPUT_MSGPACK', False)
+
+    assert output.negotiate('application/msgpack', None)[0] == 'json'
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('x-gzip', 'gzip'),
+    ('deflate', 'deflate'),
+    ('gzip, deflate', 'gzip'),
+    ('gzip;q=0.5, deflate', 'deflate'),
+    ('gzip;q=0, deflate;q=0', None),
+])
+def test_negotiate_coding(accept_encoding, expected):
+    assert output.negotiate(None, accept_encoding)[1] == expected
+
+def test_compress_disabled(prefs):
+    prefs('OUTPUT_COMPRESS', False)
+
+    assert output.negotiate(None, 'gzip, deflate')[1] is None
+
+def test_compress():
+    body = b'{"results": []}' * 100
+
+    assert gzip.decompress(output.compress(body, 'gzip')) == body
+    assert zlib.decompress(output.compress(body, 'deflate')) == body
+
+def test_compress_stream():
+    chunks = [b'{"results": [', b'1, ' * 1000, b'2]}']
+
+    assert gzip.decompress(b''.join(output.compress_stream(chunks, 'gzip'))) == b''.join(chunks)
+    assert zlib.decompress(b''.join(output.compress_stream(iter([]), 'deflate'))) == b''
+
+def test_stream():
+    closed = []
+    stream = output.Stream([b'abc', b'', b'defgh'], close=lambda: closed.append(True))
+
+    assert stream.read(2) == b'ab'
+    assert stream.read() == b'cdefgh'
+    assert stream.read() == b''
+
+    stream.close()
+    stream.close()
+    assert closed == [True]
+
+def test_encode():
+    assert output.encode({'name': 'Straße', 'ping': datetime(2016, 1, 1)}) == '{"name": "Straße", "ping": "2016-01-01T00:00:00"}'.encode('utf8')
+
+    with pytest.raises(TypeError):
+        output.encode({'value': object()})
+
+def test_pack():
+    msgpack = pytest.importorskip('msgpack')
+
+    assert msgpack.unpackb(output.pack(b'{"a": [1, "b"]}'), raw=False) == {'a': [1, 'b']}
+
+    packed = output.pack({
+        'ping': datetime(2016, 1, 1),
+        'game_uuid': UUID('0b4e7a0e-5fe1-4f1e-9a3b-1c6f4a2e8d11'),
+        'kdr': Decimal('1.5'),
+        })
+    assert msgpack.unpackb(packed, raw=False) == {
+        'ping': '2016-01-01T00:00:00',
+        'game_uuid': '0b4e7a0e-5fe1-4f1e-9a3b-1c6f4a2e8d11',
+        'kdr': 1.5,
+        }
@@ -0,0 +1,94 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_prefork.py
+
+Election of the process that runs the once per host tasks
+"""
+import os, time, threading
+
+import pytest
+
+from core import prefork
+
+@pytest.fixture
+def election(monkeypatch, tmp_path):
+    """ A fresh election with a hook that records when this process leads """
+
+    led = threading.Event()
+
+    monkeypatch.setattr(prefork, 'leader_hooks', [led.set])
+    monkeypatch.setattr(prefork, 'leader_file', None)
+    monkeypatch.setattr(prefork, 'electing', False)
+
+    yield str(tmp_path / 'pygsm.leader'), led
+
+    if prefork.leader_file:
+        prefork.leader_file.close()
+
+def test_elect(election):
+    path, led = election
+
+    assert not prefork.is_leader()
+    assert prefork.elect(path)
+    assert prefork.is_leader()
+    assert led.is_set()
+
+    # Electing again does not run the hooks again
+    led.clear()
+    assert prefork.elect(path)
+    assert not led.is_set()
+
+def test_take_over(election):
+    path, led = election
+    read, write = os.pipe()
+
+    pid = os.fork()
+
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read)
+            prefork.leader_hooks = []
+            code = 0 if prefork.elect(path) else 1
+            os.write(write, b'x')
+            time.sleep(0.3)
+        finally:
+            os._exit(code)
+
+    os.close(write)
+    os.read(read, 1)
+
+    # Only one process leads while the other one holds the lock
+    assert not prefork.elect(path, retry=0.05)
+    assert not prefork.is_leader()
+    assert not led.is_set()
+
+    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+
+    assert led.wait(5)
+    assert prefork.is_leader()
+
+def test_unwritable(election, tmp_path):
+    path, led = election
+
+    assert not prefork.take_lead(str(tmp_path / 'missing' / 'pygsm.leader'))
+    assert not prefork.is_leader()
@@ -0,0 +1,70 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_pygsm.py
+
+Parameter checks of the API endpoints
+"""
+import time
+
+import pytest
+
+import pygsm
+from core.config import settings
+
+@pytest.fixture(autouse=True)
+def page_max_size(monkeypatch):
+    monkeypatch.setitem(settings.values, 'PAGE_MAX_SIZE', 50)
+
+def test_page_limit():
+    assert pygsm.page_limit(1) == 1
+    assert pygsm.page_limit(50) == 50
+
+    # The default is capped by page_max_size
+    assert pygsm.page_limit(None) == 50
+    assert pygsm.page_limit(None, default=10) == 10
+
+@pytest.mark.parametrize('limit', [0, -1, 51])
+def test_page_limit_invalid(limit):
+    with pytest.raises(ValueError):
+        pygsm.page_limit(limit)
+
+def test_kill_event():
+    now = time.time()
+
+    assert pygsm.kill_event({ 'alive_game_player_id': 1, 'dead_game_player_id': '2' }) == (1, 2, None)
+    assert pygsm.kill_event({ 'dead_game_player_id': 2**31 - 1, 'timestamp': now }) == (None, 2**31 - 1, now)
+
+@pytest.mark.parametrize('item', [
+    {},
+    { 'alive_game_player_id': 0 },
+    { 'alive_game_player_id': -1 },
+    { 'alive_game_player_id': 1, 'dead_game_player_id': -2 },
+    { 'alive_game_player_id': 2**31 },
+    { 'dead_game_player_id': '99999999999' },
+    { 'alive_game_player_id': 'one' },
+    { 'alive_game_player_id': 1, 'timestamp': float('nan') },
+    [1, 2],
+    None,
+])
+def test_kill_event_invalid(item):
+    with pytest.raises((TypeError, ValueError, AttributeError)):
+        pygsm.kill_event(item)
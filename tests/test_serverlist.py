@@ -0,0 +1,186 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_serverlist.py
+
+The in-memory snapshot of live servers and its filters
+"""
+import json, time, uuid
+from datetime import datetime
+
+import pytest
+
+from core.serverlist import ServerList, Snapshot
+
+GAME = uuid.UUID('0b4e7a0e-5fe1-4f1e-9a3b-1c6f4a2e8d11')
+OTHER = uuid.UUID('5c1d0f3a-2b7e-4c9d-8e6f-7a4b3c2d1e0f')
+
+def server(hostname, name, active, max, game_uuid = GAME, region = None, dev = False):
+    return {
+        'hostname': hostname,
+        'port': 27015,
+        'name': name,
+        'ping': datetime(2016, 1, 1),
+        'active': active,
+        'max': max,
+        'dev': dev,
+        'game_uuid': game_uuid,
+        'region': region,
+        }
+
+ROWS = [
+    server('a', 'Dust', 0, 8, region='eu'),
+    server('b', 'dusty Town', 8, 8, region='eu'),
+    server('c', 'Straße', 3, 16, region='us'),
+    server('d', 'DUST II', 1, 8, OTHER, 'us'),
+    server('e', 'Arena', 2, 4, OTHER),
+    server('dev', 'Dust', 0, 8, dev=True),
+    ]
+
+@pytest.fixture
+def snapshot():
+    return Snapshot(row for row in ROWS if not row['dev'])
+
+def hostnames(servers):
+    return sorted(json.loads(s.decode('utf8'))['hostname'] for s in servers)
+
+def test_all(snapshot):
+    assert len(snapshot) == 5
+    assert hostnames(snapshot.select()) == ['a', 'b', 'c', 'd', 'e']
+
+def test_encoded(snapshot):
+    result = json.loads(snapshot.select(name='arena')[0].decode('utf8'))
+
+    assert result == {
+        'hostname': 'e',
+        'port': 27015,
+        'name': 'Arena',
+        'ping': '2016-01-01T00:00:00',
+        'activePlayers': 2,
+        'maxPlayers': 4,
+        'game_uuid': str(OTHER),
+        'region': None,
+        }
+
+def test_game(snapshot):
+    assert hostnames(snapshot.select(game_uuid=GAME)) == ['a', 'b', 'c']
+    assert hostnames(snapshot.select(game_uuid=str(OTHER))) == ['d', 'e']
+    assert snapshot.select(game_uuid=uuid.uuid4()) == []
+
+def test_region(snapshot):
+    assert hostnames(snapshot.select(region='us')) == ['c', 'd']
+    assert snapshot.select(region='ap') == []
+
+def test_free(snapshot):
+    assert hostnames(snapshot.select(free=True)) == ['a', 'c', 'd', 'e']
+
+@pytest.mark.parametrize('prefix, expected', [
+    ('dust', ['a', 'b', 'd']),
+    ('DUST ', ['d']),
+    ('dusty', ['b']),
+    ('STRASSE', ['c']),
+    ('z', []),
+    ('\U0010ffff', []),
+])
+def test_name(snapshot, prefix, expected):
+    assert hostnames(snapshot.select(name=prefix)) == expected
+
+def test_combined(snapshot):
+    assert hostnames(snapshot.select(game_uuid=GAME, name='dust')) == ['a', 'b']
+    assert hostnames(snapshot.select(game_uuid=GAME, name='dust', free=True)) == ['a']
+    assert hostnames(snapshot.select(region='us', name='dust')) == ['d']
+    assert hostnames(snapshot.select(game_uuid=OTHER, region='eu')) == []
+
+def test_limit(snapshot):
+    assert len(snapshot.select(limit=2)) == 2
+    assert len(snapshot.select(limit=0)) == 0
+    assert len(snapshot.select(game_uuid=GAME, limit=10)) == 3
+    assert hostnames(snapshot.select(name='dust', limit=3)) == ['a', 'b', 'd']
+
+def test_etag():
+    rows = ROWS[:2]
+
+    assert Snapshot(rows).etag() == Snapshot(rows[::-1]).etag()
+    assert Snapshot(rows).etag() != Snapshot(rows[:1]).etag()
+
+@pytest.fixture
+def server_list():
+    """ A server list that refreshes from ROWS """
+
+    server_list = ServerList(max_age=60, min_age=0.05)
+
+    def refresh():
+        server_list.dirty = False
+        server_list.load(ROWS)
+
+    server_list.refresh = refresh
+
+    return server_list
+
+def test_first_read(server_list):
+    assert server_list.stale()
+    assert server_list.age() is None
+
+    assert hostnames(server_list.get()) == ['a', 'b', 'c', 'd', 'e']
+    assert hostnames(server_list.get(dev=True)) == ['dev']
+    assert server_list.refreshes == 1
+    assert not server_list.stale()
+
+def test_max_age(server_list):
+    server_list.get()
+    server_list.taken_at -= 61
+
+    assert server_list.stale()
+    server_list.get()
+    assert server_list.refreshes == 2
+
+def test_dirty(server_list):
+    server_list.get()
+    server_list.invalidate()
+
+    # Not before min_age has passed
+    server_list.get()
+    assert server_list.refreshes == 1
+
+    time.sleep(0.06)
+    server_list.get()
+    assert server_list.refreshes == 2
+    assert not server_list.dirty
+
+def test_validators(server_list):
+    server_list.get()
+    etag, modified = server_list.validators()
+
+    # Unchanged servers keep their validators
+    server_list.load(ROWS[::-1])
+    assert server_list.validators() == (etag, modified)
+
+    server_list.load(ROWS[1:])
+    assert server_list.validators()[0] != etag
+
+def test_stats(server_list):
+    server_list.get()
+
+    stats = server_list.stats()
+    assert stats['refreshes'] == 1
+    assert stats['servers'] == 5
+    assert stats['servers_dev'] == 1
+    assert 0 <= stats['age'] < 1
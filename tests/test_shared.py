@@ -0,0 +1,132 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_shared.py
+
+The shared memory blob and its lease
+"""
+import os, time
+
+import pytest
+
+from core.shared import SharedBuffer
+
+def in_child(func):
+    """ Run func in a forked child.  Returns its exit status. """
+
+    pid = os.fork()
+
+    if pid == 0:
+        try:
+            os._exit(func())
+        except BaseException:
+            os._exit(99)
+
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+def test_empty():
+    shared = SharedBuffer(4096)
+
+    assert shared.generation() == 0
+    assert shared.read() is None
+    assert not shared.dirty
+
+def test_write_read():
+    shared = SharedBuffer(4096)
+
+    assert shared.write(b'first', 1.5)
+    assert shared.read() == (2, 1.5, b'first')
+
+    assert shared.write(b'second blob', 2.5)
+    assert shared.read() == (4, 2.5, b'second blob')
+
+    # Shorter than what is left in the other half
+    assert shared.write(b'3', 3.5)
+    assert shared.read() == (6, 3.5, b'3')
+
+def test_too_large():
+    shared = SharedBuffer(4096)
+
+    assert shared.write(b'x' * shared.capacity, 1.0)
+    assert not shared.write(b'x' * (shared.capacity + 1), 2.0)
+    assert shared.read() == (2, 1.0, b'x' * shared.capacity)
+
+def test_writing():
+    shared = SharedBuffer(4096)
+    shared.write(b'data', 1.0)
+
+    # A reader never returns a blob while its header is being written
+    generation = shared.generation()
+    shared.map[0:8] = (generation + 1).to_bytes(8, 'little')
+
+    assert shared.read(retries=3) is None
+
+def test_locked():
+    shared = SharedBuffer(4096)
+    shared.lock_timeout = 0.01
+
+    with shared.lock:
+        assert not shared.write(b'data', 1.0)
+        assert not shared.claim(10.0)
+
+    assert shared.read() is None
+
+def test_dirty():
+    shared = SharedBuffer(4096)
+
+    shared.dirty = True
+    assert shared.dirty
+    assert in_child(lambda: 0 if shared.dirty else 1) == 0
+
+    assert in_child(lambda: setattr(shared, 'dirty', False) or 0) == 0
+    assert not shared.dirty
+
+def test_across_processes():
+    shared = SharedBuffer(4096)
+
+    assert in_child(lambda: 0 if shared.write(b'from child', 4.0) else 1) == 0
+    assert shared.read() == (2, 4.0, b'from child')
+
+def test_claim():
+    shared = SharedBuffer(4096)
+
+    assert shared.claim(10.0)
+
+    # The holder can renew it, another process can not take it
+    assert shared.claim(10.0)
+    assert in_child(lambda: 0 if shared.claim(10.0) else 1) == 1
+
+    # Nor give it up for this process
+    assert in_child(lambda: shared.unclaim() or 0) == 0
+    assert in_child(lambda: 0 if shared.claim(10.0) else 1) == 1
+
+    shared.unclaim()
+    assert in_child(lambda: 0 if shared.claim(10.0) else 1) == 0
+    assert not shared.claim(10.0)
+
+def test_claim_expires():
+    shared = SharedBuffer(4096)
+
+    assert in_child(lambda: 0 if shared.claim(0.05) else 1) == 0
+    assert not shared.claim(10.0)
+
+    time.sleep(0.1)
+    assert shared.claim(10.0)
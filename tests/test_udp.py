@@ -0,0 +1,69 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_udp.py
+
+The UDP heartbeat packet codec
+"""
+import uuid
+
+import pytest
+
+from core.udp import encode_heartbeat, decode_heartbeat
+
+GAME = uuid.UUID('0b4e7a0e-5fe1-4f1e-9a3b-1c6f4a2e8d11')
+
+def test_round_trip():
+    packet = encode_heartbeat('secret', 'game.example.com', 27015, 'Dust', 12, 16, GAME)
+
+    assert decode_heartbeat(packet) == ('secret', 'game.example.com', 27015, 'Dust', 12, 16, GAME)
+
+def test_new_game_and_source_address():
+    packet = encode_heartbeat('secret', '', 27015, 'Dust', 0)
+
+    psk, hostname, port, name, active, max, game_uuid = decode_heartbeat(packet)
+
+    assert hostname == ''
+    assert max == 8
+    assert game_uuid is None
+
+def test_unicode_name():
+    packet = encode_heartbeat('secret', 'host', 1, 'Ünïcode ☃', 1, 2)
+
+    assert decode_heartbeat(packet)[3] == 'Ünïcode ☃'
+
+@pytest.mark.parametrize('packet', [
+    b'',
+    b'XX\x01',
+    b'PG\x02',
+    b'PG\x01',
+    b'PG\x01\x06secr',
+])
+def test_invalid(packet):
+    with pytest.raises(ValueError):
+        decode_heartbeat(packet)
+
+def test_truncated():
+    packet = encode_heartbeat('secret', 'host', 27015, 'Dust', 1, 2)
+
+    for end in range(len(packet)):
+        with pytest.raises(ValueError):
+            decode_heartbeat(packet[:end])
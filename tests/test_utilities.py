@@ -0,0 +1,98 @@
+"""
+pygsm - A RESTful API that acts as a game server tracker
+
+Copyright (C) 2016 GoInto, LLC
+
+This file is part of pygsm.
+
+pygsm is free software: you can redistribute it and/or modify it under 
+the terms of the GNU General Public License as published by the Free 
+Software Foundation, either version 2 of the License, or (at your option)
+any later version.
+
+pygsm is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or 
+FITNESS FOR A PARTICULAR PURPOSE.
+
+See the GNU General Public License for more details. You should have 
+received a copy of the GNU General Public License along with pygsm. If 
+not, see <http://www.gnu.org/licenses/>.
+"""
+"""
+test_utilities.py
+
+Pagination cursors and streamed responses
+"""
+import json, base64, uuid
+from datetime import datetime
+
+import pytest
+
+from utilities import encode_cursor, decode_cursor, response_stream
+
+GAME = uuid.UUID('0b4e7a0e-5fe1-4f1e-9a3b-1c6f4a2e8d11')
+
+def raw_cursor(text):
+    return base64.urlsafe_b64encode(text.encode('utf8')).decode('ascii')
+
+def test_round_trip():
+    started = datetime(2016, 5, 4, 3, 2, 1, 123456)
+
+    assert decode_cursor(encode_cursor([started.isoformat(), str(GAME)]), ('timestamp', 'uuid')) == [started, GAME]
+    assert decode_cursor(encode_cursor([datetime(2016, 5, 4).isoformat()]), ('timestamp', )) == [datetime(2016, 5, 4)]
+    assert decode_cursor(encode_cursor([12.5, 7]), ('float8', 'int')) == [12.5, 7]
+    assert decode_cursor(encode_cursor([3, 7]), ('float8', 'int')) == [3.0, 7]
+
+@pytest.mark.parametrize('values, types', [
+    (['7'], ('int', )),
+    ([True], ('int', )),
+    ([1.5], ('int', )),
+    ([2**31], ('int', )),
+    ([None], ('int', )),
+    (['1.5'], ('float8', )),
+    ([False], ('float8', )),
+    ([[1]], ('float8', )),
+    ([1462330921], ('timestamp', )),
+    (['yesterday'], ('timestamp', )),
+    ([str(GAME)[:-1]], ('uuid', )),
+    ([1], ('uuid', )),
+    ([1, 2], ('int', )),
+    ([1], ('float8', 'int')),
+    ([], ('int', )),
+])
+def test_invalid_values(values, types):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(values), types)
+
+@pytest.mark.parametrize('text', ['NaN', 'Infinity', '-Infinity', '1e999'])
+def test_not_finite(text):
+    with pytest.raises(ValueError):
+        decode_cursor(raw_cursor('[%s, 1]' % text), ('float8', 'int'))
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not base64!',
+    raw_cursor('{"a": 1}'),
+    raw_cursor('7'),
+    raw_cursor('[1'),
+    base64.urlsafe_b64encode(b'[1, "\xff"]').decode('ascii'),
+    'é',
+])
+def test_invalid_cursors(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, ('int', ))
+
+@pytest.mark.parametrize('count', [0, 1, 5, 100])
+def test_response_stream(count):
+    results = [json.dumps({'n': n}).encode('utf8') for n in range(count)]
+    chunks = list(response_stream(iter(results), chunk_size=32))
+
+    assert json.loads(b''.join(chunks).decode('utf8')) == {
+        'code': 200,
+        'success': True,
+        'message': 'Success',
+        'results': [{'n': n} for n in range(count)],
+        }
+
+    # Chunks stay around chunk_size instead of holding the whole body
+    assert all(len(chunk) < 128 for chunk in chunks)
@@ -18,6 +18,14 @@ See the GNU General Public License for more details. You should have
 received a copy of the GNU General Public License along with pygsm. If 
 not, see <http://www.gnu.org/licenses/>.
 """
+import json, math, uuid, base64, binascii
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from core import metrics
+
+api_errors = metrics.Counter('pygsm_api_errors_total', 
+    "Error responses by response code", ('code', ))
 
 def exists(d, k):
     """ Check if a key exists in a dictionary """
@@ -37,6 +45,105 @@ def response(obj):
         'results': obj,
     }
 
+def response_page(obj, cursor = None):
+    """ Assemble a response for one page of results.  cursor is passed 
+        back to get the next page, and is None on the last page. """
+    page = response(obj)
+    page['cursor'] = cursor
+    return page
+
+def encode_cursor(values):
+    """ Encode keyset pagination values into an opaque cursor """
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf8')).decode('ascii')
+
+# Range of the SQL integer type
+INT4_MIN = -2**31
+INT4_MAX = 2**31 - 1
+
+def int4(value, name = 'value', minimum = INT4_MIN, maximum = INT4_MAX):
+    """ Check that value is an int from minimum to maximum, which must be 
+        within the SQL integer range.  Raises ValueError if it is not. """
+    if isinstance(value, bool) or not isinstance(value, int) or not minimum <= value <= maximum:
+        raise ValueError("%s must be an integer from %s to %s" % (name, minimum, maximum))
+    return value
+
+def cursor_int(value):
+    """ A cursor value for an int parameter """
+    return int4(value, 'cursor value')
+
+def cursor_float8(value):
+    """ A cursor value for a float8 parameter """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("not a finite number: %r" % (value, ))
+    return float(value)
+
+def cursor_timestamp(value):
+    """ A cursor value for a timestamp parameter, encoded with isoformat() """
+    if not isinstance(value, str):
+        raise ValueError("not a timestamp: %r" % (value, ))
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+
+def cursor_uuid(value):
+    """ A cursor value for a uuid parameter """
+    if not isinstance(value, str):
+        raise ValueError("not a uuid: %r" % (value, ))
+    return uuid.UUID(value)
+
+# Checks for the values of a cursor, by the SQL type of the parameter they 
+# are passed as
+cursor_types = {
+    'int': cursor_int,
+    'float8': cursor_float8,
+    'timestamp': cursor_timestamp,
+    'uuid': cursor_uuid,
+}
+
+def decode_cursor(cursor, types):
+    """ Decode a cursor made by encode_cursor.  types are the SQL types of 
+        the values, as in the casts of core/queries.py.  Returns the values 
+        converted to those types.  Raises ValueError if it is invalid. """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8'))
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor: %s" % e)
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+
+    try:
+        return [cursor_types[t](value) for t, value in zip(types, values)]
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor: %s" % e)
+
+def response_encoded(results):
+    """ Assemble a response from a list of already JSON encoded results """
+    return b''.join((
+        b'{"code": 200, "success": true, "message": "Success", "results": [',
+        b', '.join(results),
+        b']}',
+    ))
+
+def response_stream(results, chunk_size = 65536):
+    """ Assemble a response from an iterable of already JSON encoded 
+        results, yielded in chunks of about chunk_size bytes """
+    chunk = [b'{"code": 200, "success": true, "message": "Success", "results": [']
+    size = 0
+    separator = b''
+
+    for result in results:
+        chunk.append(separator)
+        chunk.append(result)
+        separator = b', '
+        size += len(result)
+
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+
+    chunk.append(b']}')
+    yield b''.join(chunk)
+
 def response_positive(message, code = 200):
     """ Assemble a generic positive response """
     return {
@@ -48,9 +155,29 @@ def response_positive(message, code = 200):
 
 def response_error(message, code = 500):
     """ Assemble an error response """
+    api_errors.inc(code)
     return {
         'code': code,
         'success': False,
         'message': message,
         'results': None,
-    }
\ No newline at end of file
+    }
+
+def not_modified(etag, modified = None, if_none_match = None, if_modified_since = None):
+    """ Whether a GET with the given If-None-Match and If-Modified-Since 
+        headers can be answered with a 304.  modified is a Unix time. """
+
+    # Weak comparison, and If-Modified-Since only counts without ETags
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag.replace('W/', '') in (tag.replace('W/', '') for tag in tags)
+
+    if modified and if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+
+        return int(modified) <= since
+
+    return False
\ No newline at end of file